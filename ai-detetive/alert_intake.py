@@ -0,0 +1,270 @@
+"""
+告警合并入口
+功能：对告警的问题描述计算指纹（异常类、调用栈、服务名、归一化文本），
+时间窗口内指纹相同的告警合并为同一个排查（singleflight）：第一条告警发起排查，
+后续告警订阅同一个结果；一次故障触发的大量告警只产生与不同问题数量相当的排查和LLM开销
+"""
+import asyncio
+import hashlib
+import logging
+import re
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 默认合并窗口（秒）
+DEFAULT_COALESCE_WINDOW = 300.0
+
+# 指纹中保留的调用栈帧数（从栈顶开始）
+MAX_FINGERPRINT_FRAMES = 5
+
+# 异常类名，如 java.lang.NullPointerException、ValueError
+_EXCEPTION_PATTERN = re.compile(r"\b((?:[A-Za-z_$][\w$]*\.)*[A-Z][\w$]*(?:Exception|Error))\b")
+
+# Java调用栈帧：at com.foo.Bar.method(Bar.java:42)
+_JAVA_FRAME_PATTERN = re.compile(r"\bat\s+([\w$.<>]+)\(")
+
+# Python调用栈帧：File "x.py", line 12, in func
+_PYTHON_FRAME_PATTERN = re.compile(r'File "([^"]+)", line \d+, in (\w+)')
+
+# 服务名：service=order-service、service: order、服务：订单服务
+_SERVICE_PATTERN = re.compile(r"(?:service|服务)\s*[=:：]\s*([\w.\-一-鿿]+)", re.IGNORECASE)
+
+# 文本归一化时替换为占位符的可变部分
+_VARIABLE_PATTERNS = [
+    (re.compile(r"\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}:\d{2}(?:[.,]\d+)?"), "<time>"),
+    (re.compile(r"\b[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}\b", re.IGNORECASE), "<uuid>"),
+    (re.compile(r"\b\d{1,3}(?:\.\d{1,3}){3}(?::\d+)?\b"), "<ip>"),
+    (re.compile(r"\b0x[0-9a-f]+\b|\b[0-9a-f]{16,}\b", re.IGNORECASE), "<hex>"),
+    (re.compile(r"'[^']*'|\"[^\"]*\""), "<str>"),
+    (re.compile(r"\d+"), "<num>"),
+]
+
+
+def normalize_alert_text(text: str) -> str:
+    """
+    归一化告警文本：时间、ID、IP、数字、引号内容替换为占位符，合并空白
+
+    Args:
+        text: 告警文本
+
+    Returns:
+        归一化后的文本
+    """
+    text = text.strip().lower()
+    for pattern, placeholder in _VARIABLE_PATTERNS:
+        text = pattern.sub(placeholder, text)
+    return " ".join(text.split())
+
+
+def alert_signature(text: str) -> Dict:
+    """
+    提取告警特征
+
+    Args:
+        text: 告警的问题描述
+
+    Returns:
+        {"service", "exceptions", "frames", "text"}
+    """
+    frames = _JAVA_FRAME_PATTERN.findall(text)
+    frames += [f"{path}:{func}" for path, func in _PYTHON_FRAME_PATTERN.findall(text)]
+    service = _SERVICE_PATTERN.search(text)
+    return {
+        "service": service.group(1).lower() if service else "",
+        "exceptions": sorted(set(_EXCEPTION_PATTERN.findall(text))),
+        "frames": frames[:MAX_FINGERPRINT_FRAMES],
+        "text": normalize_alert_text(text),
+    }
+
+
+def alert_fingerprint(text: str) -> str:
+    """
+    计算告警指纹：有调用栈，或有异常类且有服务名时按（服务、异常类、栈顶帧）计算，
+    与告警标题、级别等措辞无关；只有异常类时异常类不足以区分问题
+    （如不同业务的 NullPointerException），同时加入归一化文本；否则按归一化文本计算
+
+    Args:
+        text: 告警的问题描述
+
+    Returns:
+        指纹（16位十六进制）
+    """
+    signature = alert_signature(text)
+    exceptions = ",".join(signature["exceptions"])
+    if signature["frames"] or (signature["exceptions"] and signature["service"]):
+        key = "|".join([signature["service"], exceptions, ",".join(signature["frames"])])
+    elif signature["exceptions"]:
+        key = "|".join([signature["service"], exceptions, signature["text"]])
+    else:
+        key = "|".join([signature["service"], signature["text"]])
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+
+@dataclass
+class _Flight:
+    """同一指纹的一次排查"""
+
+    fingerprint: str
+    problem_description: str
+    started_at: float
+    future: object
+    alerts: List[str] = field(default_factory=list)
+
+
+def _flight_failed(future) -> bool:
+    """排查是否已失败结束（抛出异常、被取消或返回 status 为 error 的结果）"""
+    if future is None or not future.done():
+        return False
+    if future.cancelled() or future.exception() is not None:
+        return True
+    result = future.result()
+    return isinstance(result, dict) and result.get("status") == "error"
+
+
+class AlertCoalescer:
+    """
+    告警合并入口（singleflight）
+
+    用法：
+        coalescer = AlertCoalescer(coordinator, window_seconds=300)
+        future = coalescer.submit(alert_text)        # 同步：concurrent.futures.Future
+        result = await coalescer.asubmit(alert_text)  # 异步
+    """
+
+    def __init__(self, coordinator, window_seconds: float = DEFAULT_COALESCE_WINDOW,
+                 max_rounds: int = 3, max_workers: int = 8):
+        """
+        初始化告警合并入口
+
+        Args:
+            coordinator: CoordinatorAgent 实例
+            window_seconds: 合并窗口（秒），从该指纹第一条告警发起排查开始计算
+            max_rounds: 每个排查的最大轮数
+            max_workers: 同步提交时并发执行的排查数
+        """
+        self.coordinator = coordinator
+        self.window_seconds = window_seconds
+        self.max_rounds = max_rounds
+        self.max_workers = max_workers
+        self._flights: Dict[str, _Flight] = {}
+        self._async_flights: Dict[str, _Flight] = {}
+        self._lock = threading.RLock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._stats = {"alerts": 0, "investigations": 0, "coalesced": 0}
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                        thread_name_prefix="alert-investigation")
+        return self._executor
+
+    def _join(self, flights: Dict[str, _Flight], problem_description: str) -> Tuple[_Flight, bool]:
+        """
+        查找同指纹、进行中或在窗口内成功结束的排查并加入；没有时返回新建的排查（需持有锁）。
+        失败的排查不再合并，之后的同指纹告警重新发起排查
+
+        Returns:
+            (排查, 是否为新建)
+        """
+        now = time.monotonic()
+        fingerprint = alert_fingerprint(problem_description)
+        self._stats["alerts"] += 1
+
+        # 清理已失败、或已结束且超出窗口的排查
+        for key in [key for key, flight in flights.items()
+                    if _flight_failed(flight.future)
+                    or (now - flight.started_at > self.window_seconds and flight.future.done())]:
+            del flights[key]
+
+        flight = flights.get(fingerprint)
+        if flight is not None:
+            flight.alerts.append(problem_description)
+            self._stats["coalesced"] += 1
+            logger.info(f"告警合并到排查 {fingerprint}（共 {len(flight.alerts)} 条告警）")
+            return flight, False
+
+        self._stats["investigations"] += 1
+        logger.info(f"告警发起新排查 {fingerprint}")
+        flight = _Flight(fingerprint, problem_description, now, None, [problem_description])
+        flights[fingerprint] = flight
+        return flight, True
+
+    def _with_alerts(self, flight: _Flight, result: Dict) -> Dict:
+        return dict(result or {}, alert_fingerprint=flight.fingerprint, coalesced_alerts=len(flight.alerts))
+
+    def submit(self, problem_description: str) -> Future:
+        """
+        提交告警（同步）
+
+        Args:
+            problem_description: 告警的问题描述
+
+        Returns:
+            Future，结果为 investigate 的返回值，附加 alert_fingerprint 和 coalesced_alerts
+        """
+        with self._lock:
+            flight, created = self._join(self._flights, problem_description)
+            if created:
+                flight.future = Future()
+                self.executor.submit(self._run, flight)
+            subscriber = Future()
+            flight.future.add_done_callback(lambda done: self._resolve(flight, done, subscriber))
+        return subscriber
+
+    def _run(self, flight: _Flight) -> None:
+        try:
+            flight.future.set_result(self.coordinator.investigate(flight.problem_description,
+                                                                  max_rounds=self.max_rounds))
+        except Exception as e:
+            flight.future.set_exception(e)
+
+    def _resolve(self, flight: _Flight, done: Future, subscriber: Future) -> None:
+        if done.exception() is not None:
+            subscriber.set_exception(done.exception())
+        else:
+            subscriber.set_result(self._with_alerts(flight, done.result()))
+
+    async def asubmit(self, problem_description: str) -> Dict:
+        """
+        提交告警（异步）并等待排查结果；同指纹的告警共享同一个 ainvestigate 任务
+
+        Args:
+            problem_description: 告警的问题描述
+
+        Returns:
+            investigate 的返回值，附加 alert_fingerprint 和 coalesced_alerts
+        """
+        with self._lock:
+            flight, created = self._join(self._async_flights, problem_description)
+            if created:
+                flight.future = asyncio.ensure_future(
+                    self.coordinator.ainvestigate(flight.problem_description, max_rounds=self.max_rounds)
+                )
+        # shield：单个订阅者被取消时不影响其他订阅者共享的排查
+        result = await asyncio.shield(flight.future)
+        return self._with_alerts(flight, result)
+
+    def stats(self) -> Dict:
+        """
+        合并统计
+
+        Returns:
+            {"alerts": 收到的告警数, "investigations": 发起的排查数, "coalesced": 被合并的告警数, "active": 窗口内的排查数}
+        """
+        with self._lock:
+            return dict(self._stats, active=len(self._flights) + len(self._async_flights))
+
+    def shutdown(self, wait: bool = False) -> None:
+        """关闭排查线程池"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
@@ -0,0 +1,227 @@
+"""
+排查编排基准测试（离线）
+功能：使用模拟大模型（fake_llm）运行 CoordinatorAgent.investigate / ainvestigate，
+在不同并发数下统计吞吐量、排查耗时的 p50/p99 和内存占用，用于衡量编排开销和并发表现，不调用真实接口
+
+用法：
+    python benchmark.py                                              # 默认：进程内模拟模型，并发 1,10,50
+    python benchmark.py --concurrency 1,10,100,500 --latency lognormal:0.8,0.5
+    python benchmark.py --mode http --async --concurrency 100        # 经过HTTP模拟接口，异步排查
+    python benchmark.py --latency fixed:0 --concurrency 1            # 无模型延迟，只测编排开销
+    python benchmark.py --mode replay --cassette real.jsonl --timing # 回放真实排查的录像（见 cassette.py）
+"""
+import argparse
+import asyncio
+import gc
+import json
+import logging
+import resource
+import statistics
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import llm_client
+from coordinator_agent import CoordinatorAgent
+from cassette import Cassette
+from fake_llm import FakeChatModel, FakeOpenAIServer, LatencyDistribution, ScriptedTranscript
+
+# 默认问题描述（参考 example.py）
+DEFAULT_PROBLEM = "订单创建失败，错误提示为'数据校验失败'，traceId=4bf92f3577b34da6"
+
+
+def percentile(values: List[float], q: float) -> float:
+    """
+    分位数（线性插值）
+
+    Args:
+        values: 数值列表
+        q: 分位（0-1）
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def _max_rss_mb() -> float:
+    """进程的峰值常驻内存（MB）"""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 单位为KB，macOS 为字节
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def _run_one(coordinator: CoordinatorAgent, problem: str, max_rounds: int) -> Dict:
+    started = time.perf_counter()
+    result = coordinator.investigate(problem, max_rounds=max_rounds)
+    return {"latency": time.perf_counter() - started, "ok": result.get("status") == "success",
+            "rounds": result.get("rounds_completed", 0)}
+
+
+async def _arun_all(coordinator: CoordinatorAgent, problem: str, max_rounds: int,
+                    total: int, concurrency: int) -> List[Dict]:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one() -> Dict:
+        async with semaphore:
+            started = time.perf_counter()
+            result = await coordinator.ainvestigate(problem, max_rounds=max_rounds)
+            return {"latency": time.perf_counter() - started, "ok": result.get("status") == "success",
+                    "rounds": result.get("rounds_completed", 0)}
+
+    return await asyncio.gather(*[one() for _ in range(total)])
+
+
+def _begin_level() -> float:
+    gc.collect()
+    tracemalloc.start()
+    return time.perf_counter()
+
+
+def _level_result(concurrency: int, runs: List[Dict], started: float) -> Dict:
+    seconds = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    total = len(runs)
+    latencies = [run["latency"] for run in runs]
+    return {
+        "concurrency": concurrency,
+        "investigations": total,
+        "errors": sum(not run["ok"] for run in runs),
+        "seconds": round(seconds, 3),
+        "throughput": round(total / seconds, 2) if seconds else 0.0,
+        "p50": round(percentile(latencies, 0.5), 3),
+        "p99": round(percentile(latencies, 0.99), 3),
+        "mean_rounds": round(statistics.mean(run["rounds"] for run in runs), 2) if runs else 0.0,
+        "peak_python_mb": round(peak / (1024 * 1024), 1),
+        "max_rss_mb": round(_max_rss_mb(), 1),
+    }
+
+
+def run_level(coordinator: CoordinatorAgent, concurrency: int, total: int, problem: str = DEFAULT_PROBLEM,
+              max_rounds: int = 3) -> Dict:
+    """
+    在指定并发数下执行 total 次排查（每个排查占用一个线程）
+
+    Args:
+        coordinator: 协调者Agent
+        concurrency: 并发排查数
+        total: 排查总数
+        problem: 问题描述
+        max_rounds: 最大排查轮数
+
+    Returns:
+        {"concurrency", "investigations", "errors", "seconds", "throughput", "p50", "p99", "mean_rounds",
+         "peak_python_mb", "max_rss_mb"}
+    """
+    started = _begin_level()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="benchmark") as executor:
+        runs = list(executor.map(lambda _: _run_one(coordinator, problem, max_rounds), range(total)))
+    return _level_result(concurrency, runs, started)
+
+
+async def arun_level(coordinator: CoordinatorAgent, concurrency: int, total: int, problem: str = DEFAULT_PROBLEM,
+                     max_rounds: int = 3) -> Dict:
+    """
+    run_level 的异步版本，使用 ainvestigate，并发数由信号量控制
+
+    多个并发级别需在同一个事件循环中执行：模型客户端按配置缓存，其异步连接池绑定在创建它的事件循环上
+    """
+    started = _begin_level()
+    runs = await _arun_all(coordinator, problem, max_rounds, total, concurrency)
+    return _level_result(concurrency, runs, started)
+
+
+def format_results(results: List[Dict]) -> str:
+    """结果表格"""
+    header = f"{'并发':>6}{'排查数':>8}{'失败':>6}{'耗时(s)':>10}{'吞吐(次/s)':>12}{'p50(s)':>9}{'p99(s)':>9}" \
+             f"{'轮数':>6}{'Python峰值MB':>14}{'RSS峰值MB':>11}"
+    lines = [header]
+    for result in results:
+        lines.append(f"{result['concurrency']:>8}{result['investigations']:>11}{result['errors']:>8}"
+                     f"{result['seconds']:>10}{result['throughput']:>14}{result['p50']:>9}{result['p99']:>9}"
+                     f"{result['mean_rounds']:>8}{result['peak_python_mb']:>16}{result['max_rss_mb']:>13}")
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="排查编排基准测试（模拟大模型）")
+    parser.add_argument("--concurrency", default="1,10,50", help="并发数列表，逗号分隔（1-500）")
+    parser.add_argument("--investigations", type=int, default=0,
+                        help="每个并发级别的排查数，默认为并发数的2倍（至少10）")
+    parser.add_argument("--latency", default="lognormal:0.5,0.3",
+                        help="模型延迟分布：fixed:S | uniform:A,B | normal:MU,SIGMA | lognormal:MEDIAN,SIGMA")
+    parser.add_argument("--mode", choices=["inprocess", "http", "replay"], default="inprocess",
+                        help="inprocess：进程内模拟模型；http：本地OpenAI兼容模拟接口；replay：回放录像")
+    parser.add_argument("--cassette", help="replay 模式使用的录像文件（example.py --record 录制）")
+    parser.add_argument("--timing", action="store_true", help="replay 模式下按录制时的耗时回放")
+    parser.add_argument("--problem", help="问题描述，replay 模式默认使用录像中的第一个排查")
+    parser.add_argument("--async", dest="use_async", action="store_true", help="使用 ainvestigate")
+    parser.add_argument("--transcript", help="排查脚本JSON文件（格式见 fake_llm.py）")
+    parser.add_argument("--max-rounds", type=int, default=3)
+    parser.add_argument("--enable-cache", action="store_true", help="启用collector缓存（默认关闭，每次排查都完整执行）")
+    parser.add_argument("--no-pre-route", action="store_true", help="关闭预路由（对比第一轮省去的规划调用）")
+    parser.add_argument("--seed", type=int, default=None, help="延迟分布的随机种子")
+    parser.add_argument("--json", action="store_true", help="以JSON输出结果")
+    args = parser.parse_args(argv)
+
+    logging.getLogger().setLevel(logging.WARNING)
+    levels = [int(value) for value in args.concurrency.split(",") if value]
+    cassette = None
+    transcript = ScriptedTranscript.load(args.transcript) if args.transcript else ScriptedTranscript()
+    latency = LatencyDistribution.parse(args.latency, seed=args.seed)
+
+    server = None
+    problem = args.problem or DEFAULT_PROBLEM
+    if args.mode == "replay":
+        if not args.cassette:
+            parser.error("replay 模式需要 --cassette")
+        cassette = Cassette(args.cassette, timing=args.timing)
+        if not args.problem and cassette.problems:
+            problem = cassette.problems[0]["problem"]
+        llm_client.set_cassette(cassette)
+        base_url = "http://cassette"
+    elif args.mode == "http":
+        server = FakeOpenAIServer(transcript, latency).start()
+        base_url = server.base_url
+    else:
+        llm_client.set_chat_model_factory(
+            lambda **kwargs: FakeChatModel(transcript=transcript, latency=latency, model_name=kwargs["model"])
+        )
+        base_url = "http://fake"
+
+    try:
+        coordinator = CoordinatorAgent("fake-key", base_url, collector_workers=max(32, max(levels) * 3),
+                                       enable_cache=args.enable_cache,
+                                       enable_pre_route=not args.no_pre_route, cassette=cassette)
+
+        async def arun_levels() -> List[Dict]:
+            return [await arun_level(coordinator, concurrency, args.investigations or max(10, concurrency * 2),
+                                     problem, args.max_rounds) for concurrency in levels]
+
+        if args.use_async:
+            results = asyncio.run(arun_levels())
+        else:
+            results = [run_level(coordinator, concurrency, args.investigations or max(10, concurrency * 2),
+                                 problem, args.max_rounds) for concurrency in levels]
+    finally:
+        if server is not None:
+            server.stop()
+        llm_client.set_chat_model_factory(None)
+        if cassette is not None:
+            llm_client.set_cassette(None)
+
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+    else:
+        print(format_results(results))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,243 @@
+"""
+排查预算
+功能：为单次排查设置token、耗时和collector调用次数上限，协调者和子Agent的每次LLM调用、
+每次collector调用都从同一预算中扣除；截止时间传递给子Agent，预算将尽时协调者停止调用工具，
+直接基于已有信息总结，使最慢的排查也有可预期的上限
+"""
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Optional, Sequence
+
+from langchain.agents.middleware import AgentMiddleware
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import HumanMessage
+from langchain_core.outputs import LLMResult
+from langgraph.config import get_config
+
+from resilient_transport import request_deadline
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 默认预算
+DEFAULT_MAX_TOKENS = 200_000
+DEFAULT_MAX_SECONDS = 600.0
+DEFAULT_MAX_TOOL_CALLS = 30
+
+# 任一维度剩余比例低于该值时视为预算将尽
+DEFAULT_LOW_RATIO = 0.2
+
+# 预算将尽时追加给协调者的指令
+SUMMARIZE_INSTRUCTION = "排查预算即将用完，不能再调用collector查询。请基于目前已收集到的信息直接总结根因、解决方案，并给出置信度评分。"
+
+
+class BudgetExceededError(RuntimeError):
+    """排查预算已用完"""
+
+
+@dataclass
+class InvestigationBudget:
+    """单次排查的预算（线程安全），None 表示该维度不限制"""
+
+    max_tokens: Optional[int] = DEFAULT_MAX_TOKENS
+    max_seconds: Optional[float] = DEFAULT_MAX_SECONDS
+    max_tool_calls: Optional[int] = DEFAULT_MAX_TOOL_CALLS
+    low_ratio: float = DEFAULT_LOW_RATIO
+    tokens_used: int = 0
+    tool_calls: int = 0
+    cancelled: bool = False
+    started_at: float = field(default_factory=time.monotonic)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    @property
+    def deadline(self) -> Optional[float]:
+        """截止时间（time.monotonic）"""
+        return None if self.max_seconds is None else self.started_at + self.max_seconds
+
+    def elapsed(self) -> float:
+        """已用时间（秒）"""
+        return time.monotonic() - self.started_at
+
+    def remaining_seconds(self) -> Optional[float]:
+        """剩余时间（秒），不限时为 None"""
+        return None if self.max_seconds is None else max(0.0, self.max_seconds - self.elapsed())
+
+    def exhausted_reason(self) -> Optional[str]:
+        """预算已用完的原因，未用完时返回 None"""
+        if self.cancelled:
+            return "排查已取消"
+        if self.max_seconds is not None and self.elapsed() >= self.max_seconds:
+            return f"耗时已达上限 {self.max_seconds:g} 秒"
+        if self.max_tokens is not None and self.tokens_used >= self.max_tokens:
+            return f"token已达上限 {self.max_tokens}"
+        if self.max_tool_calls is not None and self.tool_calls >= self.max_tool_calls:
+            return f"collector调用次数已达上限 {self.max_tool_calls}"
+        return None
+
+    def exhausted(self) -> bool:
+        """预算是否已用完"""
+        return self.exhausted_reason() is not None
+
+    def low(self) -> bool:
+        """任一维度剩余比例低于 low_ratio"""
+        if self.max_seconds is not None and self.elapsed() >= self.max_seconds * (1 - self.low_ratio):
+            return True
+        if self.max_tokens is not None and self.tokens_used >= self.max_tokens * (1 - self.low_ratio):
+            return True
+        if self.max_tool_calls is not None and self.tool_calls >= self.max_tool_calls * (1 - self.low_ratio):
+            return True
+        return False
+
+    def check(self) -> None:
+        """
+        检查预算
+
+        Raises:
+            BudgetExceededError: 预算已用完
+        """
+        reason = self.exhausted_reason()
+        if reason is not None:
+            raise BudgetExceededError(f"排查预算已用完: {reason}")
+
+    def cancel(self) -> None:
+        """取消排查：后续collector调用和子Agent的LLM调用都会被拒绝"""
+        self.cancelled = True
+
+    def charge_tokens(self, tokens: int) -> None:
+        """扣除LLM调用消耗的token"""
+        with self._lock:
+            self.tokens_used += tokens
+
+    def acquire_tool_call(self) -> None:
+        """
+        占用一次collector调用
+
+        Raises:
+            BudgetExceededError: 预算已用完
+        """
+        with self._lock:
+            self.check()
+            self.tool_calls += 1
+
+    def timeout(self, default: float) -> float:
+        """在剩余时间内的调用超时时间（秒）"""
+        remaining = self.remaining_seconds()
+        return default if remaining is None else min(default, remaining)
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "InvestigationBudget":
+        """
+        从 to_dict 的结果恢复预算（恢复中断的排查时使用），已用时间计入新的起始时间
+
+        Args:
+            data: to_dict 的返回值
+
+        Returns:
+            预算
+        """
+        return cls(
+            max_tokens=data.get("max_tokens"),
+            max_seconds=data.get("max_seconds"),
+            max_tool_calls=data.get("max_tool_calls"),
+            tokens_used=data.get("tokens_used", 0),
+            tool_calls=data.get("tool_calls", 0),
+            started_at=time.monotonic() - data.get("seconds_used", 0.0)
+        )
+
+    def to_dict(self) -> Dict:
+        """导出预算使用情况"""
+        return {
+            "max_tokens": self.max_tokens,
+            "max_seconds": self.max_seconds,
+            "max_tool_calls": self.max_tool_calls,
+            "tokens_used": self.tokens_used,
+            "seconds_used": round(self.elapsed(), 3),
+            "tool_calls": self.tool_calls,
+            "exhausted": self.exhausted_reason()
+        }
+
+
+def _usage_tokens(response: LLMResult) -> int:
+    """从LLM返回结果中读取消耗的token数"""
+    tokens = 0
+    for generations in response.generations:
+        for generation in generations:
+            usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if usage:
+                tokens += usage.get("total_tokens", 0)
+    if not tokens and response.llm_output:
+        tokens = (response.llm_output.get("token_usage") or {}).get("total_tokens", 0) or 0
+    return tokens
+
+
+class BudgetCallbackHandler(BaseCallbackHandler):
+    """
+    LLM调用回调：记录token消耗；enforce 为 True 时在预算用完后中止后续LLM调用
+    （用于子Agent，协调者自身通过 BudgetMiddleware 转为总结）
+    """
+
+    raise_error = True
+    # 异步调用时在事件循环中直接执行，预算检查的异常才能中止本次LLM调用
+    run_inline = True
+
+    def __init__(self, budget: InvestigationBudget, enforce: bool = True):
+        self.budget = budget
+        self.enforce = enforce
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages, **kwargs: Any) -> None:
+        if self.enforce:
+            self.budget.check()
+
+    def on_llm_start(self, serialized: Dict[str, Any], prompts, **kwargs: Any) -> None:
+        if self.enforce:
+            self.budget.check()
+
+    def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+        self.budget.charge_tokens(_usage_tokens(response))
+
+
+class BudgetMiddleware(AgentMiddleware):
+    """
+    预算将尽时，协调者的模型调用不再提供collector工具（保留 keep_tools，如提交结论），并要求直接总结；
+    模型请求（含重试）不晚于预算截止时间结束
+    """
+
+    def __init__(self, get_budget: Callable[[Optional[Dict]], Optional[InvestigationBudget]],
+                 keep_tools: Sequence[str] = ()):
+        """
+        Args:
+            get_budget: 从Agent调用配置中取出当前排查预算的函数
+            keep_tools: 总结时仍然提供的工具名称
+        """
+        super().__init__()
+        self.get_budget = get_budget
+        self.keep_tools = set(keep_tools)
+
+    def _budget(self) -> Optional[InvestigationBudget]:
+        try:
+            return self.get_budget(get_config())
+        except RuntimeError:
+            return None
+
+    def _summarize_request(self, request, budget: Optional[InvestigationBudget]):
+        if budget is None or not budget.low():
+            return request
+        logger.info(f"排查预算将尽，转为总结: {budget.to_dict()}")
+        return request.override(
+            tools=[tool for tool in request.tools if getattr(tool, "name", None) in self.keep_tools],
+            tool_choice=None,
+            messages=list(request.messages) + [HumanMessage(content=SUMMARIZE_INSTRUCTION)]
+        )
+
+    def wrap_model_call(self, request, handler):
+        budget = self._budget()
+        with request_deadline(budget.deadline if budget is not None else None):
+            return handler(self._summarize_request(request, budget))
+
+    async def awrap_model_call(self, request, handler):
+        budget = self._budget()
+        with request_deadline(budget.deadline if budget is not None else None):
+            return await handler(self._summarize_request(request, budget))
@@ -0,0 +1,373 @@
+"""
+大模型与collector调用的录制回放
+功能：录制模式下把所有大模型HTTP请求（聊天补全、向量化）的请求和响应，以及collector调用结果写入录像文件（JSON lines）；
+回放模式下按请求内容匹配返回录制的结果，不访问网络、不调用子Agent，可选按录制时的耗时回放。
+用真实排查的录像离线复现排查过程，对编排、缓存和并发的改动做基准测试和回归测试
+
+录像文件每行一条记录：
+    {"kind": "investigation", "problem": "...", "max_rounds": 3}
+    {"kind": "http", "key": "...", "method": "POST", "path": "/v1/chat/completions", "request": {...},
+     "status": 200, "headers": {...}, "body": "...", "duration": 1.23}
+    {"kind": "collector", "key": "...", "tool": "log_collector", "query": "...", "result": "...", "duration": 4.56}
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import httpx
+
+from collector_cache import normalize_query
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 模式
+MODE_RECORD = "record"
+MODE_REPLAY = "replay"
+
+# 记录类型
+KIND_INVESTIGATION = "investigation"
+KIND_HTTP = "http"
+KIND_COLLECTOR = "collector"
+
+# 回放时不还原的响应头（录制时响应体已解码、完整读入）
+_DROPPED_HEADERS = {"content-encoding", "content-length", "transfer-encoding", "connection", "keep-alive"}
+
+
+def _plain_headers(headers: httpx.Headers) -> Dict[str, str]:
+    return {name: value for name, value in headers.items() if name.lower() not in _DROPPED_HEADERS}
+
+
+class CassetteMissError(LookupError):
+    """回放时录像中没有匹配的记录"""
+
+
+def _digest(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:32]
+
+
+def _request_json(body: bytes):
+    try:
+        return json.loads(body) if body else None
+    except ValueError:
+        return body.decode("utf-8", "replace")
+
+
+def request_key(method: str, path: str, body: bytes) -> str:
+    """
+    HTTP请求的匹配键：方法、接口名（路径的最后一段，回放时的 base_url 可以与录制时不同）和请求体（JSON按键排序），
+    不含请求头（API密钥、SDK版本等）
+
+    Args:
+        method: 请求方法
+        path: 请求路径
+        body: 请求体
+    """
+    endpoint = path.rstrip("/").rsplit("/", 1)[-1]
+    return _digest(f"{method} {endpoint}\n{json.dumps(_request_json(body), sort_keys=True, ensure_ascii=False)}")
+
+
+def collector_key(tool: str, query: str) -> str:
+    """collector调用的匹配键：collector名称和规范化后的查询"""
+    return _digest(f"{tool}\n{normalize_query(query)}")
+
+
+class Cassette:
+    """录像文件：录制或回放大模型HTTP请求和collector调用（线程安全）"""
+
+    def __init__(self, path: str, mode: str = MODE_REPLAY, timing: bool = False, strict: bool = True):
+        """
+        打开录像
+
+        Args:
+            path: 录像文件路径（录制模式下覆盖已有文件）
+            mode: MODE_RECORD 或 MODE_REPLAY
+            timing: 回放时是否按录制时的耗时等待后再返回
+            strict: 回放时未匹配到记录是否抛出 CassetteMissError；False 时改为真实请求或调用子Agent
+        """
+        if mode not in (MODE_RECORD, MODE_REPLAY):
+            raise ValueError(f"不支持的录像模式: {mode}")
+        self.path = path
+        self.mode = mode
+        self.timing = timing
+        self.strict = strict
+        self._lock = threading.Lock()
+        self._entries: Dict[str, List[Dict]] = defaultdict(list)
+        self._cursors: Dict[str, int] = defaultdict(int)
+        self._problems: List[Dict] = []
+        self._stats = {"recorded": 0, "replayed": 0, "misses": 0}
+        self._file = None
+        if mode == MODE_RECORD:
+            self._file = open(path, "w", encoding="utf-8")
+        else:
+            self._load()
+        logger.info(f"录像{'录制' if self.recording else '回放'}: {path}")
+
+    @property
+    def recording(self) -> bool:
+        return self.mode == MODE_RECORD
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == MODE_REPLAY
+
+    @property
+    def problems(self) -> List[Dict]:
+        """录像中的排查：[{"problem", "max_rounds"}]"""
+        return list(self._problems)
+
+    def _load(self) -> None:
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                entry = json.loads(line)
+                if entry["kind"] == KIND_INVESTIGATION:
+                    self._problems.append({"problem": entry["problem"], "max_rounds": entry.get("max_rounds")})
+                else:
+                    self._entries[entry["key"]].append(entry)
+
+    def _write(self, entry: Dict) -> None:
+        # 每条记录写入后立即落盘，录制中途进程退出时已录制的部分仍可回放
+        with self._lock:
+            self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self._file.flush()
+            self._stats["recorded"] += entry["kind"] != KIND_INVESTIGATION
+
+    def _next(self, key: str) -> Optional[Dict]:
+        """
+        取出匹配键的下一条记录：同一请求录制了多次时按录制顺序依次返回，用完后从头循环
+        （同一录像可重复回放多次排查，如基准测试）
+        """
+        with self._lock:
+            entries = self._entries.get(key)
+            if not entries:
+                self._stats["misses"] += 1
+                return None
+            entry = entries[self._cursors[key] % len(entries)]
+            self._cursors[key] += 1
+            self._stats["replayed"] += 1
+            return entry
+
+    def _miss(self, description: str) -> None:
+        if self.strict:
+            raise CassetteMissError(f"录像中没有匹配的记录: {description}")
+        logger.warning(f"录像中没有匹配的记录，改为真实调用: {description}")
+
+    def delay(self, entry: Dict) -> float:
+        """回放记录前的等待时间（秒）"""
+        return entry.get("duration", 0.0) if self.timing else 0.0
+
+    def record_investigation(self, problem_description: str, max_rounds: int) -> None:
+        """录制排查的问题描述（回放时 benchmark 等工具据此重新发起排查）"""
+        if self.recording:
+            self._write({"kind": KIND_INVESTIGATION, "problem": problem_description, "max_rounds": max_rounds})
+
+    def record_http(self, request: httpx.Request, response: httpx.Response, body: bytes, duration: float) -> None:
+        """
+        录制一次HTTP请求
+
+        Args:
+            request: 请求（请求体已读入）
+            response: 响应
+            body: 完整的响应体（流式响应为全部事件）
+            duration: 请求耗时（秒），包含重试和对冲
+        """
+        self._write({
+            "kind": KIND_HTTP,
+            "key": request_key(request.method, request.url.path, request.content),
+            "method": request.method,
+            "path": request.url.path,
+            "request": _request_json(request.content),
+            "status": response.status_code,
+            "headers": _plain_headers(response.headers),
+            "body": body.decode("utf-8", "replace"),
+            "duration": round(duration, 6),
+        })
+
+    def replay_http(self, request: httpx.Request) -> Optional[Dict]:
+        """回放HTTP请求，返回匹配的记录；未匹配时按 strict 抛出异常或返回 None"""
+        entry = self._next(request_key(request.method, request.url.path, request.content))
+        if entry is None:
+            self._miss(f"{request.method} {request.url.path}")
+        return entry
+
+    def record_collector(self, tool: str, query: str, duration: float,
+                         result: Optional[str] = None, error: Optional[str] = None) -> None:
+        """
+        录制一次collector调用（子Agent的回答或失败原因）
+
+        Args:
+            tool: collector名称
+            query: 查询要求
+            duration: 调用耗时（秒）
+            result: 子Agent回答
+            error: 失败原因（调用失败时）
+        """
+        entry = {"kind": KIND_COLLECTOR, "key": collector_key(tool, query), "tool": tool, "query": query,
+                 "duration": round(duration, 6)}
+        if error is not None:
+            entry["error"] = error
+        else:
+            entry["result"] = result
+        self._write(entry)
+
+    def replay_collector(self, tool: str, query: str) -> Optional[Dict]:
+        """回放collector调用，返回匹配的记录；未匹配时按 strict 抛出异常或返回 None"""
+        entry = self._next(collector_key(tool, query))
+        if entry is None:
+            self._miss(f"{tool}: {query}")
+        return entry
+
+    @staticmethod
+    def _collector_outcome(entry: Dict) -> str:
+        if "error" in entry:
+            raise RuntimeError(entry["error"])
+        return entry["result"]
+
+    def call_collector(self, tool: str, query: str, call: Callable[[], str]) -> str:
+        """
+        执行collector调用：回放模式下返回录制的结果，录制模式下调用并录制
+
+        Args:
+            tool: collector名称
+            query: 查询要求
+            call: 实际调用子Agent的函数
+
+        Returns:
+            子Agent回答（录制的失败会重新抛出）
+        """
+        if self.replaying:
+            entry = self.replay_collector(tool, query)
+            if entry is not None:
+                time.sleep(self.delay(entry))
+                return self._collector_outcome(entry)
+        started = time.monotonic()
+        try:
+            result = call()
+        except Exception as e:
+            if self.recording:
+                self.record_collector(tool, query, time.monotonic() - started, error=str(e))
+            raise
+        if self.recording:
+            self.record_collector(tool, query, time.monotonic() - started, result=result)
+        return result
+
+    async def acall_collector(self, tool: str, query: str, call: Callable[[], Awaitable[str]]) -> str:
+        """call_collector 的异步版本"""
+        if self.replaying:
+            entry = self.replay_collector(tool, query)
+            if entry is not None:
+                await asyncio.sleep(self.delay(entry))
+                return self._collector_outcome(entry)
+        started = time.monotonic()
+        try:
+            result = await call()
+        except Exception as e:
+            if self.recording:
+                self.record_collector(tool, query, time.monotonic() - started, error=str(e))
+            raise
+        if self.recording:
+            self.record_collector(tool, query, time.monotonic() - started, result=result)
+        return result
+
+    def transport(self, transport: httpx.BaseTransport) -> "CassetteTransport":
+        """包装同步传输层"""
+        return CassetteTransport(transport, self)
+
+    def async_transport(self, transport: httpx.AsyncBaseTransport) -> "AsyncCassetteTransport":
+        """包装异步传输层"""
+        return AsyncCassetteTransport(transport, self)
+
+    def stats(self) -> Dict[str, int]:
+        """录制、回放和未匹配的记录数"""
+        with self._lock:
+            return dict(self._stats)
+
+    def close(self) -> None:
+        """关闭录像文件"""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def __enter__(self) -> "Cassette":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+
+def _replayed_response(entry: Dict, request: httpx.Request) -> httpx.Response:
+    return httpx.Response(entry["status"], headers=entry["headers"], content=entry["body"].encode("utf-8"),
+                          request=request)
+
+
+class CassetteTransport(httpx.BaseTransport):
+    """同步传输层：录制或回放HTTP请求（包装在重试、熔断层之外，录制的是调用方最终看到的响应）"""
+
+    def __init__(self, transport: httpx.BaseTransport, cassette: Cassette):
+        self._transport = transport
+        self._cassette = cassette
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        request.read()
+        if self._cassette.replaying:
+            entry = self._cassette.replay_http(request)
+            if entry is not None:
+                time.sleep(self._cassette.delay(entry))
+                return _replayed_response(entry, request)
+
+        started = time.monotonic()
+        response = self._transport.handle_request(request)
+        if not self._cassette.recording:
+            return response
+        # 流式响应在录制时完整读入后再返回
+        try:
+            body = response.read()
+        finally:
+            response.close()
+        self._cassette.record_http(request, response, body, time.monotonic() - started)
+        return httpx.Response(response.status_code, headers=_plain_headers(response.headers), content=body,
+                              request=request)
+
+    def close(self) -> None:
+        self._transport.close()
+
+
+class AsyncCassetteTransport(httpx.AsyncBaseTransport):
+    """异步传输层：录制或回放HTTP请求"""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, cassette: Cassette):
+        self._transport = transport
+        self._cassette = cassette
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        await request.aread()
+        if self._cassette.replaying:
+            entry = self._cassette.replay_http(request)
+            if entry is not None:
+                await asyncio.sleep(self._cassette.delay(entry))
+                return _replayed_response(entry, request)
+
+        started = time.monotonic()
+        response = await self._transport.handle_async_request(request)
+        if not self._cassette.recording:
+            return response
+        try:
+            body = await response.aread()
+        finally:
+            await response.aclose()
+        self._cassette.record_http(request, response, body, time.monotonic() - started)
+        return httpx.Response(response.status_code, headers=_plain_headers(response.headers), content=body,
+                              request=request)
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
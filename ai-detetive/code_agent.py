@@ -4,11 +4,13 @@
 代码通过ssh从代码库拉取
 """
 import logging
-from langchain.chat_models import init_chat_model
+from typing import Optional
 from langchain.agents import create_agent
 from langchain.tools import tool
+from langchain_core.runnables import RunnableConfig
 import subprocess
 from prompts import get_code_agent_prompt
+from model_routing import TASK_RETRIEVAL, route_model
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
@@ -43,14 +45,8 @@ class CodeAgent:
     
     def _create_agent(self):
         """创建代码查询Agent实例"""
-        # 初始化LLM
-        llm = init_chat_model(
-            model="deepseek-chat",
-            model_provider="openai",
-            api_key=self.api_key,
-            base_url=self.base_url,
-            temperature=0,
-        )
+        # 初始化LLM（检索类任务，按模型路由选择模型层级，失败时改用后备模型）
+        routed = route_model(self.api_key, self.base_url, "code_agent", TASK_RETRIEVAL)
         
         # 定义工具
         @tool
@@ -105,10 +101,11 @@ class CodeAgent:
         
         # 创建Agent
         agent = create_agent(
-            model=llm,
+            model=routed.model,
             tools=tools,
             debug=False,
-            system_prompt=system_prompt
+            system_prompt=system_prompt,
+            middleware=routed.middleware()
         )
         
         return agent
@@ -281,12 +278,35 @@ class CodeAgent:
                 "error": str(e)
             }
     
-    def invoke(self, message: dict) -> dict:
+    def invoke(self, message: dict, config: Optional[RunnableConfig] = None) -> dict:
         """
         直接调用Agent（供外部使用）
         
         Args:
             message: 消息字典，格式: {"messages": [{"role": "user", "content": "问题内容"}]}
+            config: 调用配置（可选，协调者用于传递排查预算和截止时间）
+            
+        Returns:
+            Agent返回结果
+        """
+        logger.info(f"接收到查询请求: {message}")
+        
+        try:
+            result = self.agent.invoke(message, config=config, streaming=False)
+            logger.info("查询执行完成")
+            return result
+            
+        except Exception as e:
+            logger.error(f"查询执行失败: {str(e)}")
+            raise
+
+    async def ainvoke(self, message: dict, config: Optional[RunnableConfig] = None) -> dict:
+        """
+        直接调用Agent（异步，供外部使用）
+        
+        Args:
+            message: 消息字典，格式: {"messages": [{"role": "user", "content": "问题内容"}]}
+            config: 调用配置（可选，协调者用于传递排查预算和截止时间）
             
         Returns:
             Agent返回结果
@@ -294,7 +314,7 @@ class CodeAgent:
         logger.info(f"接收到查询请求: {message}")
         
         try:
-            result = self.agent.invoke(message, streaming=False)
+            result = await self.agent.ainvoke(message, config=config, streaming=False)
             logger.info("查询执行完成")
             return result
             
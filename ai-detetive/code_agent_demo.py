@@ -1,8 +1,10 @@
 import logging
-from langchain.chat_models import init_chat_model
+from typing import Optional
 from langchain.agents import create_agent
 from langchain.tools import tool
+from langchain_core.runnables import RunnableConfig
 from prompts import get_code_agent_prompt
+from model_routing import TASK_RETRIEVAL, route_model
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
@@ -27,13 +29,8 @@ class CodeAgent:
         logger.info("CodeAgent.__init__ ===> 代码查询Agent初始化完成")
     
     def _create_agent(self):
-        llm = init_chat_model(
-            model="deepseek-chat",
-            model_provider="openai",
-            api_key=self.api_key,
-            base_url=self.base_url,
-            temperature=0,
-        )
+        # 检索类任务，按模型路由选择模型层级，失败时改用后备模型
+        routed = route_model(self.api_key, self.base_url, "code_agent", TASK_RETRIEVAL)
         
         @tool
         def search_code_by_ssh():
@@ -46,19 +43,32 @@ class CodeAgent:
         system_prompt = get_code_agent_prompt() # 从prompts文件夹加载系统提示词
 
         agent = create_agent(  # 创建Agent
-            model=llm,
+            model=routed.model,
             tools=tools,
             debug=False,
-            system_prompt=system_prompt
+            system_prompt=system_prompt,
+            middleware=routed.middleware()
         )
         
         return agent
 
-    def invoke(self, message: dict) -> dict:
+    def invoke(self, message: dict, config: Optional[RunnableConfig] = None) -> dict:
         logger.info(f"CodeAgent.invoke ===> 接收协调者指令: {message}")
         
         try:
-            result = self.agent.invoke(message, streaming=False)
+            result = self.agent.invoke(message, config=config, streaming=False)
+            logger.info("查询执行完成")
+            return result
+            
+        except Exception as e:
+            logger.error(f"查询执行失败: {str(e)}")
+            raise
+
+    async def ainvoke(self, message: dict, config: Optional[RunnableConfig] = None) -> dict:
+        logger.info(f"CodeAgent.ainvoke ===> 接收协调者指令: {message}")
+        
+        try:
+            result = await self.agent.ainvoke(message, config=config, streaming=False)
             logger.info("查询执行完成")
             return result
             
@@ -1,14 +1,17 @@
 import logging
+from typing import Optional
 import faiss
 import numpy as np
 import pickle
 
 from langchain_core.tools import Tool
 from openai import OpenAI
-from langchain.chat_models import init_chat_model
 from langchain.agents import create_agent
 from langchain.tools import tool
+from langchain_core.runnables import RunnableConfig
 from prompts import get_code_agent_prompt
+from llm_client import get_http_client
+from model_routing import TASK_RETRIEVAL, route_model
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
@@ -33,7 +36,8 @@ class CodeAgent:
         
         # 初始化向量模型客户端
         if self.embedding_api_key and self.embedding_base_url:
-            self.embedding_client = OpenAI(api_key=self.embedding_api_key, base_url=self.embedding_base_url)
+            self.embedding_client = OpenAI(api_key=self.embedding_api_key, base_url=self.embedding_base_url,
+                                           http_client=get_http_client())
         else:
             self.embedding_client = None
         
@@ -62,13 +66,8 @@ class CodeAgent:
     
     def _create_agent(self):
         """创建DeepSeek大模型Agent"""
-        llm = init_chat_model(
-            model="deepseek-chat",
-            model_provider="openai",
-            api_key=self.api_key,
-            base_url=self.base_url,
-            temperature=0,
-        )
+        # 检索类任务，按模型路由选择模型层级，失败时改用后备模型
+        routed = route_model(self.api_key, self.base_url, "code_agent", TASK_RETRIEVAL)
         
         @tool
         def search_code_by_faiss(query: str) -> str:
@@ -109,10 +108,11 @@ class CodeAgent:
         """
 
         agent = create_agent(  # 创建Agent
-            model=llm,
+            model=routed.model,
             tools=tools,
             debug=False,
-            system_prompt=system_prompt
+            system_prompt=system_prompt,
+            middleware=routed.middleware()
         )
         
         return agent
@@ -183,11 +183,23 @@ class CodeAgent:
         """
         return self._search_code(query)
 
-    def invoke(self, message: dict) -> dict:
+    def invoke(self, message: dict, config: Optional[RunnableConfig] = None) -> dict:
         print(f"CodeAgent.invoke ===> 接收协调者指令: {message}")
         
         try:
-            result = self.agent.invoke(message, streaming=False)
+            result = self.agent.invoke(message, config=config, streaming=False)
+            logger.info("查询执行完成")
+            return result
+            
+        except Exception as e:
+            logger.error(f"查询执行失败: {str(e)}")
+            raise
+
+    async def ainvoke(self, message: dict, config: Optional[RunnableConfig] = None) -> dict:
+        print(f"CodeAgent.ainvoke ===> 接收协调者指令: {message}")
+        
+        try:
+            result = await self.agent.ainvoke(message, config=config, streaming=False)
             logger.info("查询执行完成")
             return result
             
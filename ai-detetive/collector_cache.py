@@ -0,0 +1,152 @@
+"""
+collector结果缓存
+功能：在每个collector前增加缓存，按 (collector名称, 归一化后的查询) 命中；
+LRU淘汰 + 按collector区分的有效期（数据库状态变化快、代码变化慢），并统计命中率
+"""
+import logging
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 默认最大缓存条数
+DEFAULT_MAX_ENTRIES = 1024
+
+# 各collector结果的有效期（秒）
+DEFAULT_TTLS = {
+    "db_collector": 60,
+    "log_collector": 300,
+    "dld_collector": 1800,
+    "prd_collector": 3600,
+    "code_collector": 3600,
+}
+
+# 未配置的collector使用的有效期（秒）
+DEFAULT_TTL = 300
+
+# 归一化时去掉的空白：只保留两个英文单词字符之间的空白（压缩为一个空格），
+# 运算符、数字和小数点都保留在键中（a > 1 与 a < 1、1.5 与 15 不能视为同一查询）
+_SPACE_PATTERN = re.compile(r"\s+")
+_DROPPED_SPACE_PATTERN = re.compile(r"(?<![A-Za-z0-9_]) | (?![A-Za-z0-9_])")
+
+
+def normalize_query(query: str) -> str:
+    """
+    归一化查询文本：全角转半角，去掉不影响含义的空白
+    （中文查询中空格位置随意，"查询 user_table 状态" 与 "查询user_table状态" 视为同一查询）；
+    标点、运算符和大小写都保留，只有写法完全等价的查询才共用缓存
+
+    Args:
+        query: 原始查询
+
+    Returns:
+        归一化后的查询
+    """
+    text = _SPACE_PATTERN.sub(" ", unicodedata.normalize("NFKC", query).strip())
+    return _DROPPED_SPACE_PATTERN.sub("", text)
+
+
+class CollectorCache:
+    """collector结果缓存（线程安全）"""
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES,
+                 ttls: Optional[Dict[str, float]] = None):
+        """
+        初始化缓存
+
+        Args:
+            max_entries: 最大缓存条数，超出后淘汰最久未使用的条目
+            ttls: collector名称 -> 有效期（秒），覆盖默认配置
+        """
+        self.max_entries = max_entries
+        self.ttls = dict(DEFAULT_TTLS)
+        if ttls:
+            self.ttls.update(ttls)
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    def _count(self, name: str, metric: str) -> None:
+        stats = self._stats.setdefault(name, {"hits": 0, "misses": 0, "expired": 0, "evictions": 0})
+        stats[metric] += 1
+
+    def get(self, name: str, query: str) -> Optional[str]:
+        """
+        查询缓存
+
+        Args:
+            name: collector名称
+            query: 查询要求
+
+        Returns:
+            缓存的结果，未命中或已过期时返回 None
+        """
+        key = (name, normalize_query(query))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._count(name, "misses")
+                return None
+            expires_at, result = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self._count(name, "expired")
+                self._count(name, "misses")
+                return None
+            self._entries.move_to_end(key)
+            self._count(name, "hits")
+            return result
+
+    def put(self, name: str, query: str, result: str) -> None:
+        """
+        写入缓存
+
+        Args:
+            name: collector名称
+            query: 查询要求
+            result: 查询结果
+        """
+        ttl = self.ttls.get(name, DEFAULT_TTL)
+        if ttl <= 0:
+            return
+        key = (name, normalize_query(query))
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                (evicted_name, _), _ = self._entries.popitem(last=False)
+                self._count(evicted_name, "evictions")
+
+    def invalidate(self, name: Optional[str] = None) -> None:
+        """
+        清除缓存
+
+        Args:
+            name: collector名称，为空时清除全部
+        """
+        with self._lock:
+            if name is None:
+                self._entries.clear()
+            else:
+                for key in [key for key in self._entries if key[0] == name]:
+                    del self._entries[key]
+
+    def stats(self) -> Dict:
+        """
+        缓存命中统计
+
+        Returns:
+            {"size": 条数, "collectors": {名称: {hits, misses, expired, evictions, hit_rate}}}
+        """
+        with self._lock:
+            collectors = {}
+            for name, stats in self._stats.items():
+                total = stats["hits"] + stats["misses"]
+                collectors[name] = dict(stats, hit_rate=round(stats["hits"] / total, 3) if total else 0.0)
+            return {"size": len(self._entries), "collectors": collectors}
@@ -0,0 +1,183 @@
+"""
+采集工具并发执行池
+功能：协调者在同一轮中调用的多个 *_collector 并发执行，每个调用有独立超时，
+结果按调用顺序返回；整轮耗时约等于最慢的一个采集工具，而不是所有工具耗时之和
+
+超时从调用真正开始执行时计时，在队列中等待空闲线程的时间不计入。
+线程中正在执行的调用无法被取消：超时后该线程仍被卡住的调用占用，直到调用自行返回。
+为避免卡住的线程逐渐占满线程池，发生超时后新的调用提交到新建的线程池，
+旧线程池在队列中的调用执行完后退出（卡住的线程在调用返回后退出）；
+当前仍被超时调用占用的线程数通过 stuck_workers 查看
+"""
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Any, Callable, Optional
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 默认并发数
+DEFAULT_MAX_WORKERS = 8
+
+# 默认单个采集工具超时时间（秒）
+DEFAULT_COLLECTOR_TIMEOUT = 120.0
+
+# 调用在队列中等待执行时，检查是否已开始执行的间隔（秒）
+QUEUE_POLL_INTERVAL = 0.05
+
+
+class CollectorTimeoutError(TimeoutError):
+    """采集工具执行超时"""
+
+    def __init__(self, name: str, timeout: float):
+        super().__init__(f"{name}执行超时（{timeout:.1f}秒）")
+        self.name = name
+        self.timeout = timeout
+
+
+class _Call:
+    """提交到线程池的一次调用，记录开始执行的时间"""
+
+    def __init__(self, pool: "CollectorPool", name: str, func: Callable[..., Any], args: tuple, kwargs: dict):
+        self.pool = pool
+        self.name = name
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.started_at: Optional[float] = None
+        # 以下两个标记只在持有 pool._lock 时读写：
+        # abandoned 表示已超时，执行结束时释放占用的线程计数；finished 表示已执行结束
+        self.abandoned = False
+        self.finished = False
+        self.future: Optional[Future] = None
+
+    def __call__(self) -> Any:
+        self.started_at = time.monotonic()
+        try:
+            return self.func(*self.args, **self.kwargs)
+        finally:
+            self.pool._finish(self)
+
+
+class CollectorPool:
+    """采集工具线程池，供协调者Agent的各个collector共享"""
+
+    def __init__(self, max_workers: int = DEFAULT_MAX_WORKERS,
+                 default_timeout: float = DEFAULT_COLLECTOR_TIMEOUT):
+        """
+        初始化执行池
+
+        Args:
+            max_workers: 最大并发数
+            default_timeout: 默认单个调用超时时间（秒）
+        """
+        self.max_workers = max_workers
+        self.default_timeout = default_timeout
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._stuck_workers = 0
+        # 因超时而更换的线程池数
+        self.replaced = 0
+
+    def _ensure_executor(self) -> ThreadPoolExecutor:
+        """首次使用或更换时创建线程池（调用方持有锁）"""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers,
+                thread_name_prefix="collector"
+            )
+        return self._executor
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        """首次使用时创建线程池"""
+        with self._lock:
+            return self._ensure_executor()
+
+    @property
+    def stuck_workers(self) -> int:
+        """仍被已超时的调用占用的线程数"""
+        with self._lock:
+            return self._stuck_workers
+
+    def _submit(self, name: str, func: Callable[..., Any], args: tuple, kwargs: dict) -> _Call:
+        call = _Call(self, name, func, args, kwargs)
+        # 与更换线程池互斥，避免提交到已关闭的线程池
+        with self._lock:
+            call.future = self._ensure_executor().submit(call)
+        return call
+
+    def _finish(self, call: _Call) -> None:
+        """调用执行结束；已超时放弃的调用释放占用的线程计数"""
+        with self._lock:
+            call.finished = True
+            if not call.abandoned:
+                return
+            self._stuck_workers -= 1
+            stuck = self._stuck_workers
+        logger.info(f"{call.name}超时的调用已返回，释放线程（仍卡住 {stuck} 个）")
+
+    def _abandon(self, call: _Call, timeout: float) -> CollectorTimeoutError:
+        """
+        放弃已超时的调用：未开始的直接取消；已在执行的无法中断，
+        之后的调用改为提交到新线程池，避免卡住的线程占满线程池
+        """
+        if call.future.cancel():
+            return CollectorTimeoutError(call.name, timeout)
+        with self._lock:
+            # 与 _finish 在同一把锁下判断是否已结束，保证计数只在调用返回时释放一次
+            if call.finished:
+                return CollectorTimeoutError(call.name, timeout)
+            call.abandoned = True
+            self._stuck_workers += 1
+            stuck = self._stuck_workers
+            if self._executor is not None:
+                # 旧线程池不再接收新调用，空闲线程在队列清空后退出
+                self._executor.shutdown(wait=False)
+                self._executor = None
+                self.replaced += 1
+        logger.warning(f"{call.name}执行超时: {timeout}秒（仍卡住 {stuck} 个线程，已更换线程池）")
+        return CollectorTimeoutError(call.name, timeout)
+
+    def _result(self, call: _Call, timeout: float) -> Any:
+        """等待调用结果，超时从调用开始执行时计时"""
+        while True:
+            if call.started_at is None:
+                wait = QUEUE_POLL_INTERVAL
+            else:
+                wait = call.started_at + timeout - time.monotonic()
+                if wait <= 0:
+                    raise self._abandon(call, timeout)
+            try:
+                return call.future.result(timeout=wait)
+            except FutureTimeoutError:
+                continue
+
+    def run(self, name: str, func: Callable[..., Any], *args,
+            timeout: Optional[float] = None, **kwargs) -> Any:
+        """
+        在线程池中执行单个采集调用并等待结果
+
+        Args:
+            name: 采集工具名称（用于日志和超时信息）
+            func: 实际执行的函数
+            timeout: 超时时间（秒），默认使用 default_timeout
+
+        Returns:
+            func 的返回值
+
+        Raises:
+            CollectorTimeoutError: 超时
+        """
+        timeout = self.default_timeout if timeout is None else timeout
+        return self._result(self._submit(name, func, args, kwargs), timeout)
+
+    def shutdown(self, wait: bool = False) -> None:
+        """关闭线程池"""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait, cancel_futures=True)
+                self._executor = None
@@ -0,0 +1,133 @@
+"""
+排查会话记忆
+功能：多轮排查在同一个会话线程（checkpointer）中继续，模型能看到之前各轮的工具结果，
+不再重复调用collector；会话变长后，较早的工具结果在发送给模型前压缩为摘要，
+使提示词长度保持有界（完整结果仍保存在排查上下文的 actions_taken 中）
+"""
+import re
+from dataclasses import dataclass
+from typing import List, Sequence
+
+from langchain.agents.middleware import ContextEditingMiddleware
+from langchain.agents.middleware.context_editing import ContextEdit, TokenCounter
+from langchain_core.messages import AIMessage, AnyMessage, BaseMessage, ToolMessage
+
+# 触发压缩的会话token数
+DEFAULT_CONTEXT_TOKEN_LIMIT = 8000
+
+# 保留原文的最近工具结果数
+DEFAULT_KEEP_TOOL_RESULTS = 5
+
+# 工具结果摘要的最大字符数
+DEFAULT_SUMMARY_CHARS = 300
+
+# 中文字符（约1个token一个字）
+_CJK_PATTERN = re.compile(r"[一-鿿　-〿＀-￯]")
+
+
+def estimate_text_tokens(text: str) -> int:
+    """
+    估算文本token数：中文按每字1个token，其余按每4个字符1个token
+
+    Args:
+        text: 文本
+
+    Returns:
+        估算的token数
+    """
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def estimate_tokens(messages: Sequence[BaseMessage]) -> int:
+    """
+    估算消息列表的token数（langchain 自带的近似计数对中文偏低）
+
+    Args:
+        messages: 消息列表
+
+    Returns:
+        估算的token数
+    """
+    total = 0
+    for message in messages:
+        content = message.content if isinstance(message.content, str) else str(message.content)
+        total += estimate_text_tokens(content) + 4
+        if isinstance(message, AIMessage):
+            for tool_call in message.tool_calls:
+                total += estimate_text_tokens(str(tool_call.get("args", ""))) + 4
+    return total
+
+
+def compact_tool_result(content: str, summary_chars: int = DEFAULT_SUMMARY_CHARS) -> str:
+    """
+    将工具结果压缩为摘要：保留开头若干完整行
+
+    Args:
+        content: 工具结果原文
+        summary_chars: 摘要最大字符数
+
+    Returns:
+        摘要文本
+    """
+    lines: List[str] = []
+    size = 0
+    for line in content.strip().splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if size + len(line) > summary_chars:
+            if not lines:
+                lines.append(line[:summary_chars])
+            break
+        lines.append(line)
+        size += len(line)
+    return "[较早的结果已压缩] " + "\n".join(lines) + f"\n……（原文 {len(content)} 字符）"
+
+
+@dataclass
+class CompactToolResultsEdit(ContextEdit):
+    """会话超过token上限时，将最近 keep 条以外的工具结果压缩为摘要"""
+
+    trigger: int = DEFAULT_CONTEXT_TOKEN_LIMIT
+    keep: int = DEFAULT_KEEP_TOOL_RESULTS
+    summary_chars: int = DEFAULT_SUMMARY_CHARS
+
+    def apply(self, messages: List[AnyMessage], *, count_tokens: TokenCounter) -> None:
+        if count_tokens(messages) <= self.trigger:
+            return
+
+        positions = [i for i, message in enumerate(messages) if isinstance(message, ToolMessage)]
+        if self.keep:
+            positions = positions[:-self.keep]
+
+        for i in positions:
+            message = messages[i]
+            content = message.content if isinstance(message.content, str) else str(message.content)
+            if message.response_metadata.get("compacted") or len(content) <= self.summary_chars:
+                continue
+            messages[i] = message.model_copy(update={
+                "content": compact_tool_result(content, self.summary_chars),
+                "artifact": None,
+                "response_metadata": {**message.response_metadata, "compacted": True},
+            })
+            if count_tokens(messages) <= self.trigger:
+                break
+
+
+def create_memory_middleware(context_token_limit: int = DEFAULT_CONTEXT_TOKEN_LIMIT,
+                             keep_tool_results: int = DEFAULT_KEEP_TOOL_RESULTS) -> ContextEditingMiddleware:
+    """
+    创建会话压缩中间件
+
+    Args:
+        context_token_limit: 触发压缩的会话token数
+        keep_tool_results: 保留原文的最近工具结果数
+
+    Returns:
+        ContextEditingMiddleware
+    """
+    return ContextEditingMiddleware(
+        edits=[CompactToolResultsEdit(trigger=context_token_limit, keep=keep_tool_results)],
+        token_counter=estimate_tokens,
+    )
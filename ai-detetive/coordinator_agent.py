@@ -4,12 +4,20 @@
 包含5个tools：db_collector、dld_collector、log_collector、prd_collector、code_collector
 每个tool内部调用对应的agent
 """
+import asyncio
 import logging
-from typing import Dict, List, Optional
-from langchain.chat_models import init_chat_model
+import threading
+import time
+import uuid
+from typing import AsyncIterator, Dict, Iterator, List, Optional
 from langchain.agents import create_agent
-from langchain.tools import tool
+from langchain_core.messages import AIMessage, ToolMessage
+from langchain_core.tools import StructuredTool
+from langchain_core.runnables import RunnableConfig
+from langchain_core.runnables.config import get_executor_for_config
+from langgraph.checkpoint.memory import InMemorySaver
 from prompts import get_coordinator_agent_prompt
+from model_routing import COORDINATOR, TASK_SYNTHESIS, TASK_VERDICT, route_model
 
 # 导入各个子Agent
 from db_agent import DatabaseAgent
@@ -17,256 +25,617 @@ from dld_agent import BusinessLogicAgent
 from log_agent import LogAgent
 from prd_agent import PRDAgent
 from code_agent import CodeAgent
+from collector_pool import CollectorPool, CollectorTimeoutError, DEFAULT_COLLECTOR_TIMEOUT
+from collector_cache import CollectorCache
+from conversation_memory import (
+    DEFAULT_CONTEXT_TOKEN_LIMIT,
+    DEFAULT_KEEP_TOOL_RESULTS,
+    create_memory_middleware,
+)
+from investigation import CONFIG_KEY, InvestigationContext, get_investigation
+from investigation_events import EventType, InvestigationEvent, events_from_stream, submitted_verdict
+from budget import BudgetCallbackHandler, BudgetExceededError, BudgetMiddleware, InvestigationBudget
+from investigation_verdict import (
+    VERDICT_INSTRUCTION, VERDICT_TOOL, VERDICT_TOOL_DESCRIPTION, InvestigationVerdict, StoppingPolicy,
+    VerdictTurnMiddleware
+)
+from investigation_store import (
+    STATUS_CANCELLED,
+    STATUS_COMPLETED,
+    STATUS_FAILED,
+    STATUS_RUNNING,
+    InvestigationStore,
+)
+from cassette import Cassette
+from pre_router import PlannedCall, PreRouter
+from resilient_transport import request_deadline
+from tracing import KIND_AGENT, KIND_INVESTIGATION, KIND_ROUND, KIND_TOOL, NoopTracer, Tracer, trace_id_for
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# collector名称 -> (子Agent属性名, 结果描述)
+COLLECTORS = {
+    "db_collector": ("db_agent", "数据库查询"),
+    "dld_collector": ("dld_agent", "业务流程查询"),
+    "log_collector": ("log_agent", "日志查询"),
+    "prd_collector": ("prd_agent", "产品需求查询"),
+    "code_collector": ("code_agent", "代码查询"),
+}
+
+# collector工具说明（提供给协调者模型）
+COLLECTOR_DESCRIPTIONS = {
+    "db_collector": "数据库查询工具：查询数据库对象状态、详细内容或分析数据问题。"
+                    "query: 查询要求，描述需要查询的数据库对象或问题",
+    "dld_collector": "业务流程查询工具：查询业务流程的实现路径、关键步骤或分析流程问题。"
+                     "query: 查询要求，描述需要查询的业务流程或问题",
+    "log_collector": "日志查询工具：查询关联日志，支持通过traceId、错误调用栈等方式查询。"
+                     "query: 查询要求，描述需要查询的日志或查询条件",
+    "prd_collector": "产品需求查询工具：查询业务逻辑、业务规则或业务场景。"
+                     "query: 查询要求，描述需要查询的业务逻辑或需求",
+    "code_collector": "代码查询工具：查询业务对应的代码片段或根据错误日志查询相关代码。"
+                      "query: 查询要求，描述需要查询的代码或错误信息",
+}
+
+# 子Agent属性名 -> 子Agent类
+SUB_AGENT_CLASSES = {
+    "db_agent": DatabaseAgent,
+    "dld_agent": BusinessLogicAgent,
+    "log_agent": LogAgent,
+    "prd_agent": PRDAgent,
+    "code_agent": CodeAgent,
+}
+
 
 class CoordinatorAgent:
     """协调者Agent类，负责问题排查流程编排"""
     
-    def __init__(self, api_key: str, base_url: str):
+    def __init__(self, api_key: str, base_url: str,
+                 max_parallel_collectors: int = 5,
+                 collector_timeout: float = DEFAULT_COLLECTOR_TIMEOUT,
+                 collector_workers: int = 32,
+                 collector_cache: Optional[CollectorCache] = None,
+                 enable_cache: bool = True,
+                 pre_router: Optional[PreRouter] = None,
+                 enable_pre_route: bool = True,
+                 context_token_limit: int = DEFAULT_CONTEXT_TOKEN_LIMIT,
+                 keep_tool_results: int = DEFAULT_KEEP_TOOL_RESULTS,
+                 stopping_policy: Optional[StoppingPolicy] = None,
+                 store: Optional[InvestigationStore] = None,
+                 tracer: Optional[Tracer] = None,
+                 cassette: Optional[Cassette] = None):
         """
         初始化协调者Agent
         
         Args:
             api_key: DeepSeek API密钥
             base_url: API基础URL
+            max_parallel_collectors: 同一轮中并发执行的collector数量上限
+            collector_timeout: 单个collector调用的超时时间（秒）
+            collector_workers: collector线程池大小，由并发执行的所有排查共享
+            collector_cache: collector结果缓存（可选，默认新建）
+            enable_cache: 是否启用collector结果缓存
+            pre_router: 本地预路由（可选，默认新建）
+            enable_pre_route: 是否启用预路由（问题描述中有traceId、调用栈、表名等时，第一轮开始前直接并发调用对应collector）
+            context_token_limit: 会话超过该token数时压缩较早的工具结果
+            keep_tool_results: 压缩时保留原文的最近工具结果数
+            stopping_policy: 排查停止策略（可选，默认按置信度阈值和相对上一轮的提升判断）
+            store: 排查检查点存储（可选），配置后每轮和每次collector调用后保存检查点，可通过 resume 继续中断的排查
+            tracer: 链路追踪器（可选），记录排查、轮次、collector、子Agent和LLM调用的耗时
+            cassette: 录像（可选），录制或回放collector调用结果；大模型请求的录制回放通过 llm_client.set_cassette 设置
         """
         self.api_key = api_key
         self.base_url = base_url
+        self.max_parallel_collectors = max_parallel_collectors
+        self.context_token_limit = context_token_limit
+        self.keep_tool_results = keep_tool_results
+        self.stopping_policy = stopping_policy or StoppingPolicy()
+        self.store = store
+        self.tracer = tracer or NoopTracer()
+        self.cassette = cassette
         
-        # 初始化各个子Agent
-        self.db_agent = DatabaseAgent(api_key, base_url)
-        self.dld_agent = BusinessLogicAgent(api_key, base_url)
-        self.log_agent = LogAgent(api_key, base_url)
-        self.prd_agent = PRDAgent(api_key, base_url)
-        self.code_agent = CodeAgent(api_key, base_url)
+        # 多轮排查在同一会话线程中继续，线程ID为排查ID
+        self.checkpointer = InMemorySaver()
+        
+        # collector共享的并发执行池
+        self.collector_pool = CollectorPool(
+            max_workers=collector_workers,
+            default_timeout=collector_timeout
+        )
+        
+        # collector结果缓存，跨排查共享
+        self.collector_cache = (collector_cache or CollectorCache()) if enable_cache else None
+        
+        # 本地预路由，省去第一轮决定调用哪些collector的LLM调用
+        self.pre_router = (pre_router or PreRouter()) if enable_pre_route else None
+        
+        # 子Agent在首次使用时才创建
+        self._sub_agents = {}
+        self._sub_agent_lock = threading.Lock()
         
         # 创建协调者Agent
         self.agent = self._create_agent()
         
-        # 问题排查状态
-        self.investigation_state = {
-            "current_round": 0,
-            "max_rounds": 3,
-            "confidence": 0.0,
-            "findings": [],
-            "actions_taken": []
-        }
+        # 协调者未通过 submit_verdict 提交结论时，补齐结构化结论的模型（function calling 兼容大多数OpenAI兼容接口）
+        verdict_model = route_model(self.api_key, self.base_url, COORDINATOR, TASK_VERDICT)
+        self.verdict_model = verdict_model.with_structured_output(InvestigationVerdict, method="function_calling")
         
         logger.info("协调者Agent初始化完成")
     
+    def _get_sub_agent(self, agent_attr: str):
+        """
+        获取子Agent，首次使用时创建
+        
+        Args:
+            agent_attr: 子Agent属性名（如 db_agent）
+            
+        Returns:
+            子Agent实例
+        """
+        agent = self._sub_agents.get(agent_attr)
+        if agent is None:
+            with self._sub_agent_lock:
+                agent = self._sub_agents.get(agent_attr)
+                if agent is None:
+                    logger.info(f"创建子Agent: {agent_attr}")
+                    agent = SUB_AGENT_CLASSES[agent_attr](self.api_key, self.base_url)
+                    self._sub_agents[agent_attr] = agent
+        return agent
+    
+    @property
+    def db_agent(self) -> DatabaseAgent:
+        return self._get_sub_agent("db_agent")
+    
+    @db_agent.setter
+    def db_agent(self, agent: DatabaseAgent):
+        self._sub_agents["db_agent"] = agent
+    
+    @property
+    def dld_agent(self) -> BusinessLogicAgent:
+        return self._get_sub_agent("dld_agent")
+    
+    @dld_agent.setter
+    def dld_agent(self, agent: BusinessLogicAgent):
+        self._sub_agents["dld_agent"] = agent
+    
+    @property
+    def log_agent(self) -> LogAgent:
+        return self._get_sub_agent("log_agent")
+    
+    @log_agent.setter
+    def log_agent(self, agent: LogAgent):
+        self._sub_agents["log_agent"] = agent
+    
+    @property
+    def prd_agent(self) -> PRDAgent:
+        return self._get_sub_agent("prd_agent")
+    
+    @prd_agent.setter
+    def prd_agent(self, agent: PRDAgent):
+        self._sub_agents["prd_agent"] = agent
+    
+    @property
+    def code_agent(self) -> CodeAgent:
+        return self._get_sub_agent("code_agent")
+    
+    @code_agent.setter
+    def code_agent(self, agent: CodeAgent):
+        self._sub_agents["code_agent"] = agent
+    
     def _create_agent(self):
         """创建协调者Agent实例"""
-        # 初始化LLM
-        llm = init_chat_model(
-            model="deepseek-chat",
-            model_provider="openai",
-            api_key=self.api_key,
-            base_url=self.base_url,
-            temperature=0,
+        # 初始化LLM（分析与综合，按模型路由选择模型层级，失败时改用后备模型）
+        routed = route_model(self.api_key, self.base_url, COORDINATOR, TASK_SYNTHESIS)
+        
+        # 定义工具（封装子Agent调用），同时提供同步和异步实现；协调者给出本轮回复时一并提交结论
+        tools = [self._create_collector_tool(name) for name in COLLECTORS] + [self._create_verdict_tool()]
+        
+        # 从prompts文件夹加载系统提示词
+        system_prompt = get_coordinator_agent_prompt()
+        
+        # 创建Agent
+        agent = create_agent(
+            model=routed.model,
+            tools=tools,
+            debug=False,
+            system_prompt=system_prompt,
+            middleware=[
+                create_memory_middleware(self.context_token_limit, self.keep_tool_results),
+                BudgetMiddleware(lambda config: getattr(get_investigation(config), "budget", None),
+                                 keep_tools=[VERDICT_TOOL]),
+                VerdictTurnMiddleware(),
+                *routed.middleware(),
+            ],
+            checkpointer=self.checkpointer
         )
         
-        # 定义工具（封装子Agent调用）
-        @tool
-        def db_collector(query: str) -> str:
-            """
-            数据库查询工具：查询数据库对象状态、详细内容或分析数据问题
-            
-            Args:
-                query: 查询要求，描述需要查询的数据库对象或问题
-                
-            Returns:
-                查询结果
-            """
-            logger.info(f"调用db_collector: {query}")
-            try:
-                result = self.db_agent.invoke(
-                    {"messages": [{"role": "user", "content": query}]}
-                )
-                content = result.get("messages")[-1].content
-                
-                # 记录已执行的操作
-                self.investigation_state["actions_taken"].append({
-                    "tool": "db_collector",
-                    "query": query,
-                    "result": content
-                })
-                
-                logger.info(f"db_collector执行完成")
-                return content
-            except Exception as e:
-                logger.error(f"db_collector执行失败: {str(e)}")
-                return f"数据库查询失败: {str(e)}"
+        return agent
+    
+    def _create_verdict_tool(self) -> StructuredTool:
+        """
+        创建提交结论工具：结论参数直接从工具调用中读取，工具本身只返回确认；
+        return_direct 使本轮在提交结论后结束，不再多一次模型调用
+        （与collector在同一次回复中调用时由 VerdictTurnMiddleware 拒绝，本轮继续）
         
-        @tool
-        def dld_collector(query: str) -> str:
-            """
-            业务流程查询工具：查询业务流程的实现路径、关键步骤或分析流程问题
-            
-            Args:
-                query: 查询要求，描述需要查询的业务流程或问题
-                
-            Returns:
-                查询结果
-            """
-            logger.info(f"调用dld_collector: {query}")
-            try:
-                result = self.dld_agent.invoke(
-                    {"messages": [{"role": "user", "content": query}]}
-                )
-                content = result.get("messages")[-1].content
-                
-                # 记录已执行的操作
-                self.investigation_state["actions_taken"].append({
-                    "tool": "dld_collector",
-                    "query": query,
-                    "result": content
-                })
-                
-                logger.info(f"dld_collector执行完成")
-                return content
-            except Exception as e:
-                logger.error(f"dld_collector执行失败: {str(e)}")
-                return f"业务流程查询失败: {str(e)}"
+        Returns:
+            工具实例
+        """
+        def submit(**verdict) -> str:
+            return "本轮结论已提交"
         
-        @tool
-        def log_collector(query: str) -> str:
-            """
-            日志查询工具：查询关联日志，支持通过traceId、错误调用栈等方式查询
-            
-            Args:
-                query: 查询要求，描述需要查询的日志或查询条件
-                
-            Returns:
-                查询结果
-            """
-            logger.info(f"调用log_collector: {query}")
-            try:
-                result = self.log_agent.invoke(
-                    {"messages": [{"role": "user", "content": query}]}
-                )
-                content = result.get("messages")[-1].content
-                
-                # 记录已执行的操作
-                self.investigation_state["actions_taken"].append({
-                    "tool": "log_collector",
-                    "query": query,
-                    "result": content
-                })
-                
-                logger.info(f"log_collector执行完成")
-                return content
-            except Exception as e:
-                logger.error(f"log_collector执行失败: {str(e)}")
-                return f"日志查询失败: {str(e)}"
+        return StructuredTool.from_function(
+            func=submit,
+            name=VERDICT_TOOL,
+            description=VERDICT_TOOL_DESCRIPTION,
+            args_schema=InvestigationVerdict,
+            return_direct=True
+        )
+    
+    def _create_collector_tool(self, name: str) -> StructuredTool:
+        """
+        创建collector工具：同步调用（invoke/stream）走线程池，
+        异步调用（ainvoke/astream）直接 await 子Agent的 ainvoke
         
-        @tool
-        def prd_collector(query: str) -> str:
-            """
-            产品需求查询工具：查询业务逻辑、业务规则或业务场景
+        Args:
+            name: collector名称
             
-            Args:
-                query: 查询要求，描述需要查询的业务逻辑或需求
-                
-            Returns:
-                查询结果
-            """
-            logger.info(f"调用prd_collector: {query}")
-            try:
-                result = self.prd_agent.invoke(
-                    {"messages": [{"role": "user", "content": query}]}
-                )
-                content = result.get("messages")[-1].content
-                
-                # 记录已执行的操作
-                self.investigation_state["actions_taken"].append({
-                    "tool": "prd_collector",
-                    "query": query,
-                    "result": content
-                })
-                
-                logger.info(f"prd_collector执行完成")
-                return content
-            except Exception as e:
-                logger.error(f"prd_collector执行失败: {str(e)}")
-                return f"产品需求查询失败: {str(e)}"
+        Returns:
+            工具实例
+        """
+        def run(query: str, config: RunnableConfig) -> str:
+            return self._run_collector(name, query, get_investigation(config))
+        
+        async def arun(query: str, config: RunnableConfig) -> str:
+            return await self._arun_collector(name, query, get_investigation(config))
+        
+        return StructuredTool.from_function(
+            func=run,
+            coroutine=arun,
+            name=name,
+            description=COLLECTOR_DESCRIPTIONS[name]
+        )
+    
+    def _call_sub_agent(self, name: str, query: str,
+                        budget: Optional[InvestigationBudget] = None,
+                        tool_span=None) -> str:
+        """
+        调用collector对应的子Agent并返回最后一条消息内容
         
-        @tool
-        def code_collector(query: str) -> str:
-            """
-            代码查询工具：查询业务对应的代码片段或根据错误日志查询相关代码
+        Args:
+            name: collector名称
+            query: 查询要求
+            budget: 排查预算，子Agent的LLM调用从中扣除，预算用完后中止
+            tool_span: collector调用的span（可选），记录在线程池中的排队时间
+            
+        Returns:
+            子Agent返回内容
+        """
+        agent_attr, _ = COLLECTORS[name]
+        if tool_span is not None:
+            tool_span.set(queue_time=round(time.time() - tool_span.start_time, 6))
+        with self.tracer.start_span(agent_attr, KIND_AGENT, parent=tool_span) as agent_span:
+            def call() -> str:
+                # 子Agent的模型请求（含重试和对冲）不晚于排查预算的截止时间结束
+                with request_deadline(budget.deadline if budget is not None else None):
+                    result = getattr(self, agent_attr).invoke(
+                        {"messages": [{"role": "user", "content": query}]},
+                        config=self._sub_agent_config(budget, agent_attr, agent_span)
+                    )
+                return result.get("messages")[-1].content
+            
+            if self.cassette is None:
+                return call()
+            return self.cassette.call_collector(name, query, call)
+    
+    def _sub_agent_config(self, budget: Optional[InvestigationBudget], agent_attr: str = "",
+                          agent_span=None) -> Optional[Dict]:
+        """
+        子Agent调用配置：LLM调用从排查预算中扣除，预算用完（或排查取消）后中止；
+        启用追踪时子Agent的LLM和工具调用记录在 agent_span 下
+        """
+        callbacks = []
+        if budget is not None:
+            callbacks.append(BudgetCallbackHandler(budget))
+        handler = self.tracer.callback_handler(agent_span, agent=agent_attr)
+        if handler is not None:
+            callbacks.append(handler)
+        return {"callbacks": callbacks} if callbacks else None
+    
+    async def _acall_sub_agent(self, name: str, query: str,
+                               budget: Optional[InvestigationBudget] = None,
+                               tool_span=None) -> str:
+        """调用collector对应的子Agent（异步）并返回最后一条消息内容"""
+        agent_attr, _ = COLLECTORS[name]
+        with self.tracer.start_span(agent_attr, KIND_AGENT, parent=tool_span) as agent_span:
+            async def call() -> str:
+                with request_deadline(budget.deadline if budget is not None else None):
+                    result = await getattr(self, agent_attr).ainvoke(
+                        {"messages": [{"role": "user", "content": query}]},
+                        config=self._sub_agent_config(budget, agent_attr, agent_span)
+                    )
+                return result.get("messages")[-1].content
             
-            Args:
-                query: 查询要求，描述需要查询的代码或错误信息
-                
-            Returns:
-                查询结果
-            """
-            logger.info(f"调用code_collector: {query}")
+            if self.cassette is None:
+                return await call()
+            return await self.cassette.acall_collector(name, query, call)
+    
+    def _record_action(self, investigation: Optional[InvestigationContext], name: str, query: str,
+                       result: str, cached: bool = False) -> None:
+        """记录已执行的collector调用，配置了检查点存储时同时持久化"""
+        if investigation is None:
+            return
+        investigation.record_action(name, query, result, cached=cached)
+        if self.store is not None:
             try:
-                result = self.code_agent.invoke(
-                    {"messages": [{"role": "user", "content": query}]}
-                )
-                content = result.get("messages")[-1].content
-                
-                # 记录已执行的操作
-                self.investigation_state["actions_taken"].append({
-                    "tool": "code_collector",
-                    "query": query,
-                    "result": content
-                })
-                
-                logger.info(f"code_collector执行完成")
-                return content
+                self.store.record_action(investigation.investigation_id, investigation.current_round,
+                                         name, query, result, cached)
             except Exception as e:
-                logger.error(f"code_collector执行失败: {str(e)}")
-                return f"代码查询失败: {str(e)}"
+                logger.warning(f"保存collector调用结果失败: {str(e)}")
+    
+    def _cached_result(self, name: str, query: str,
+                       investigation: Optional[InvestigationContext], span) -> Optional[str]:
+        """
+        查询精确缓存和语义缓存，命中来源记录在span的 cache 属性中
         
-        tools = [db_collector, dld_collector, log_collector, prd_collector, code_collector]
+        Returns:
+            缓存的结果，未命中时返回 None
+        """
+        # 恢复中断的排查时，中断前已执行的调用直接回放结果
+        if investigation is not None:
+            replayed = investigation.replay(name, query)
+            if replayed is not None:
+                logger.info(f"{name}回放中断前的调用结果")
+                span.set(cache="replay")
+                return replayed
         
-        # 从prompts文件夹加载系统提示词
-        system_prompt = get_coordinator_agent_prompt()
+        # 相同（归一化后）查询直接返回缓存结果
+        if self.collector_cache is not None:
+            cached = self.collector_cache.get(name, query)
+            if cached is not None:
+                logger.info(f"{name}命中缓存")
+                span.set(cache="exact")
+                self._record_action(investigation, name, query, cached, cached=True)
+                return cached
+        span.set(cache="miss")
+        return None
+    
+    def _tool_span(self, name: str, query: str, investigation: Optional[InvestigationContext]):
+        """collector调用的span，父span为排查的当前轮次"""
+        parent = investigation.round_span if investigation is not None else None
+        return self.tracer.start_span(name, KIND_TOOL, parent=parent, query=query)
+    
+    def _acquire_collector_call(self, budget: Optional[InvestigationBudget]) -> Optional[float]:
+        """
+        实际调用子Agent才占用预算
         
-        # 创建Agent
-        agent = create_agent(
-            model=llm,
-            tools=tools,
-            debug=False,
-            system_prompt=system_prompt
-        )
+        Returns:
+            本次调用的超时时间（不超过排查剩余时间），无预算时为 None
         
-        return agent
+        Raises:
+            BudgetExceededError: 预算已用完
+        """
+        if budget is None:
+            return None
+        budget.acquire_tool_call()
+        return budget.timeout(self.collector_pool.default_timeout)
     
-    def investigate(self, problem_description: str, 
-                   max_rounds: int = 3) -> Dict:
+    def _collector_succeeded(self, name: str, query: str, content: str,
+                             investigation: Optional[InvestigationContext]) -> str:
+        """写入缓存并记录已执行的操作"""
+        if self.collector_cache is not None:
+            self.collector_cache.put(name, query, content)
+        
+        self._record_action(investigation, name, query, content)
+        
+        logger.info(f"{name}执行完成")
+        return content
+    
+    def _collector_failed(self, name: str, error: Exception, span) -> str:
+        """collector失败时返回给模型的说明"""
+        _, label = COLLECTORS[name]
+        span.record_error(error)
+        if isinstance(error, BudgetExceededError):
+            logger.warning(f"{name}未执行: {str(error)}")
+            return f"{label}未执行: {str(error)}，请基于已有信息总结"
+        if isinstance(error, CollectorTimeoutError):
+            # 超时的同步调用仍占用线程直到返回，记录当前被占用的线程数
+            span.set(stuck_workers=self.collector_pool.stuck_workers)
+            logger.error(f"{name}执行超时: {str(error)}")
+            return f"{label}超时: {str(error)}"
+        logger.error(f"{name}执行失败: {str(error)}")
+        return f"{label}失败: {str(error)}"
+    
+    def _run_collector(self, name: str, query: str,
+                       investigation: Optional[InvestigationContext] = None) -> str:
         """
-        执行问题排查
+        执行collector：在线程池中调用子Agent，超时或失败时返回错误说明
+        
+        同一轮中模型发起的多个collector调用由Agent并发调度，
+        这里再通过线程池为每个调用设置独立超时
         
         Args:
-            problem_description: 问题描述
-            max_rounds: 最大排查轮数
+            name: collector名称
+            query: 查询要求
+            investigation: 当前排查上下文（直接调用Agent时为None）
             
         Returns:
-            排查结果字典
+            查询结果
+        """
+        logger.info(f"调用{name}: {query}")
+        with self._tool_span(name, query, investigation) as span:
+            cached = self._cached_result(name, query, investigation, span)
+            if cached is not None:
+                return cached
+            
+            budget = investigation.budget if investigation is not None else None
+            try:
+                timeout = self._acquire_collector_call(budget)
+                content = self.collector_pool.run(name, self._call_sub_agent, name, query, budget,
+                                                  span if self.tracer.enabled else None, timeout=timeout)
+                return self._collector_succeeded(name, query, content, investigation)
+            except Exception as e:
+                return self._collector_failed(name, e, span)
+    
+    async def _arun_collector(self, name: str, query: str,
+                              investigation: Optional[InvestigationContext] = None) -> str:
+        """
+        执行collector（异步）：直接 await 子Agent，不占用线程；超时或失败时返回错误说明，
+        所在任务被取消时子Agent调用随之取消
+        
+        Args:
+            name: collector名称
+            query: 查询要求
+            investigation: 当前排查上下文（直接调用Agent时为None）
+            
+        Returns:
+            查询结果
+        """
+        logger.info(f"调用{name}: {query}")
+        with self._tool_span(name, query, investigation) as span:
+            cached = self._cached_result(name, query, investigation, span)
+            if cached is not None:
+                return cached
+            
+            budget = investigation.budget if investigation is not None else None
+            try:
+                timeout = self._acquire_collector_call(budget)
+                if timeout is None:
+                    timeout = self.collector_pool.default_timeout
+                try:
+                    content = await asyncio.wait_for(
+                        self._acall_sub_agent(name, query, budget, span if self.tracer.enabled else None),
+                        timeout
+                    )
+                except asyncio.TimeoutError:
+                    logger.warning(f"{name}执行超时: {timeout}秒")
+                    raise CollectorTimeoutError(name, timeout)
+                return self._collector_succeeded(name, query, content, investigation)
+            except Exception as e:
+                return self._collector_failed(name, e, span)
+    
+    def _invoke_config(self, investigation: Optional[InvestigationContext] = None) -> Dict:
+        """
+        Agent调用配置：同一轮的多个工具调用最多并发 max_parallel_collectors 个，
+        并把排查上下文传给collector；同一排查的各轮使用同一会话线程，
+        其他调用各自使用一次性的会话线程
         """
+        configurable = {"thread_id": investigation.investigation_id if investigation else uuid.uuid4().hex}
+        config = {"max_concurrency": self.max_parallel_collectors, "configurable": configurable}
+        if investigation is not None:
+            configurable[CONFIG_KEY] = investigation
+            callbacks = []
+            if investigation.budget is not None:
+                # 协调者自身的LLM调用只计入token，预算将尽时由 BudgetMiddleware 转为总结
+                callbacks.append(BudgetCallbackHandler(investigation.budget, enforce=False))
+            # collector调用由 _tool_span 单独记录，这里只追踪协调者的LLM调用
+            handler = self.tracer.callback_handler(lambda: investigation.round_span or investigation.span,
+                                                   agent="coordinator", trace_tools=False)
+            if handler is not None:
+                callbacks.append(handler)
+            if callbacks:
+                config["callbacks"] = callbacks
+        return config
+    
+    def _release_thread(self, config: Dict) -> None:
+        """排查结束后删除会话线程的检查点，避免内存持续增长"""
+        try:
+            self.checkpointer.delete_thread(config["configurable"]["thread_id"])
+        except Exception as e:
+            logger.warning(f"删除会话线程失败: {str(e)}")
+    
+    def _start_investigation(self, problem_description: str, max_rounds: int,
+                             budget: Optional[InvestigationBudget],
+                             investigation_id: Optional[str] = None) -> InvestigationContext:
+        """创建排查上下文（每次排查独立，同一实例可并发执行多个排查）"""
         logger.info(f"开始问题排查: {problem_description}")
         logger.info(f"最大排查轮数: {max_rounds}")
+        investigation = InvestigationContext(
+            problem_description=problem_description,
+            max_rounds=max_rounds,
+            budget=budget or InvestigationBudget()
+        )
+        if investigation_id is not None:
+            investigation.investigation_id = investigation_id
+        if self.cassette is not None:
+            self.cassette.record_investigation(problem_description, max_rounds)
+        return investigation
+    
+    def _load_checkpoint(self, investigation_id: str):
+        """
+        读取排查检查点
         
-        # 重置排查状态
-        self.investigation_state = {
-            "current_round": 0,
-            "max_rounds": max_rounds,
-            "confidence": 0.0,
-            "findings": [],
-            "actions_taken": []
-        }
+        Returns:
+            (排查上下文, 开始轮次, 会话消息, 排查结果)；排查结果仅在排查已结束时不为 None
+            
+        Raises:
+            ValueError: 未配置检查点存储或排查不存在
+        """
+        if self.store is None:
+            raise ValueError("未配置排查检查点存储，无法恢复排查")
+        checkpoint = self.store.load(investigation_id)
+        if checkpoint is None:
+            raise ValueError(f"排查不存在: {investigation_id}")
         
-        # 构建初始查询
-        query = f"""请协助排查以下技术问题：
-问题描述：{problem_description}
+        investigation = InvestigationContext.from_checkpoint(checkpoint)
+        if checkpoint["status"] == STATUS_COMPLETED:
+            return investigation, investigation.current_round, [], checkpoint["result"]
+        
+        # 最后一轮已完成时从下一轮开始，否则重新执行中断的一轮（已执行的collector调用会回放）
+        finished_rounds = investigation.findings[-1]["round"] if investigation.findings else 0
+        first_round = finished_rounds + 1
+        logger.info(f"恢复排查 {investigation_id}：从第 {first_round} 轮继续，"
+                    f"可回放 {len(investigation.replay_results)} 个collector调用结果")
+        return investigation, first_round, checkpoint["messages"], None
+    
+    def _investigation_span(self, investigation: InvestigationContext, first_round: int):
+        """排查的根span，trace ID 由排查ID得出"""
+        return self.tracer.start_span(
+            "investigation", KIND_INVESTIGATION, trace_id=trace_id_for(investigation.investigation_id),
+            investigation_id=investigation.investigation_id, problem=investigation.problem_description,
+            max_rounds=investigation.max_rounds, first_round=first_round
+        )
+    
+    def _end_investigation_span(self, investigation: InvestigationContext, error=None) -> None:
+        """结束排查及未结束的轮次span，记录结论和预算使用情况"""
+        for span in (investigation.round_span, investigation.span):
+            if span is None:
+                continue
+            if error is not None:
+                span.record_error(error)
+            if span is investigation.span:
+                budget = investigation.budget.to_dict() if investigation.budget is not None else {}
+                span.set(rounds=investigation.current_round, confidence=investigation.confidence,
+                         stop_reason=investigation.stop_reason, tokens=budget.get("tokens_used"),
+                         tool_calls=budget.get("tool_calls"))
+            span.end()
+    
+    def _restore_thread(self, config: Dict, messages: List) -> None:
+        """把检查点中的会话消息写回会话线程，后续轮次在原会话上继续"""
+        if messages:
+            self.agent.update_state(config, {"messages": messages}, as_node="model")
+    
+    def _checkpoint(self, investigation: InvestigationContext, config: Dict,
+                    status: str = STATUS_RUNNING, result: Optional[Dict] = None,
+                    error: Optional[str] = None) -> None:
+        """保存排查检查点（未配置存储时不做任何事），保存失败不影响排查"""
+        if self.store is None:
+            return
+        try:
+            messages = self.agent.get_state(config).values.get("messages") if status == STATUS_RUNNING else None
+            self.store.save(investigation.to_state(), investigation.problem_description, status,
+                            messages=messages, result=result, error=error)
+        except Exception as e:
+            logger.warning(f"保存排查检查点失败: {str(e)}")
+    
+    def _round_input(self, investigation: InvestigationContext, round_num: int) -> Dict:
+        """
+        构建本轮输入：第一轮使用初始查询，后续轮次在已有会话上继续深入
+        （各轮在同一会话线程中继续，模型能看到之前各轮的工具调用和结果）
+        """
+        if round_num == 1:
+            content = f"""请协助排查以下技术问题：
+问题描述：{investigation.problem_description}
 
 请按照以下步骤进行排查：
 1. 理解问题，识别关键信息
@@ -277,131 +646,511 @@ class CoordinatorAgent:
 6. 给出结论和建议
 
 请在每一步说明你的思考过程和使用的工具。"""
+        else:
+            content = """请根据目前已收集到的信息，判断是否需要进一步排查。如果需要，请继续深入调查（已查询过的内容无需重复查询）；如果已经找到明确的根因和解决方案，请总结最终结果并给出置信度评分。"""
+        return {"messages": [{"role": "user", "content": content}]}
+    
+    def _pre_routed_calls(self, investigation: InvestigationContext, round_num: int) -> List[PlannedCall]:
+        """第一轮开始前由预路由确定的collector调用（其他轮次或未启用预路由时为空）"""
+        if self.pre_router is None or round_num != 1:
+            return []
+        try:
+            calls = self.pre_router.plan(investigation.problem_description)[:self.max_parallel_collectors]
+        except Exception as e:
+            logger.warning(f"预路由失败，由模型决定collector调用: {str(e)}")
+            return []
+        if calls:
+            investigation.round_span.set(pre_routed=len(calls))
+        return calls
+    
+    @staticmethod
+    def _pre_route_message(calls: List[PlannedCall]) -> AIMessage:
+        """预路由的collector调用，以协调者工具调用的形式写入会话"""
+        reasons = "、".join(dict.fromkeys(call.reason for call in calls))
+        return AIMessage(
+            content=f"根据问题描述中的{reasons}，先并发查询相关信息。",
+            tool_calls=[
+                {"name": call.tool, "args": {"query": call.query}, "id": f"pre_route_{i}", "type": "tool_call"}
+                for i, call in enumerate(calls)
+            ]
+        )
+    
+    @staticmethod
+    def _pre_routed_state(round_input: Dict, call_message: AIMessage, results: List[str]) -> Dict:
+        """
+        第一轮的问题、预路由的工具调用和结果，以工具节点的输出写入会话线程后，模型的第一次调用即可直接分析结果
+        
+        Returns:
+            会话状态更新 {"messages": [...]}，最后几条为工具结果消息
+        """
+        tool_messages = [
+            ToolMessage(content=result, tool_call_id=tool_call["id"], name=tool_call["name"])
+            for tool_call, result in zip(call_message.tool_calls, results)
+        ]
+        return {"messages": round_input["messages"] + [call_message] + tool_messages}
+    
+    def _begin_round(self, investigation: InvestigationContext, round_num: int) -> bool:
+        """
+        开始新一轮排查
+        
+        Returns:
+            本轮是否因预算将尽只做总结
+        """
+        logger.info(f"=== 开始第 {round_num} 轮排查 ===")
+        investigation.current_round = round_num
+        investigation.round_span = self.tracer.start_span(f"round {round_num}", KIND_ROUND,
+                                                          parent=investigation.span, round=round_num)
+        
+        # 预算将尽时不再开始新一轮深入排查，本轮只做总结
+        budget_low = round_num > 1 and investigation.budget.low()
+        if budget_low:
+            logger.info(f"排查预算将尽，第 {round_num} 轮转为总结: {investigation.budget.to_dict()}")
+        return budget_low
+    
+    def _verdict_input(self, investigation: InvestigationContext, response: str) -> List[Dict]:
+        return [{"role": "user", "content": VERDICT_INSTRUCTION.format(
+            problem=investigation.problem_description, response=response or "（本轮没有给出结论）"
+        )}]
+    
+    def _parse_verdict(self, verdict, response: str) -> InvestigationVerdict:
+        """结构化输出缺失时退回到从回复文本中解析"""
+        if isinstance(verdict, InvestigationVerdict):
+            return verdict
+        logger.warning("未获得结构化结论，从回复文本中解析")
+        return InvestigationVerdict.from_text(response)
+    
+    def _submitted_verdict(self, submitted: Optional[Dict]) -> Optional[InvestigationVerdict]:
+        """校验协调者通过 submit_verdict 提交的结论，未提交或参数不合法时返回 None"""
+        if submitted is None:
+            return None
+        try:
+            return InvestigationVerdict.model_validate(submitted)
+        except ValueError as e:
+            logger.warning(f"提交的结论不合法: {str(e)}")
+            return None
+    
+    def _get_verdict(self, investigation: InvestigationContext, response: str,
+                     submitted: Optional[Dict], config: Dict) -> InvestigationVerdict:
+        """
+        取得本轮的结构化结论：优先使用协调者提交的结论，未提交时才单独调用一次结构化输出
         
+        Args:
+            investigation: 排查上下文
+            response: 协调者本轮的回复
+            submitted: 协调者通过 submit_verdict 提交的结论参数
+            config: Agent调用配置（用于计入排查预算）
+            
+        Returns:
+            结论
+        """
+        verdict = self._submitted_verdict(submitted)
+        if verdict is not None:
+            return verdict
+        logger.info("协调者未提交结论，单独生成结构化结论")
         try:
-            # 执行排查
-            for round_num in range(1, max_rounds + 1):
-                logger.info(f"=== 开始第 {round_num} 轮排查 ===")
-                self.investigation_state["current_round"] = round_num
-                
-                # 调用协调者Agent
-                if round_num == 1:
-                    # 第一轮使用初始查询
-                    result = self.agent.invoke(
-                        {"messages": [{"role": "user", "content": query}]},
-                        streaming=False
-                    )
-                else:
-                    # 后续轮次根据上一轮结果继续深入
-                    last_result = self.investigation_state["findings"][-1]
-                    follow_up_query = f"""上一轮排查结果如下：
-{last_result}
-
-请根据以上结果，判断是否需要进一步排查。如果需要，请继续深入调查；如果已经找到明确的根因和解决方案，请总结最终结果并给出置信度评分。"""
+            verdict = self.verdict_model.invoke(self._verdict_input(investigation, response),
+                                                config={"callbacks": config.get("callbacks"), "tags": ["verdict"]})
+        except Exception as e:
+            logger.warning(f"生成结构化结论失败: {str(e)}")
+            verdict = None
+        return self._parse_verdict(verdict, response)
+    
+    async def _aget_verdict(self, investigation: InvestigationContext, response: str,
+                            submitted: Optional[Dict], config: Dict) -> InvestigationVerdict:
+        """取得本轮的结构化结论（异步）"""
+        verdict = self._submitted_verdict(submitted)
+        if verdict is not None:
+            return verdict
+        logger.info("协调者未提交结论，单独生成结构化结论")
+        try:
+            verdict = await self.verdict_model.ainvoke(self._verdict_input(investigation, response),
+                                                       config={"callbacks": config.get("callbacks"), "tags": ["verdict"]})
+        except Exception as e:
+            logger.warning(f"生成结构化结论失败: {str(e)}")
+            verdict = None
+        return self._parse_verdict(verdict, response)
+    
+    def _finish_round(self, investigation: InvestigationContext, round_num: int,
+                      response: str, verdict: InvestigationVerdict, budget_low: bool) -> Dict:
+        """
+        记录本轮结果和结论，按停止策略判断是否结束排查
+        
+        Returns:
+            CONFIDENCE 事件数据：{"confidence", "verdict", "stop", "reason"}
+        """
+        previous_confidence = investigation.verdict["confidence"] if investigation.verdict else None
+        investigation.add_finding(round_num, response, verdict.model_dump())
+        investigation.confidence = verdict.confidence
+        
+        logger.info(f"第 {round_num} 轮排查完成")
+        logger.info(f"本轮结果: {response[:200]}...")
+        
+        stop, reason = self.stopping_policy.decide(verdict, previous_confidence)
+        if not stop and budget_low:
+            stop, reason = True, "排查预算将尽"
+        elif not stop and round_num >= investigation.max_rounds:
+            stop, reason = True, f"已达到最大排查轮数 {investigation.max_rounds}（{reason}）"
+        investigation.stop_reason = reason
+        logger.info(f"第 {round_num} 轮{'结束排查' if stop else '继续排查'}: {reason}")
+        investigation.round_span.set(confidence=verdict.confidence, stop=stop, reason=reason)
+        investigation.round_span.end()
+        return {"confidence": verdict.confidence, "verdict": verdict.model_dump(),
+                "stop": stop, "reason": reason}
+    
+    def _error_result(self, investigation: InvestigationContext, error: Exception) -> Dict:
+        logger.error(f"问题排查失败: {str(error)}")
+        return {
+            "status": "error",
+            "error": str(error),
+            "investigation_id": investigation.investigation_id,
+            "investigation_state": investigation.to_state()
+        }
+    
+    def _end_events(self, investigation: InvestigationContext, config: Dict,
+                    error: Optional[Exception] = None) -> List[InvestigationEvent]:
+        """排查结束时的事件：失败时先产出 ERROR，最后总是 DONE"""
+        events = []
+        if error is None:
+            result = self._summarize_investigation(investigation)
+            logger.info(f"问题排查完成，置信度: {result['confidence']}")
+            self._checkpoint(investigation, config, STATUS_COMPLETED, result=result)
+        else:
+            result = self._error_result(investigation, error)
+            self._checkpoint(investigation, config, STATUS_FAILED, error=str(error))
+            events.append(InvestigationEvent(EventType.ERROR, investigation.investigation_id,
+                                             investigation.current_round, {"error": str(error)}))
+        events.append(InvestigationEvent(EventType.DONE, investigation.investigation_id,
+                                         investigation.current_round, {"result": result}))
+        return events
+    
+    def stream_investigate(self, problem_description: str,
+                           max_rounds: int = 3,
+                           budget: Optional[InvestigationBudget] = None,
+                           investigation_id: Optional[str] = None) -> Iterator[InvestigationEvent]:
+        """
+        流式执行问题排查，排查过程中实时产出事件
+        
+        调用方停止迭代（break 或 close()）即取消排查：已发出的collector调用不会再占用预算，
+        子Agent的后续LLM调用会被拒绝
+        
+        Args:
+            problem_description: 问题描述
+            max_rounds: 最大排查轮数
+            budget: 排查预算，默认使用 InvestigationBudget 的默认上限
+            investigation_id: 排查ID（可选，默认自动生成），配置检查点存储时可用于 resume
+            
+        Yields:
+            InvestigationEvent，最后一个事件为 DONE，data["result"] 为 investigate 的返回值
+        """
+        investigation = self._start_investigation(problem_description, max_rounds, budget, investigation_id)
+        yield from self._stream_rounds(investigation, 1)
+    
+    def stream_resume(self, investigation_id: str) -> Iterator[InvestigationEvent]:
+        """
+        流式恢复中断的排查（需要配置检查点存储），事件同 stream_investigate；
+        已结束的排查直接产出保存的结果
+        
+        Args:
+            investigation_id: 排查ID
+            
+        Raises:
+            ValueError: 未配置检查点存储或排查不存在
+        """
+        investigation, first_round, messages, result = self._load_checkpoint(investigation_id)
+        if result is not None:
+            yield InvestigationEvent(EventType.DONE, investigation_id, investigation.current_round,
+                                     {"result": result})
+            return
+        yield from self._stream_rounds(investigation, first_round, messages)
+    
+    def _stream_rounds(self, investigation: InvestigationContext, first_round: int,
+                       messages: Optional[List] = None) -> Iterator[InvestigationEvent]:
+        """从 first_round 开始执行各轮排查并产出事件"""
+        investigation_id = investigation.investigation_id
+        max_rounds = investigation.max_rounds
+        investigation.span = self._investigation_span(investigation, first_round)
+        config = self._invoke_config(investigation)
+        finished = False
+        
+        try:
+            error = None
+            try:
+                self._restore_thread(config, messages)
+                for round_num in range(first_round, max_rounds + 1):
+                    budget_low = self._begin_round(investigation, round_num)
+                    self._checkpoint(investigation, config)
+                    yield InvestigationEvent(EventType.ROUND_START, investigation_id, round_num,
+                                             {"round": round_num, "max_rounds": max_rounds})
                     
-                    result = self.agent.invoke(
-                        {"messages": [{"role": "user", "content": follow_up_query}]},
-                        streaming=False
-                    )
-                
-                # 获取结果
-                response = result.get("messages")[-1].content
-                self.investigation_state["findings"].append({
-                    "round": round_num,
-                    "result": response
-                })
-                
-                logger.info(f"第 {round_num} 轮排查完成")
-                logger.info(f"本轮结果: {response[:200]}...")
-                
-                # 检查是否已经找到明确答案
-                if "结论" in response or "根因" in response or "置信度" in response:
-                    logger.info("已找到明确答案，结束排查")
-                    break
+                    round_input = self._round_input(investigation, round_num)
+                    calls = self._pre_routed_calls(investigation, round_num)
+                    if calls:
+                        call_message = self._pre_route_message(calls)
+                        yield from events_from_stream(investigation_id, round_num, "updates",
+                                                      {"pre_route": {"messages": [call_message]}})
+                        with get_executor_for_config(config) as executor:
+                            results = list(executor.map(
+                                lambda call: self._run_collector(call.tool, call.query, investigation), calls
+                            ))
+                        state = self._pre_routed_state(round_input, call_message, results)
+                        self.agent.update_state(config, state, as_node="tools")
+                        tool_messages = state["messages"][-len(calls):]
+                        yield from events_from_stream(investigation_id, round_num, "updates",
+                                                      {"pre_route": {"messages": tool_messages}})
+                        # 会话已包含本轮输入，从模型节点继续
+                        round_input = None
+                    
+                    response, submitted = "", None
+                    for mode, chunk in self.agent.stream(round_input,
+                                                         config=config,
+                                                         stream_mode=["updates", "messages"]):
+                        submitted = submitted_verdict(mode, chunk) or submitted
+                        for event in events_from_stream(investigation_id, round_num, mode, chunk):
+                            if event.type == EventType.MESSAGE:
+                                response = event.data["content"]
+                            yield event
+                    
+                    verdict = self._get_verdict(investigation, response, submitted, config)
+                    decision = self._finish_round(investigation, round_num, response, verdict, budget_low)
+                    self._checkpoint(investigation, config)
+                    yield InvestigationEvent(EventType.CONFIDENCE, investigation_id, round_num, decision)
+                    if decision["stop"]:
+                        break
+            except Exception as e:
+                error = e
             
-            # 汇总最终结果
-            final_result = self._summarize_investigation()
-            logger.info(f"问题排查完成，置信度: {final_result['confidence']}")
+            finished = True
+            self._end_investigation_span(investigation, error)
+            yield from self._end_events(investigation, config, error)
+        finally:
+            if not finished:
+                logger.info(f"排查已取消: {investigation_id}")
+                investigation.budget.cancel()
+                self._checkpoint(investigation, config, STATUS_CANCELLED)
+                self._end_investigation_span(investigation, "排查已取消")
+            self._release_thread(config)
+    
+    async def astream_investigate(self, problem_description: str,
+                                  max_rounds: int = 3,
+                                  budget: Optional[InvestigationBudget] = None,
+                                  investigation_id: Optional[str] = None) -> AsyncIterator[InvestigationEvent]:
+        """
+        流式执行问题排查（异步迭代器版本），参数和事件同 stream_investigate；
+        取消迭代所在的任务即取消排查
+        """
+        investigation = self._start_investigation(problem_description, max_rounds, budget, investigation_id)
+        async for event in self._astream_rounds(investigation, 1):
+            yield event
+    
+    async def astream_resume(self, investigation_id: str) -> AsyncIterator[InvestigationEvent]:
+        """流式恢复中断的排查（异步迭代器版本），参数和事件同 stream_resume"""
+        investigation, first_round, messages, result = self._load_checkpoint(investigation_id)
+        if result is not None:
+            yield InvestigationEvent(EventType.DONE, investigation_id, investigation.current_round,
+                                     {"result": result})
+            return
+        async for event in self._astream_rounds(investigation, first_round, messages):
+            yield event
+    
+    async def _astream_rounds(self, investigation: InvestigationContext, first_round: int,
+                              messages: Optional[List] = None) -> AsyncIterator[InvestigationEvent]:
+        """从 first_round 开始执行各轮排查并产出事件（异步）"""
+        investigation_id = investigation.investigation_id
+        max_rounds = investigation.max_rounds
+        investigation.span = self._investigation_span(investigation, first_round)
+        config = self._invoke_config(investigation)
+        finished = False
+        
+        try:
+            error = None
+            try:
+                self._restore_thread(config, messages)
+                for round_num in range(first_round, max_rounds + 1):
+                    budget_low = self._begin_round(investigation, round_num)
+                    self._checkpoint(investigation, config)
+                    yield InvestigationEvent(EventType.ROUND_START, investigation_id, round_num,
+                                             {"round": round_num, "max_rounds": max_rounds})
+                    
+                    round_input = self._round_input(investigation, round_num)
+                    calls = self._pre_routed_calls(investigation, round_num)
+                    if calls:
+                        call_message = self._pre_route_message(calls)
+                        for event in events_from_stream(investigation_id, round_num, "updates",
+                                                        {"pre_route": {"messages": [call_message]}}):
+                            yield event
+                        results = await asyncio.gather(*[
+                            self._arun_collector(call.tool, call.query, investigation) for call in calls
+                        ])
+                        state = self._pre_routed_state(round_input, call_message, results)
+                        await self.agent.aupdate_state(config, state, as_node="tools")
+                        tool_messages = state["messages"][-len(calls):]
+                        for event in events_from_stream(investigation_id, round_num, "updates",
+                                                        {"pre_route": {"messages": tool_messages}}):
+                            yield event
+                        # 会话已包含本轮输入，从模型节点继续
+                        round_input = None
+                    
+                    response, submitted = "", None
+                    async for mode, chunk in self.agent.astream(round_input,
+                                                                config=config,
+                                                                stream_mode=["updates", "messages"]):
+                        submitted = submitted_verdict(mode, chunk) or submitted
+                        for event in events_from_stream(investigation_id, round_num, mode, chunk):
+                            if event.type == EventType.MESSAGE:
+                                response = event.data["content"]
+                            yield event
+                    
+                    verdict = await self._aget_verdict(investigation, response, submitted, config)
+                    decision = self._finish_round(investigation, round_num, response, verdict, budget_low)
+                    self._checkpoint(investigation, config)
+                    yield InvestigationEvent(EventType.CONFIDENCE, investigation_id, round_num, decision)
+                    if decision["stop"]:
+                        break
+            except Exception as e:
+                error = e
             
-            return final_result
+            finished = True
+            self._end_investigation_span(investigation, error)
+            for event in self._end_events(investigation, config, error):
+                yield event
+        finally:
+            if not finished:
+                logger.info(f"排查已取消: {investigation_id}")
+                investigation.budget.cancel()
+                self._checkpoint(investigation, config, STATUS_CANCELLED)
+                self._end_investigation_span(investigation, "排查已取消")
+            self._release_thread(config)
+    
+    def investigate(self, problem_description: str, 
+                   max_rounds: int = 3,
+                   budget: Optional[InvestigationBudget] = None,
+                   investigation_id: Optional[str] = None) -> Dict:
+        """
+        执行问题排查
+        
+        Args:
+            problem_description: 问题描述
+            max_rounds: 最大排查轮数
+            budget: 排查预算（token、耗时、collector调用次数），默认使用 InvestigationBudget 的默认上限
+            investigation_id: 排查ID（可选，默认自动生成），配置检查点存储时可用于 resume
             
-        except Exception as e:
-            logger.error(f"问题排查失败: {str(e)}")
-            return {
-                "status": "error",
-                "error": str(e),
-                "investigation_state": self.investigation_state
-            }
+        Returns:
+            排查结果字典
+        """
+        result = None
+        for event in self.stream_investigate(problem_description, max_rounds, budget, investigation_id):
+            if event.type == EventType.DONE:
+                result = event.data["result"]
+        return result
+    
+    def resume(self, investigation_id: str) -> Dict:
+        """
+        从最后一个检查点继续中断的排查（需要配置检查点存储）：
+        恢复会话消息、各轮结论、已执行的操作和预算使用情况，中断前已执行的collector调用直接回放结果
+        
+        Args:
+            investigation_id: 排查ID
+            
+        Returns:
+            排查结果字典（排查已结束时返回保存的结果）
+            
+        Raises:
+            ValueError: 未配置检查点存储或排查不存在
+        """
+        result = None
+        for event in self.stream_resume(investigation_id):
+            if event.type == EventType.DONE:
+                result = event.data["result"]
+        return result
     
-    def _summarize_investigation(self) -> Dict:
+    async def ainvestigate(self, problem_description: str,
+                           max_rounds: int = 3,
+                           budget: Optional[InvestigationBudget] = None,
+                           investigation_id: Optional[str] = None) -> Dict:
+        """
+        执行问题排查（异步）：模型和子Agent调用均为异步，等待LLM时不占用线程，
+        同一个事件循环可以同时驱动大量排查；取消所在任务即取消排查
+        
+        Args:
+            problem_description: 问题描述
+            max_rounds: 最大排查轮数
+            budget: 排查预算，默认使用 InvestigationBudget 的默认上限
+            investigation_id: 排查ID（可选，默认自动生成），配置检查点存储时可用于 aresume
+            
+        Returns:
+            排查结果字典
+        """
+        result = None
+        async for event in self.astream_investigate(problem_description, max_rounds, budget, investigation_id):
+            if event.type == EventType.DONE:
+                result = event.data["result"]
+        return result
+    
+    async def aresume(self, investigation_id: str) -> Dict:
+        """从最后一个检查点继续中断的排查（异步），参数和返回值同 resume"""
+        result = None
+        async for event in self.astream_resume(investigation_id):
+            if event.type == EventType.DONE:
+                result = event.data["result"]
+        return result
+    
+    def _summarize_investigation(self, investigation: InvestigationContext) -> Dict:
         """
         汇总排查结果
         
+        Args:
+            investigation: 排查上下文
+            
         Returns:
             汇总结果字典
         """
         logger.info("开始汇总排查结果")
         
         # 获取最后一轮结果作为主要结论
-        if self.investigation_state["findings"]:
-            last_finding = self.investigation_state["findings"][-1]["result"]
+        if investigation.findings:
+            last_finding = investigation.findings[-1]["result"]
         else:
             last_finding = "未获得有效结果"
-        
-        # 尝试从结果中提取置信度
-        confidence = self._extract_confidence(last_finding)
+        verdict = investigation.verdict or {}
         
         summary = {
             "status": "success",
+            "investigation_id": investigation.investigation_id,
             "problem": "技术问题排查",
-            "rounds_completed": self.investigation_state["current_round"],
-            "confidence": confidence,
-            "findings": self.investigation_state["findings"],
-            "actions_taken": self.investigation_state["actions_taken"],
+            "rounds_completed": investigation.current_round,
+            "confidence": investigation.confidence,
+            "root_cause": verdict.get("root_cause", ""),
+            "solution": verdict.get("solution", ""),
+            "open_questions": list(verdict.get("open_questions", [])),
+            "stop_reason": investigation.stop_reason,
+            "findings": list(investigation.findings),
+            "actions_taken": list(investigation.actions_taken),
+            "budget": investigation.budget.to_dict() if investigation.budget is not None else None,
             "conclusion": last_finding
         }
         
         logger.info("排查结果汇总完成")
         return summary
     
-    def _extract_confidence(self, text: str) -> float:
+    def cache_stats(self) -> Dict:
         """
-        从文本中提取置信度评分
+        collector缓存命中统计
         
-        Args:
-            text: 包含置信度信息的文本
-            
         Returns:
-            置信度评分（0-100）
+            统计字典，未启用缓存时为空
         """
-        import re
-        
-        # 尝试匹配"置信度"关键词
-        patterns = [
-            r"置信度[：:]\s*(\d+)",
-            r"置信度[为是]\s*(\d+)",
-            r"confidence[：:]\s*(\d+)",
-        ]
-        
-        for pattern in patterns:
-            match = re.search(pattern, text)
-            if match:
-                try:
-                    confidence = float(match.group(1))
-                    # 确保在0-100范围内
-                    return max(0.0, min(100.0, confidence))
-                except (ValueError, IndexError):
-                    continue
-        
-        # 未找到明确置信度，返回默认值
-        return 50.0
+        if self.collector_cache is None:
+            return {}
+        return self.collector_cache.stats()
     
-    def verify_result(self, verification_query: str) -> Dict:
+    def verify_result(self, verification_query: str,
+                      investigation_result: Optional[Dict] = None) -> Dict:
         """
         验证排查结果
         
         Args:
             verification_query: 验证查询
+            investigation_result: 需要验证的排查结果（investigate 的返回值，可选）
             
         Returns:
             验证结果字典
@@ -412,17 +1161,21 @@ class CoordinatorAgent:
 验证内容：{verification_query}
 
 已有的排查结果：
-{self.investigation_state.get('findings', [])}
+{(investigation_result or {}).get('findings', [])}
 
 请使用相关工具进行验证，并说明验证结果是否支持原结论。"""
         
+        config = self._invoke_config()
         try:
             result = self.agent.invoke(
                 {"messages": [{"role": "user", "content": query}]},
+                config=config,
                 streaming=False
             )
             
-            response = result.get("messages")[-1].content
+            # 协调者提交结论后最后一条是工具确认消息，取最后一条模型回复
+            response = next((message.content for message in reversed(result.get("messages"))
+                             if isinstance(message, AIMessage)), "")
             logger.info("排查结果验证完成")
             
             return {
@@ -437,6 +1190,8 @@ class CoordinatorAgent:
                 "status": "error",
                 "error": str(e)
             }
+        finally:
+            self._release_thread(config)
     
     def invoke(self, message: dict) -> dict:
         """
@@ -450,14 +1205,41 @@ class CoordinatorAgent:
         """
         logger.info(f"接收到请求: {message}")
         
+        config = self._invoke_config()
+        try:
+            result = self.agent.invoke(message, config=config, streaming=False)
+            logger.info("请求执行完成")
+            return result
+            
+        except Exception as e:
+            logger.error(f"请求执行失败: {str(e)}")
+            raise
+        finally:
+            self._release_thread(config)
+
+    async def ainvoke(self, message: dict) -> dict:
+        """
+        直接调用Agent（异步，供外部使用）
+        
+        Args:
+            message: 消息字典
+            
+        Returns:
+            Agent返回结果
+        """
+        logger.info(f"接收到请求: {message}")
+        
+        config = self._invoke_config()
         try:
-            result = self.agent.invoke(message, streaming=False)
+            result = await self.agent.ainvoke(message, config=config, streaming=False)
             logger.info("请求执行完成")
             return result
             
         except Exception as e:
             logger.error(f"请求执行失败: {str(e)}")
             raise
+        finally:
+            self._release_thread(config)
 
 
 # 创建全局Agent实例（实际使用时需要配置API密钥）
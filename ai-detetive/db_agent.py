@@ -4,10 +4,12 @@
 通过将mysql数据库内容向量化后访问
 """
 import logging
-from langchain.chat_models import init_chat_model
+from typing import Optional
 from langchain.agents import create_agent
 from langchain.tools import tool
+from langchain_core.runnables import RunnableConfig
 from prompts import get_db_agent_prompt
+from model_routing import TASK_RETRIEVAL, route_model
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
@@ -32,24 +34,19 @@ class DatabaseAgent:
     
     def _create_agent(self):
         """创建数据库Agent实例"""
-        # 初始化LLM
-        llm = init_chat_model(
-            model="deepseek-chat",
-            model_provider="openai",
-            api_key=self.api_key,
-            base_url=self.base_url,
-            temperature=0,
-        )
+        # 初始化LLM（检索类任务，按模型路由选择模型层级，失败时改用后备模型）
+        routed = route_model(self.api_key, self.base_url, "db_agent", TASK_RETRIEVAL)
         
         # 从prompts文件夹加载系统提示词
         system_prompt = get_db_agent_prompt()
         
         # 创建Agent
         agent = create_agent(
-            model=llm,
+            model=routed.model,
             tools=[],
             debug=False,
-            system_prompt=system_prompt
+            system_prompt=system_prompt,
+            middleware=routed.middleware()
         )
         
         return agent
@@ -177,12 +174,35 @@ class DatabaseAgent:
                 "error": str(e)
             }
     
-    def invoke(self, message: dict) -> dict:
+    def invoke(self, message: dict, config: Optional[RunnableConfig] = None) -> dict:
         """
         直接调用Agent（供外部使用）
         
         Args:
             message: 消息字典，格式: {"messages": [{"role": "user", "content": "问题内容"}]}
+            config: 调用配置（可选，协调者用于传递排查预算和截止时间）
+            
+        Returns:
+            Agent返回结果
+        """
+        logger.info(f"接收到查询请求: {message}")
+        
+        try:
+            result = self.agent.invoke(message, config=config, streaming=False)
+            logger.info("查询执行完成")
+            return result
+            
+        except Exception as e:
+            logger.error(f"查询执行失败: {str(e)}")
+            raise
+
+    async def ainvoke(self, message: dict, config: Optional[RunnableConfig] = None) -> dict:
+        """
+        直接调用Agent（异步，供外部使用）
+        
+        Args:
+            message: 消息字典，格式: {"messages": [{"role": "user", "content": "问题内容"}]}
+            config: 调用配置（可选，协调者用于传递排查预算和截止时间）
             
         Returns:
             Agent返回结果
@@ -190,7 +210,7 @@ class DatabaseAgent:
         logger.info(f"接收到查询请求: {message}")
         
         try:
-            result = self.agent.invoke(message, streaming=False)
+            result = await self.agent.ainvoke(message, config=config, streaming=False)
             logger.info("查询执行完成")
             return result
             
@@ -4,9 +4,11 @@
 返回示例：先查询数据库-进行数据比对-删除数据-给用户返回成功，删除数据失败-给用户返回失败
 """
 import logging
-from langchain.chat_models import init_chat_model
+from typing import Optional
 from langchain.agents import create_agent
+from langchain_core.runnables import RunnableConfig
 from prompts import get_dld_agent_prompt
+from model_routing import TASK_RETRIEVAL, route_model
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
@@ -31,24 +33,19 @@ class BusinessLogicAgent:
     
     def _create_agent(self):
         """创建业务流程Agent实例"""
-        # 初始化LLM
-        llm = init_chat_model(
-            model="deepseek-chat",
-            model_provider="openai",
-            api_key=self.api_key,
-            base_url=self.base_url,
-            temperature=0,
-        )
+        # 初始化LLM（检索类任务，按模型路由选择模型层级，失败时改用后备模型）
+        routed = route_model(self.api_key, self.base_url, "dld_agent", TASK_RETRIEVAL)
         
         # 从prompts文件夹加载系统提示词
         system_prompt = get_dld_agent_prompt()
         
         # 创建Agent
         agent = create_agent(
-            model=llm,
+            model=routed.model,
             tools=[],
             debug=False,
-            system_prompt=system_prompt
+            system_prompt=system_prompt,
+            middleware=routed.middleware()
         )
         
         return agent
@@ -175,12 +172,35 @@ class BusinessLogicAgent:
                 "error": str(e)
             }
     
-    def invoke(self, message: dict) -> dict:
+    def invoke(self, message: dict, config: Optional[RunnableConfig] = None) -> dict:
         """
         直接调用Agent（供外部使用）
         
         Args:
             message: 消息字典，格式: {"messages": [{"role": "user", "content": "问题内容"}]}
+            config: 调用配置（可选，协调者用于传递排查预算和截止时间）
+            
+        Returns:
+            Agent返回结果
+        """
+        logger.info(f"接收到查询请求: {message}")
+        
+        try:
+            result = self.agent.invoke(message, config=config, streaming=False)
+            logger.info("查询执行完成")
+            return result
+            
+        except Exception as e:
+            logger.error(f"查询执行失败: {str(e)}")
+            raise
+
+    async def ainvoke(self, message: dict, config: Optional[RunnableConfig] = None) -> dict:
+        """
+        直接调用Agent（异步，供外部使用）
+        
+        Args:
+            message: 消息字典，格式: {"messages": [{"role": "user", "content": "问题内容"}]}
+            config: 调用配置（可选，协调者用于传递排查预算和截止时间）
             
         Returns:
             Agent返回结果
@@ -188,7 +208,7 @@ class BusinessLogicAgent:
         logger.info(f"接收到查询请求: {message}")
         
         try:
-            result = self.agent.invoke(message, streaming=False)
+            result = await self.agent.ainvoke(message, config=config, streaming=False)
             logger.info("查询执行完成")
             return result
             
@@ -1,7 +1,17 @@
 """
 AI问题排查系统使用示例
+
+用法：
+    python example.py                          # 调用真实接口
+    python example.py --record cassette.jsonl  # 同时录制大模型请求和collector调用结果
+    python example.py --replay cassette.jsonl  # 离线回放录像（--timing 按录制时的耗时回放）
 """
+import argparse
 import logging
+from typing import Optional
+
+import llm_client
+from cassette import MODE_RECORD, Cassette
 from coordinator_agent import CoordinatorAgent
 
 # 配置日志
@@ -15,8 +25,13 @@ API_KEY = "sk-94ac4e052ab5486ead278f6bff21db91"
 BASE_URL = "https://api.deepseek.com/v1"
 
 
-def main():
-    """主函数：演示问题排查功能"""
+def main(cassette: Optional[Cassette] = None):
+    """
+    主函数：演示问题排查功能
+    
+    Args:
+        cassette: 录像（可选），录制或回放collector调用结果
+    """
     
     print("=" * 80)
     print("AI问题排查系统 - 使用示例")
@@ -26,7 +41,8 @@ def main():
     print("\n1. 初始化协调者Agent...")
     coordinator = CoordinatorAgent(
         api_key=API_KEY,
-        base_url=BASE_URL
+        base_url=BASE_URL,
+        cassette=cassette
     )
     print("   ✓ 协调者Agent初始化完成")
     
@@ -138,8 +154,26 @@ def test_individual_agents():
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="AI问题排查系统使用示例")
+    parser.add_argument("--record", metavar="PATH", help="录制大模型请求和collector调用结果到录像文件")
+    parser.add_argument("--replay", metavar="PATH", help="回放录像文件，不访问网络")
+    parser.add_argument("--timing", action="store_true", help="回放时按录制时的耗时等待")
+    args = parser.parse_args()
+    
+    cassette = None
+    if args.record:
+        cassette = Cassette(args.record, MODE_RECORD)
+    elif args.replay:
+        cassette = Cassette(args.replay, timing=args.timing)
+    if cassette is not None:
+        llm_client.set_cassette(cassette)
+    
     # 运行主示例
-    main()
+    main(cassette)
+    
+    if cassette is not None:
+        cassette.close()
+        print(f"录像: {cassette.stats()}")
     
     # 可选：测试单个Agent
     # test_individual_agents()
@@ -0,0 +1,422 @@
+"""
+离线模拟大模型
+功能：按脚本化的排查过程（每轮调用哪些collector、回复什么结论）生成模型回复，
+并按可配置的延迟分布模拟接口耗时，不产生任何费用：
+1. FakeChatModel：进程内的聊天模型，通过 llm_client.set_chat_model_factory 替换所有Agent的模型
+2. FakeOpenAIServer：OpenAI兼容的HTTP服务（/v1/chat/completions，支持流式），
+   把 base_url 指向它即可经过真实的HTTP客户端、重试和限流链路
+
+排查脚本（JSON）格式：
+    {
+      "rounds": [
+        {"tool_calls": [{"name": "log_collector", "args": {"query": "..."}}], "answer": "... 置信度: 60"},
+        {"tool_calls": [], "answer": "结论: ... 置信度: 85"}
+      ],
+      "root_cause": "...",
+      "sub_agent_answer": "子Agent对 {query} 的回答"
+    }
+协调者给出每轮回复时一并调用 submit_verdict 提交结论；某一轮设置 "submit_verdict": false 时
+只回复文本，用于模拟未提交结论、由单独的结构化输出补齐的情况；设置 "early_verdict": "置信度: 95" 时
+在调用collector的同一次回复中按该文本提前提交结论，用于模拟过早提交结论的模型
+"""
+import asyncio
+import json
+import logging
+import random
+import re
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Sequence
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+from conversation_memory import estimate_text_tokens
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 结构化结论的工具名（investigation_verdict.InvestigationVerdict）
+VERDICT_TOOL = "InvestigationVerdict"
+
+# 协调者提交结论的工具名（investigation_verdict.VERDICT_TOOL）
+SUBMIT_VERDICT_TOOL = "submit_verdict"
+
+# 低于该置信度时模拟的结论带有待确认问题
+OPEN_QUESTION_BELOW = 80.0
+
+_CONFIDENCE_PATTERN = re.compile(r"置信度[：:为是]?\s*(\d+(?:\.\d+)?)")
+
+# 默认排查脚本：第一轮并发查询日志、代码和数据库，第二轮补充查询代码后给出结论
+DEFAULT_SCRIPT = {
+    "rounds": [
+        {
+            "tool_calls": [
+                {"name": "log_collector", "args": {"query": "查询问题相关的错误日志和调用栈"}},
+                {"name": "code_collector", "args": {"query": "根据错误调用栈查询相关代码"}},
+                {"name": "db_collector", "args": {"query": "查询相关数据记录的状态"}},
+            ],
+            "answer": "初步判断为参数校验失败导致，需要确认校验规则。置信度: 60",
+        },
+        {
+            "tool_calls": [
+                {"name": "prd_collector", "args": {"query": "查询该字段的业务校验规则"}},
+            ],
+            "answer": "结论: 根因是校验规则与上游数据格式不一致，建议调整校验逻辑。置信度: 85",
+        },
+    ],
+    "root_cause": "校验规则与上游数据格式不一致",
+    "sub_agent_answer": "已查询：{query}。结果：发现相关记录和错误信息，详见上述内容。",
+}
+
+
+@dataclass
+class LatencyDistribution:
+    """
+    模拟的接口延迟分布（秒）
+
+    spec 格式：fixed:0.5 | uniform:0.2,1.5 | normal:0.8,0.2 | lognormal:0.8,0.5（中位数, sigma）
+    """
+
+    kind: str = "fixed"
+    params: Sequence[float] = (0.0,)
+    _random: random.Random = field(default_factory=random.Random, repr=False, compare=False)
+
+    @classmethod
+    def parse(cls, spec: str, seed: Optional[int] = None) -> "LatencyDistribution":
+        """
+        解析延迟分布
+
+        Args:
+            spec: 分布描述，如 "lognormal:0.8,0.5"
+            seed: 随机种子（可选）
+
+        Returns:
+            延迟分布
+        """
+        kind, _, values = spec.partition(":")
+        params = tuple(float(value) for value in values.split(",") if value) or (0.0,)
+        expected = {"fixed": 1, "uniform": 2, "normal": 2, "lognormal": 2}
+        if kind not in expected or len(params) != expected[kind]:
+            raise ValueError(f"无效的延迟分布: {spec}")
+        return cls(kind, params, random.Random(seed))
+
+    def sample(self) -> float:
+        """采样一次延迟（秒，不小于0）"""
+        if self.kind == "uniform":
+            value = self._random.uniform(*self.params)
+        elif self.kind == "normal":
+            value = self._random.gauss(*self.params)
+        elif self.kind == "lognormal":
+            median, sigma = self.params
+            value = median * self._random.lognormvariate(0.0, sigma)
+        else:
+            value = self.params[0]
+        return max(0.0, value)
+
+
+def _text(content: Any) -> str:
+    """OpenAI消息内容（字符串或内容块列表）转为文本"""
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "".join(part.get("text", "") if isinstance(part, dict) else str(part) for part in content)
+    return "" if content is None else str(content)
+
+
+class ScriptedTranscript:
+    """按排查脚本生成模型回复（对OpenAI格式的消息和工具定义进行判断，线程安全）"""
+
+    def __init__(self, script: Optional[Dict] = None):
+        """
+        Args:
+            script: 排查脚本（格式见模块说明），默认使用 DEFAULT_SCRIPT
+        """
+        self.script = script or DEFAULT_SCRIPT
+        self.rounds: List[Dict] = self.script["rounds"]
+
+    @classmethod
+    def load(cls, path: str) -> "ScriptedTranscript":
+        """从JSON文件加载排查脚本"""
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def respond(self, messages: List[Dict], tools: Optional[List[Dict]] = None,
+                tool_choice: Any = None) -> Dict:
+        """
+        生成回复
+
+        Args:
+            messages: OpenAI格式的消息列表
+            tools: OpenAI格式的工具定义
+            tool_choice: 工具选择
+
+        Returns:
+            {"content", "tool_calls": [{"id", "name", "args"}], "prompt_tokens", "completion_tokens"}
+        """
+        tool_names = [tool["function"]["name"] for tool in tools or []]
+        last = messages[-1] if messages else {"role": "user", "content": ""}
+        content, tool_calls = "", []
+
+        if VERDICT_TOOL in tool_names:
+            tool_calls = [self._verdict_call(_text(last.get("content")))]
+        elif any(name.endswith("_collector") for name in tool_names):
+            content, tool_calls = self._coordinator_turn(messages, set(tool_names))
+        elif "请基于目前已收集到的信息直接总结" in _text(last.get("content")):
+            # 预算将尽时协调者不带collector工具，直接总结并提交结论
+            content = self.rounds[-1]["answer"]
+            if SUBMIT_VERDICT_TOOL in tool_names:
+                tool_calls = [self._verdict_call(content, SUBMIT_VERDICT_TOOL)]
+        else:
+            query = next((_text(message.get("content")) for message in reversed(messages)
+                          if message.get("role") == "user"), "")
+            content = self.script.get("sub_agent_answer", DEFAULT_SCRIPT["sub_agent_answer"]).format(query=query)
+
+        prompt_tokens = sum(estimate_text_tokens(_text(message.get("content"))) for message in messages)
+        completion_tokens = estimate_text_tokens(content + json.dumps([call["args"] for call in tool_calls],
+                                                                      ensure_ascii=False))
+        return {"content": content, "tool_calls": tool_calls,
+                "prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens}
+
+    def _coordinator_turn(self, messages: List[Dict], tool_names: set):
+        """协调者：每轮（一条用户消息）先按脚本调用collector，收到工具结果后给出本轮回复"""
+        round_index = sum(1 for message in messages if message.get("role") == "user") - 1
+        step = self.rounds[min(max(round_index, 0), len(self.rounds) - 1)]
+        if messages[-1].get("role") == "user":
+            calls = [call for call in step.get("tool_calls", []) if call["name"] in tool_names]
+            if calls:
+                tool_calls = [{"id": f"call_{uuid.uuid4().hex[:12]}", "name": call["name"], "args": call["args"]}
+                              for call in calls]
+                if SUBMIT_VERDICT_TOOL in tool_names and step.get("early_verdict"):
+                    tool_calls.append(self._verdict_call(step["early_verdict"], SUBMIT_VERDICT_TOOL))
+                return "", tool_calls
+        if SUBMIT_VERDICT_TOOL in tool_names and step.get("submit_verdict", True):
+            return step["answer"], [self._verdict_call(step["answer"], SUBMIT_VERDICT_TOOL)]
+        return step["answer"], []
+
+    def _verdict_call(self, instruction: str, name: str = VERDICT_TOOL) -> Dict:
+        """结构化结论：置信度取自待评估的回复文本"""
+        match = _CONFIDENCE_PATTERN.search(instruction)
+        confidence = float(match.group(1)) if match else 50.0
+        return {
+            "id": f"call_{uuid.uuid4().hex[:12]}",
+            "name": name,
+            "args": {
+                "confidence": confidence,
+                "root_cause": self.script.get("root_cause", "") if confidence >= OPEN_QUESTION_BELOW else "",
+                "solution": "",
+                "open_questions": [] if confidence >= OPEN_QUESTION_BELOW else ["需要进一步确认根因"],
+            },
+        }
+
+
+def _message_to_dict(message: BaseMessage) -> Dict:
+    role = {"human": "user", "ai": "assistant", "system": "system", "tool": "tool"}.get(message.type, "user")
+    return {"role": role, "content": message.content}
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    进程内的模拟聊天模型
+
+    用法：
+        llm_client.set_chat_model_factory(lambda **kwargs: FakeChatModel(latency=LatencyDistribution.parse("fixed:0.5")))
+    """
+
+    transcript: Any = None
+    latency: Any = None
+    model_name: str = "fake-chat"
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        # 链路追踪按调用参数中的模型名称命名LLM span
+        return {"model_name": self.model_name}
+
+    def bind_tools(self, tools, *, tool_choice=None, **kwargs):
+        formatted = [convert_to_openai_tool(tool) for tool in tools]
+        return self.bind(tools=formatted, tool_choice=tool_choice, **kwargs)
+
+    def _reply(self, messages: List[BaseMessage], kwargs: Dict) -> ChatResult:
+        transcript = self.transcript or ScriptedTranscript()
+        reply = transcript.respond([_message_to_dict(message) for message in messages],
+                                   kwargs.get("tools"), kwargs.get("tool_choice"))
+        message = AIMessage(
+            content=reply["content"],
+            tool_calls=[{"id": call["id"], "name": call["name"], "args": call["args"]}
+                        for call in reply["tool_calls"]],
+            usage_metadata={
+                "input_tokens": reply["prompt_tokens"],
+                "output_tokens": reply["completion_tokens"],
+                "total_tokens": reply["prompt_tokens"] + reply["completion_tokens"],
+            },
+            response_metadata={"model_name": self.model_name},
+        )
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _delay(self) -> float:
+        return self.latency.sample() if self.latency is not None else 0.0
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager=None, **kwargs: Any) -> ChatResult:
+        time.sleep(self._delay())
+        return self._reply(messages, kwargs)
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager=None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self._delay())
+        return self._reply(messages, kwargs)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """OpenAI兼容接口的请求处理"""
+
+    protocol_version = "HTTP/1.1"
+    server: "FakeOpenAIServer"
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+    def _send_json(self, status: int, payload: Dict) -> None:
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError:
+            self._send_json(400, {"error": {"message": "invalid json"}})
+            return
+        self.server.count(self.path)
+        if self.path.rstrip("/").endswith("/chat/completions"):
+            time.sleep(self.server.latency.sample())
+            self._chat_completion(request)
+        else:
+            self._send_json(404, {"error": {"message": f"unknown path {self.path}"}})
+
+    def _chat_completion(self, request: Dict) -> None:
+        reply = self.server.transcript.respond(request.get("messages", []), request.get("tools"),
+                                               request.get("tool_choice"))
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:16]}"
+        model = request.get("model", "fake-chat")
+        tool_calls = [{"id": call["id"], "type": "function",
+                       "function": {"name": call["name"], "arguments": json.dumps(call["args"], ensure_ascii=False)}}
+                      for call in reply["tool_calls"]]
+        usage = {"prompt_tokens": reply["prompt_tokens"], "completion_tokens": reply["completion_tokens"],
+                 "total_tokens": reply["prompt_tokens"] + reply["completion_tokens"]}
+        finish_reason = "tool_calls" if tool_calls else "stop"
+
+        if not request.get("stream"):
+            message = {"role": "assistant", "content": reply["content"] or None}
+            if tool_calls:
+                message["tool_calls"] = tool_calls
+            self._send_json(200, {
+                "id": completion_id, "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+                "usage": usage,
+            })
+            return
+
+        def chunk(delta: Dict, finish: Optional[str] = None, **extra) -> Dict:
+            return dict({"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                         "model": model, "choices": [{"index": 0, "delta": delta, "finish_reason": finish}]},
+                        **extra)
+
+        chunks = [chunk({"role": "assistant", "content": ""})]
+        if reply["content"]:
+            # 按句切分，模拟增量输出
+            for part in re.findall(r"[^，。,.]+[，。,.]?", reply["content"]):
+                chunks.append(chunk({"content": part}))
+        for index, call in enumerate(tool_calls):
+            chunks.append(chunk({"tool_calls": [dict(call, index=index)]}))
+        chunks.append(chunk({}, finish_reason))
+        if (request.get("stream_options") or {}).get("include_usage"):
+            chunks.append({"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                           "model": model, "choices": [], "usage": usage})
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for event in chunks + ["[DONE]"]:
+            data = event if isinstance(event, str) else json.dumps(event, ensure_ascii=False)
+            payload = f"data: {data}\n\n".encode("utf-8")
+            self.wfile.write(f"{len(payload):x}\r\n".encode("ascii") + payload + b"\r\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    """
+    OpenAI兼容的模拟HTTP服务（在后台线程中运行）
+
+    用法：
+        with FakeOpenAIServer(latency=LatencyDistribution.parse("lognormal:0.8,0.5")) as server:
+            coordinator = CoordinatorAgent("fake-key", server.base_url)
+    """
+
+    daemon_threads = True
+    # 高并发压测时允许更多等待中的连接
+    request_queue_size = 1024
+
+    def __init__(self, transcript: Optional[ScriptedTranscript] = None,
+                 latency: Optional[LatencyDistribution] = None,
+                 host: str = "127.0.0.1", port: int = 0):
+        """
+        Args:
+            transcript: 排查脚本，默认使用 DEFAULT_SCRIPT
+            latency: 聊天接口的延迟分布，默认无延迟
+            host: 监听地址
+            port: 监听端口，0 表示随机选择
+        """
+        super().__init__((host, port), _Handler)
+        self.transcript = transcript or ScriptedTranscript()
+        self.latency = latency or LatencyDistribution()
+        self.requests: Dict[str, int] = {}
+        self._counter_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        """供 CoordinatorAgent / ChatOpenAI 使用的 base_url"""
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def count(self, path: str) -> None:
+        with self._counter_lock:
+            self.requests[path] = self.requests.get(path, 0) + 1
+
+    def start(self) -> "FakeOpenAIServer":
+        """在后台线程中启动服务"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.serve_forever, name="fake-openai", daemon=True)
+            self._thread.start()
+            logger.info(f"模拟OpenAI接口已启动: {self.base_url}")
+        return self
+
+    def stop(self) -> None:
+        """停止服务"""
+        if self._thread is not None:
+            self.shutdown()
+            self._thread.join()
+            self._thread = None
+        self.server_close()
+
+    def __enter__(self) -> "FakeOpenAIServer":
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.stop()
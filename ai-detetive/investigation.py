@@ -0,0 +1,143 @@
+"""
+排查上下文
+功能：保存单次问题排查的状态（轮次、置信度、每轮结论、已执行操作），
+每次 investigate 调用各自创建，通过Agent调用配置传递给collector，
+使同一个协调者Agent实例可以安全地并发执行多个排查
+"""
+import threading
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from budget import InvestigationBudget
+from collector_cache import normalize_query
+
+# 在Agent调用配置 configurable 中保存排查上下文的键名
+CONFIG_KEY = "investigation"
+
+
+@dataclass
+class InvestigationContext:
+    """单次问题排查的上下文"""
+
+    problem_description: str = ""
+    max_rounds: int = 3
+    investigation_id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    current_round: int = 0
+    confidence: float = 0.0
+    findings: List[Dict] = field(default_factory=list)
+    actions_taken: List[Dict] = field(default_factory=list)
+    budget: Optional[InvestigationBudget] = None
+    stop_reason: Optional[str] = None
+    # 恢复中断的排查时，中断前已执行的collector调用结果：(collector名称, 归一化查询) -> 结果
+    replay_results: Dict = field(default_factory=dict, repr=False)
+    # 链路追踪：排查的根span和当前轮次的span（未启用追踪时为空span）
+    span: Any = field(default=None, repr=False, compare=False)
+    round_span: Any = field(default=None, repr=False, compare=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    def record_action(self, tool_name: str, query: str, result: str,
+                      cached: bool = False) -> None:
+        """
+        记录已执行的collector调用（可能由多个线程并发调用）
+
+        Args:
+            tool_name: collector名称
+            query: 查询要求
+            result: 查询结果
+            cached: 结果是否来自缓存
+        """
+        with self._lock:
+            self.actions_taken.append({
+                "tool": tool_name,
+                "query": query,
+                "result": result,
+                "cached": cached
+            })
+
+    def add_finding(self, round_num: int, result: str, verdict: Optional[Dict] = None) -> None:
+        """
+        记录一轮排查结果
+
+        Args:
+            round_num: 轮次
+            result: 协调者本轮的回复
+            verdict: 本轮的结构化结论（InvestigationVerdict.model_dump()）
+        """
+        with self._lock:
+            self.findings.append({
+                "round": round_num,
+                "result": result,
+                "verdict": verdict
+            })
+
+    def replay(self, tool_name: str, query: str) -> Optional[str]:
+        """
+        查找中断前已执行的相同collector调用
+
+        Returns:
+            调用结果，没有时返回 None
+        """
+        return self.replay_results.get((tool_name, normalize_query(query)))
+
+    @classmethod
+    def from_checkpoint(cls, checkpoint: Dict) -> "InvestigationContext":
+        """
+        从检查点（InvestigationStore.load 的返回值）恢复排查上下文
+
+        Args:
+            checkpoint: 检查点
+
+        Returns:
+            排查上下文，已执行的collector调用可通过 replay 回放
+        """
+        state = checkpoint["state"]
+        actions_taken = list(checkpoint["actions_taken"])
+        return cls(
+            problem_description=checkpoint["problem_description"],
+            max_rounds=state["max_rounds"],
+            investigation_id=checkpoint["investigation_id"],
+            current_round=state["current_round"],
+            confidence=state["confidence"],
+            findings=list(state["findings"]),
+            actions_taken=actions_taken,
+            budget=InvestigationBudget.from_dict(state["budget"]) if state.get("budget") else InvestigationBudget(),
+            stop_reason=state.get("stop_reason"),
+            replay_results={(action["tool"], normalize_query(action["query"])): action["result"]
+                            for action in actions_taken}
+        )
+
+    @property
+    def verdict(self) -> Optional[Dict]:
+        """最近一轮的结构化结论，尚未完成任何一轮时为 None"""
+        with self._lock:
+            return self.findings[-1]["verdict"] if self.findings else None
+
+    def to_state(self) -> Dict:
+        """导出为排查状态字典"""
+        with self._lock:
+            return {
+                "investigation_id": self.investigation_id,
+                "current_round": self.current_round,
+                "max_rounds": self.max_rounds,
+                "confidence": self.confidence,
+                "stop_reason": self.stop_reason,
+                "findings": list(self.findings),
+                "actions_taken": list(self.actions_taken),
+                "budget": self.budget.to_dict() if self.budget is not None else None
+            }
+
+
+def get_investigation(config: Optional[Dict]) -> Optional[InvestigationContext]:
+    """
+    从Agent调用配置中取出排查上下文
+
+    Args:
+        config: RunnableConfig
+
+    Returns:
+        排查上下文，直接调用Agent（非 investigate）时为 None
+    """
+    if not config:
+        return None
+    return (config.get("configurable") or {}).get(CONFIG_KEY)
@@ -0,0 +1,129 @@
+"""
+排查过程事件
+功能：流式排查（stream_investigate / astream_investigate）在排查进行中产出的事件，
+供界面或命令行实时展示进度；调用方停止迭代即可取消排查
+"""
+import time
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Any, Dict, List, Optional
+
+from langchain_core.messages import AIMessage, AIMessageChunk, ToolMessage
+
+from investigation_verdict import VERDICT_TOOL, lone_verdict_call
+
+# 工具结果事件中保留的最大字符数
+TOOL_RESULT_PREVIEW_CHARS = 500
+
+
+class EventType(str, Enum):
+    """排查事件类型"""
+
+    ROUND_START = "round_start"      # 开始新一轮排查: {"round", "max_rounds"}
+    TOOL_CALL = "tool_call"          # 协调者发起collector调用: {"tool", "query", "call_id"}
+    TOOL_RESULT = "tool_result"      # collector返回结果（截断）: {"tool", "call_id", "result", "length"}
+    TOKEN = "token"                  # 协调者模型输出的增量文本: {"text"}
+    MESSAGE = "message"              # 协调者本轮的完整回复: {"content"}
+    CONFIDENCE = "confidence"        # 本轮结论与停止判断: {"confidence", "verdict", "stop", "reason"}
+    ERROR = "error"                  # 排查失败: {"error"}
+    DONE = "done"                    # 排查结束（总是最后一个事件）: {"result"}
+
+
+@dataclass
+class InvestigationEvent:
+    """排查事件"""
+
+    type: EventType
+    investigation_id: str
+    round: int
+    data: Dict[str, Any] = field(default_factory=dict)
+    timestamp: float = field(default_factory=time.time)
+
+    def to_dict(self) -> Dict:
+        """导出为可JSON序列化的字典"""
+        return {
+            "type": self.type.value,
+            "investigation_id": self.investigation_id,
+            "round": self.round,
+            "data": self.data,
+            "timestamp": self.timestamp
+        }
+
+
+def events_from_stream(investigation_id: str, round_num: int, mode: str,
+                       chunk: Any) -> List[InvestigationEvent]:
+    """
+    将Agent流式输出（stream_mode=["updates", "messages"]）转换为排查事件
+
+    Args:
+        investigation_id: 排查ID
+        round_num: 当前轮次
+        mode: 流模式（updates / messages）
+        chunk: 对应模式的输出
+
+    Returns:
+        事件列表
+    """
+    events: List[InvestigationEvent] = []
+
+    if mode == "messages":
+        message, _ = chunk
+        if isinstance(message, AIMessageChunk) and isinstance(message.content, str) and message.content:
+            events.append(InvestigationEvent(EventType.TOKEN, investigation_id, round_num,
+                                             {"text": message.content}))
+        return events
+
+    if mode != "updates" or not isinstance(chunk, dict):
+        return events
+
+    for update in chunk.values():
+        if not isinstance(update, dict):
+            continue
+        for message in update.get("messages") or []:
+            # 提交结论不是collector调用，由 CONFIDENCE 事件展示
+            if isinstance(message, ToolMessage) and message.name == VERDICT_TOOL:
+                continue
+            if isinstance(message, ToolMessage):
+                content = message.content if isinstance(message.content, str) else str(message.content)
+                events.append(InvestigationEvent(EventType.TOOL_RESULT, investigation_id, round_num, {
+                    "tool": message.name,
+                    "call_id": message.tool_call_id,
+                    "result": content[:TOOL_RESULT_PREVIEW_CHARS],
+                    "length": len(content)
+                }))
+            elif isinstance(message, AIMessage):
+                tool_calls = [call for call in message.tool_calls if call["name"] != VERDICT_TOOL]
+                for tool_call in tool_calls:
+                    events.append(InvestigationEvent(EventType.TOOL_CALL, investigation_id, round_num, {
+                        "tool": tool_call["name"],
+                        "query": tool_call["args"].get("query", ""),
+                        "call_id": tool_call.get("id")
+                    }))
+                if not tool_calls:
+                    events.append(InvestigationEvent(EventType.MESSAGE, investigation_id, round_num,
+                                                     {"content": message.content}))
+    return events
+
+
+def submitted_verdict(mode: str, chunk: Any) -> Optional[Dict]:
+    """
+    从Agent流式输出中取出协调者通过 submit_verdict 工具提交的结论
+
+    Args:
+        mode: 流模式（updates / messages）
+        chunk: 对应模式的输出
+
+    Returns:
+        结论参数，本段输出没有提交结论、或结论与其他工具在同一次回复中调用（已被拒绝）时为 None
+    """
+    if mode != "updates" or not isinstance(chunk, dict):
+        return None
+    for update in chunk.values():
+        if not isinstance(update, dict):
+            continue
+        for message in update.get("messages") or []:
+            if isinstance(message, AIMessage):
+                verdict = lone_verdict_call(message.tool_calls)
+                if verdict is not None:
+                    return verdict
+    return None
@@ -0,0 +1,201 @@
+"""
+排查检查点存储
+功能：把排查状态持久化到SQLite：每轮结束后保存协调者会话消息、各轮结论和预算使用情况，
+每次collector调用后追加调用结果；进程中断后 CoordinatorAgent.resume 从最后一个检查点继续，
+中断前已执行的collector调用直接回放结果，不再重复调用子Agent
+"""
+import json
+import logging
+import sqlite3
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+from langchain_core.messages import BaseMessage, messages_from_dict, messages_to_dict
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 默认数据库文件
+DEFAULT_DB_PATH = "investigations.db"
+
+# 排查状态
+STATUS_RUNNING = "running"
+STATUS_COMPLETED = "completed"
+STATUS_FAILED = "failed"
+STATUS_CANCELLED = "cancelled"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS investigations (
+    id TEXT PRIMARY KEY,
+    problem_description TEXT NOT NULL,
+    max_rounds INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    current_round INTEGER NOT NULL DEFAULT 0,
+    state TEXT NOT NULL,
+    messages TEXT,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS investigation_actions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    investigation_id TEXT NOT NULL,
+    round INTEGER NOT NULL,
+    tool TEXT NOT NULL,
+    query TEXT NOT NULL,
+    result TEXT NOT NULL,
+    cached INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_investigation_actions ON investigation_actions (investigation_id, id);
+"""
+
+
+def _dumps(value) -> str:
+    return json.dumps(value, ensure_ascii=False, default=str)
+
+
+class InvestigationStore:
+    """基于SQLite的排查检查点存储（线程安全，多个进程也可共用同一数据库文件）"""
+
+    def __init__(self, db_path: str = DEFAULT_DB_PATH):
+        """
+        初始化检查点存储
+
+        Args:
+            db_path: SQLite数据库文件路径
+        """
+        self.db_path = db_path
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def save(self, state: Dict, problem_description: str, status: str = STATUS_RUNNING,
+             messages: Optional[List[BaseMessage]] = None, result: Optional[Dict] = None,
+             error: Optional[str] = None) -> None:
+        """
+        保存排查检查点（collector调用记录另行追加，不随检查点重复写入）
+
+        Args:
+            state: InvestigationContext.to_state() 的返回值
+            problem_description: 问题描述
+            status: 排查状态
+            messages: 协调者会话消息（可选，None 表示保留上次保存的消息）
+            result: 排查结束时的结果（可选）
+            error: 失败原因（可选）
+        """
+        now = time.time()
+        state = {key: value for key, value in state.items() if key != "actions_taken"}
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO investigations (id, problem_description, max_rounds, status, current_round, "
+                "state, messages, result, error, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET status = excluded.status, "
+                "current_round = excluded.current_round, state = excluded.state, "
+                "messages = COALESCE(excluded.messages, investigations.messages), "
+                "result = excluded.result, error = excluded.error, updated_at = excluded.updated_at",
+                (state["investigation_id"], problem_description, state["max_rounds"], status,
+                 state["current_round"], _dumps(state),
+                 _dumps(messages_to_dict(messages)) if messages is not None else None,
+                 _dumps(result) if result is not None else None, error, now, now)
+            )
+
+    def record_action(self, investigation_id: str, round_num: int, tool: str, query: str,
+                      result: str, cached: bool = False) -> None:
+        """
+        追加一次collector调用结果
+
+        Args:
+            investigation_id: 排查ID
+            round_num: 轮次
+            tool: collector名称
+            query: 查询要求
+            result: 查询结果
+            cached: 结果是否来自缓存
+        """
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO investigation_actions (investigation_id, round, tool, query, result, cached, "
+                "created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (investigation_id, round_num, tool, query, result, int(cached), time.time())
+            )
+
+    def load(self, investigation_id: str) -> Optional[Dict]:
+        """
+        读取排查检查点
+
+        Args:
+            investigation_id: 排查ID
+
+        Returns:
+            {"investigation_id", "problem_description", "status", "state", "messages", "actions_taken",
+             "result", "error"}，不存在时返回 None
+        """
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM investigations WHERE id = ?", (investigation_id,)).fetchone()
+            if row is None:
+                return None
+            actions = conn.execute(
+                "SELECT tool, query, result, cached FROM investigation_actions "
+                "WHERE investigation_id = ? ORDER BY id",
+                (investigation_id,)
+            ).fetchall()
+        return {
+            "investigation_id": row["id"],
+            "problem_description": row["problem_description"],
+            "status": row["status"],
+            "state": json.loads(row["state"]),
+            "messages": messages_from_dict(json.loads(row["messages"])) if row["messages"] else [],
+            "actions_taken": [
+                {"tool": action["tool"], "query": action["query"], "result": action["result"],
+                 "cached": bool(action["cached"])}
+                for action in actions
+            ],
+            "result": json.loads(row["result"]) if row["result"] else None,
+            "error": row["error"],
+        }
+
+    def list_investigations(self, status: Optional[str] = None, limit: int = 100) -> List[Dict]:
+        """
+        按更新时间倒序列出排查
+
+        Args:
+            status: 只列出该状态的排查（可选）
+            limit: 最多返回条数
+
+        Returns:
+            [{"investigation_id", "problem_description", "status", "current_round", "updated_at"}]
+        """
+        with self._connect() as conn:
+            if status is None:
+                rows = conn.execute("SELECT * FROM investigations ORDER BY updated_at DESC LIMIT ?",
+                                    (limit,)).fetchall()
+            else:
+                rows = conn.execute("SELECT * FROM investigations WHERE status = ? "
+                                    "ORDER BY updated_at DESC LIMIT ?", (status, limit)).fetchall()
+        return [{
+            "investigation_id": row["id"],
+            "problem_description": row["problem_description"],
+            "status": row["status"],
+            "current_round": row["current_round"],
+            "updated_at": row["updated_at"],
+        } for row in rows]
+
+    def delete(self, investigation_id: str) -> None:
+        """删除排查检查点及其collector调用记录"""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM investigation_actions WHERE investigation_id = ?", (investigation_id,))
+            conn.execute("DELETE FROM investigations WHERE id = ?", (investigation_id,))
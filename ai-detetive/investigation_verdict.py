@@ -0,0 +1,164 @@
+"""
+排查结论与停止策略
+功能：每轮排查结束后，协调者在给出本轮回复的同时调用 submit_verdict 工具提交结构化结论
+（置信度、根因、解决方案、待确认问题），未提交时才单独调用一次结构化输出补齐；
+与collector在同一次回复中调用的 submit_verdict 被拒绝，协调者看到collector结果后再单独提交，
+停止策略根据置信度阈值和相对上一轮的置信度提升决定是否继续下一轮：
+结论可靠时不再浪费轮次，证据不足时不会过早结束
+"""
+import logging
+import re
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from langchain.agents.middleware import AgentMiddleware
+from langchain_core.messages import AIMessage, ToolMessage
+from pydantic import BaseModel, Field
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 默认停止阈值：置信度达到该值且没有待确认问题时结束排查
+DEFAULT_CONFIDENCE_THRESHOLD = 80.0
+
+# 默认最小提升：置信度相对上一轮的提升低于该值时视为继续排查收益不大
+DEFAULT_MIN_GAIN = 5.0
+
+# 默认收敛下限：置信度不再提升且不低于该值时结束排查，低于该值时继续寻找证据
+DEFAULT_PLATEAU_FLOOR = 60.0
+
+# 协调者提交本轮结论的工具名称（调用后本轮结束，不再回到模型）
+VERDICT_TOOL = "submit_verdict"
+
+# 提交结论工具的说明
+VERDICT_TOOL_DESCRIPTION = """在给出本轮排查回复的同时调用，提交本轮的结构化结论，调用后本轮排查结束。
+不要与collector在同一次回复中调用：需要先看到collector的结果再提交结论。
+confidence 只有证据直接支持根因时才给出高分，推测或证据不足时给出低分；
+root_cause、solution 尚未确定时留空；open_questions 列出仍需确认的问题或缺少的证据"""
+
+# submit_verdict 与其他工具在同一次回复中调用时返回给协调者的提示
+VERDICT_DEFERRED_MESSAGE = ("结论未提交：submit_verdict 与其他工具在同一次回复中调用，此时还没有看到这些工具的结果。"
+                            "请先查看工具结果，再单独调用 submit_verdict 提交本轮结论")
+
+# 协调者未提交结论时，单独生成结构化结论的指令
+VERDICT_INSTRUCTION = """请根据下面的问题描述和本轮排查结果，给出结构化的排查结论：
+- confidence：对根因判断的置信度（0-100），只有证据直接支持根因时才给出高分，推测或证据不足时给出低分
+- root_cause：根因的简要描述，尚未确定时留空
+- solution：解决方案或建议，尚未确定时留空
+- open_questions：仍需确认的问题或缺少的证据，没有时为空列表
+
+问题描述：
+{problem}
+
+本轮排查结果：
+{response}"""
+
+
+def lone_verdict_call(tool_calls: Sequence[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    取出一次回复中有效的 submit_verdict 调用：只有回复中没有其他工具调用时结论才有效
+
+    Args:
+        tool_calls: 协调者一次回复中的工具调用
+
+    Returns:
+        结论参数，没有提交或与其他工具一起调用时为 None
+    """
+    verdicts = [call for call in tool_calls if call["name"] == VERDICT_TOOL]
+    if not verdicts or len(verdicts) < len(tool_calls):
+        return None
+    return verdicts[-1]["args"]
+
+
+class VerdictTurnMiddleware(AgentMiddleware):
+    """
+    拒绝与其他工具在同一次回复中调用的 submit_verdict：返回错误提示而不结束本轮，
+    协调者在下一次模型调用中看到collector结果和提示后再单独提交结论
+    """
+
+    @staticmethod
+    def _deferred(request) -> Optional[ToolMessage]:
+        tool_call = request.tool_call
+        if tool_call["name"] != VERDICT_TOOL:
+            return None
+        messages = request.state.get("messages", []) if isinstance(request.state, dict) else []
+        message = next((message for message in reversed(messages) if isinstance(message, AIMessage)), None)
+        if message is None or lone_verdict_call(message.tool_calls) is not None:
+            return None
+        logger.info("submit_verdict 与其他工具在同一次回复中调用，等待工具结果后重新提交")
+        return ToolMessage(content=VERDICT_DEFERRED_MESSAGE, tool_call_id=tool_call["id"],
+                           name=VERDICT_TOOL, status="error")
+
+    def wrap_tool_call(self, request, handler):
+        deferred = self._deferred(request)
+        return deferred if deferred is not None else handler(request)
+
+    async def awrap_tool_call(self, request, handler):
+        deferred = self._deferred(request)
+        return deferred if deferred is not None else await handler(request)
+
+
+class InvestigationVerdict(BaseModel):
+    """一轮排查的结构化结论"""
+
+    confidence: float = Field(description="对根因判断的置信度，0-100", ge=0, le=100)
+    root_cause: str = Field(default="", description="根因的简要描述，尚未确定时为空")
+    solution: str = Field(default="", description="解决方案或建议，尚未确定时为空")
+    open_questions: List[str] = Field(default_factory=list, description="仍需确认的问题或缺少的证据")
+
+    @classmethod
+    def from_text(cls, text: str) -> "InvestigationVerdict":
+        """
+        结构化输出不可用时，从回复文本中解析结论：没有明确置信度时按 0 处理，
+        使停止策略继续排查而不是误判为已完成
+
+        Args:
+            text: 协调者的回复
+
+        Returns:
+            结论
+        """
+        confidence = 0.0
+        match = re.search(r"(?:置信度|confidence)\s*(?:评分)?\s*[：:为是]?\s*(\d+(?:\.\d+)?)", text, re.IGNORECASE)
+        if match:
+            confidence = max(0.0, min(100.0, float(match.group(1))))
+        return cls(confidence=confidence, open_questions=[] if match else ["未能解析本轮结论"])
+
+
+@dataclass
+class StoppingPolicy:
+    """
+    排查停止策略：
+    1. 置信度达到 confidence_threshold 且没有待确认问题时停止
+    2. 置信度相对上一轮提升不足 min_gain 且不低于 plateau_floor 时停止（继续排查收益不大）
+    3. 其余情况继续，直到达到最大轮数或预算将尽
+    """
+
+    confidence_threshold: float = DEFAULT_CONFIDENCE_THRESHOLD
+    min_gain: float = DEFAULT_MIN_GAIN
+    plateau_floor: float = DEFAULT_PLATEAU_FLOOR
+
+    def decide(self, verdict: InvestigationVerdict,
+               previous_confidence: Optional[float]) -> Tuple[bool, str]:
+        """
+        判断是否结束排查
+
+        Args:
+            verdict: 本轮结论
+            previous_confidence: 上一轮的置信度，第一轮为 None
+
+        Returns:
+            (是否结束, 原因)
+        """
+        confidence = verdict.confidence
+        if confidence >= self.confidence_threshold and not verdict.open_questions:
+            return True, f"置信度 {confidence:g} 达到阈值 {self.confidence_threshold:g}"
+
+        if previous_confidence is not None:
+            gain = confidence - previous_confidence
+            if gain < self.min_gain and confidence >= self.plateau_floor:
+                return True, f"置信度 {confidence:g} 相对上一轮提升 {gain:g}，继续排查收益不大"
+            return False, f"置信度 {confidence:g}（提升 {gain:g}），继续排查"
+
+        return False, f"置信度 {confidence:g}，继续排查"
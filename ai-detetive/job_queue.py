@@ -0,0 +1,500 @@
+"""
+排查任务队列
+功能：告警等来源提交的排查任务持久化到SQLite队列，由可配置数量的工作线程并发执行
+CoordinatorAgent.investigate；每个任务记录状态、结果和重试次数，失败后按退避时间重新排队。
+领取任务时写入执行者和租约到期时间，工作线程池定期续约；执行者异常退出后任务在租约到期后重新排队，
+多个进程共用同一数据库时不会重复执行其他进程仍在执行的任务；执行次数用完的任务标记为失败。
+聊天接口的全局限流见 llm_client.set_rate_limit
+"""
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional
+
+from alert_intake import DEFAULT_COALESCE_WINDOW, alert_fingerprint
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 默认数据库文件
+DEFAULT_DB_PATH = "investigation_jobs.db"
+
+# 任务状态
+STATUS_PENDING = "pending"
+STATUS_RUNNING = "running"
+STATUS_SUCCEEDED = "succeeded"
+STATUS_FAILED = "failed"
+
+# 默认最大执行次数（含首次）
+DEFAULT_MAX_ATTEMPTS = 3
+
+# 重试退避基数（秒），第n次重试等待 base * 2^(n-1)
+RETRY_BACKOFF_SECONDS = 30.0
+
+# 任务租约时长（秒），执行者在此期间未续约则视为已退出
+DEFAULT_LEASE_SECONDS = 300.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    problem_description TEXT NOT NULL,
+    max_rounds INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    available_at REAL NOT NULL,
+    fingerprint TEXT,
+    alert_count INTEGER NOT NULL DEFAULT 1,
+    owner TEXT,
+    lease_expires_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status_available ON jobs (status, available_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_fingerprint ON jobs (fingerprint, created_at);
+"""
+
+
+@dataclass
+class Job:
+    """排查任务"""
+
+    id: str
+    problem_description: str
+    max_rounds: int
+    status: str
+    attempts: int
+    max_attempts: int
+    result: Optional[Dict]
+    error: Optional[str]
+    created_at: float
+    updated_at: float
+    fingerprint: Optional[str] = None
+    alert_count: int = 1
+    owner: Optional[str] = None
+    lease_expires_at: Optional[float] = None
+
+    @classmethod
+    def from_row(cls, row: sqlite3.Row) -> "Job":
+        return cls(
+            id=row["id"],
+            problem_description=row["problem_description"],
+            max_rounds=row["max_rounds"],
+            status=row["status"],
+            attempts=row["attempts"],
+            max_attempts=row["max_attempts"],
+            result=json.loads(row["result"]) if row["result"] else None,
+            error=row["error"],
+            created_at=row["created_at"],
+            updated_at=row["updated_at"],
+            fingerprint=row["fingerprint"],
+            alert_count=row["alert_count"],
+            owner=row["owner"],
+            lease_expires_at=row["lease_expires_at"],
+        )
+
+
+def default_owner() -> str:
+    """执行者标识：主机名、进程号和随机后缀"""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class JobQueue:
+    """基于SQLite的持久化任务队列（线程安全，多个进程也可共用同一数据库文件）"""
+
+    def __init__(self, db_path: str = DEFAULT_DB_PATH):
+        """
+        初始化任务队列
+
+        Args:
+            db_path: SQLite数据库文件路径
+        """
+        self.db_path = db_path
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def submit(self, problem_description: str, max_rounds: int = 3,
+               max_attempts: int = DEFAULT_MAX_ATTEMPTS, fingerprint: Optional[str] = None,
+               coalesce_window: float = 0) -> str:
+        """
+        提交排查任务
+
+        Args:
+            problem_description: 问题描述
+            max_rounds: 最大排查轮数
+            max_attempts: 最大执行次数（含首次）
+            fingerprint: 问题指纹（可选），窗口内已有同指纹的未失败任务时合并到该任务
+            coalesce_window: 合并窗口（秒），从已有任务提交时开始计算；未完成的任务总是合并
+
+        Returns:
+            任务ID（合并时为已有任务的ID）
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if fingerprint is not None:
+                    row = conn.execute(
+                        "SELECT id FROM jobs WHERE fingerprint = ? AND "
+                        "(status IN (?, ?) OR (status = ? AND created_at >= ?)) "
+                        "ORDER BY created_at DESC LIMIT 1",
+                        (fingerprint, STATUS_PENDING, STATUS_RUNNING, STATUS_SUCCEEDED, now - coalesce_window)
+                    ).fetchone()
+                    if row is not None:
+                        conn.execute("UPDATE jobs SET alert_count = alert_count + 1 WHERE id = ?", (row["id"],))
+                        conn.execute("COMMIT")
+                        logger.info(f"合并到已有排查任务: {row['id']}")
+                        return row["id"]
+                conn.execute(
+                    "INSERT INTO jobs (id, problem_description, max_rounds, status, max_attempts, "
+                    "created_at, updated_at, available_at, fingerprint) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (job_id, problem_description, max_rounds, STATUS_PENDING, max_attempts, now, now, now,
+                     fingerprint)
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        logger.info(f"提交排查任务: {job_id}")
+        return job_id
+
+    def submit_alert(self, problem_description: str, max_rounds: int = 3,
+                     max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+                     coalesce_window: float = DEFAULT_COALESCE_WINDOW) -> str:
+        """
+        提交告警：按告警指纹合并，同一故障的大量告警只产生一个排查任务
+
+        Returns:
+            任务ID（合并时为已有任务的ID）
+        """
+        return self.submit(problem_description, max_rounds, max_attempts,
+                           fingerprint=alert_fingerprint(problem_description),
+                           coalesce_window=coalesce_window)
+
+    @staticmethod
+    def _reclaim_expired(conn: sqlite3.Connection, now: float) -> Dict[str, int]:
+        """租约已到期的执行中任务：执行次数用完的标记为失败，其余重新排队（调用方已开启事务）"""
+        failed = conn.execute(
+            "UPDATE jobs SET status = ?, error = ?, owner = NULL, lease_expires_at = NULL, updated_at = ? "
+            "WHERE status = ? AND lease_expires_at < ? AND attempts >= max_attempts",
+            (STATUS_FAILED, "执行者在执行中退出，执行次数已用完", now, STATUS_RUNNING, now)
+        ).rowcount
+        requeued = conn.execute(
+            "UPDATE jobs SET status = ?, owner = NULL, lease_expires_at = NULL, updated_at = ?, available_at = ? "
+            "WHERE status = ? AND lease_expires_at < ?",
+            (STATUS_PENDING, now, now, STATUS_RUNNING, now)
+        ).rowcount
+        if failed or requeued:
+            logger.warning(f"租约到期的任务: 重新排队 {requeued} 个，执行次数用完标记失败 {failed} 个")
+        return {"requeued": requeued, "failed": failed}
+
+    def claim(self, owner: Optional[str] = None, lease_seconds: float = DEFAULT_LEASE_SECONDS) -> Optional[Job]:
+        """
+        领取一个可执行的任务（按提交顺序），并将其标记为执行中；
+        领取前先处理租约已到期的执行中任务
+
+        Args:
+            owner: 执行者标识（可选，默认生成）
+            lease_seconds: 租约时长（秒），需在到期前调用 heartbeat 续约
+
+        Returns:
+            任务，没有可执行任务时返回 None
+        """
+        owner = owner or default_owner()
+        now = time.time()
+        with self._connect() as conn:
+            # BEGIN IMMEDIATE 保证多个工作线程/进程不会领取同一任务
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._reclaim_expired(conn, now)
+                row = conn.execute(
+                    "SELECT * FROM jobs WHERE status = ? AND available_at <= ? "
+                    "ORDER BY created_at LIMIT 1",
+                    (STATUS_PENDING, now)
+                ).fetchone()
+                if row is None:
+                    conn.execute("COMMIT")
+                    return None
+                lease_expires_at = now + lease_seconds
+                conn.execute(
+                    "UPDATE jobs SET status = ?, attempts = attempts + 1, owner = ?, lease_expires_at = ?, "
+                    "updated_at = ? WHERE id = ?",
+                    (STATUS_RUNNING, owner, lease_expires_at, now, row["id"])
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        job = Job.from_row(row)
+        job.status = STATUS_RUNNING
+        job.attempts += 1
+        job.owner = owner
+        job.lease_expires_at = lease_expires_at
+        return job
+
+    def heartbeat(self, owner: str, lease_seconds: float = DEFAULT_LEASE_SECONDS) -> int:
+        """
+        为执行者的所有执行中任务续约
+
+        Args:
+            owner: 执行者标识
+            lease_seconds: 租约时长（秒）
+
+        Returns:
+            续约的任务数
+        """
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET lease_expires_at = ? WHERE owner = ? AND status = ?",
+                (now + lease_seconds, owner, STATUS_RUNNING)
+            )
+            return cursor.rowcount
+
+    def complete(self, job_id: str, result: Dict, owner: Optional[str] = None) -> bool:
+        """
+        标记任务成功
+
+        Args:
+            job_id: 任务ID
+            result: 排查结果
+            owner: 执行者标识（可选）；指定时只有仍持有该任务时才写入
+
+        Returns:
+            是否写入（租约已到期、任务已被其他执行者领取时为 False）
+        """
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = NULL, owner = NULL, lease_expires_at = NULL, "
+                "updated_at = ? WHERE id = ? AND (? IS NULL OR owner = ?)",
+                (STATUS_SUCCEEDED, json.dumps(result, ensure_ascii=False, default=str), time.time(), job_id,
+                 owner, owner)
+            )
+            return cursor.rowcount > 0
+
+    def fail(self, job_id: str, error: str, result: Optional[Dict] = None, owner: Optional[str] = None) -> str:
+        """
+        标记任务失败：未达到最大执行次数时按退避时间重新排队
+
+        Args:
+            job_id: 任务ID
+            error: 失败原因
+            result: 失败时的排查结果（可选）
+            owner: 执行者标识（可选）；指定时只有仍持有该任务时才写入
+
+        Returns:
+            任务的新状态（pending 或 failed；未写入时为任务的当前状态）
+        """
+        now = time.time()
+        with self._connect() as conn:
+            # 读取执行次数和写入新状态在同一个 IMMEDIATE 事务中，期间任务不会被其他执行者领取或回收
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT status, owner, attempts, max_attempts FROM jobs WHERE id = ?",
+                                   (job_id,)).fetchone()
+                if row is None:
+                    conn.execute("COMMIT")
+                    return STATUS_FAILED
+                if row["attempts"] < row["max_attempts"]:
+                    status = STATUS_PENDING
+                    available_at = now + RETRY_BACKOFF_SECONDS * 2 ** (row["attempts"] - 1)
+                else:
+                    status = STATUS_FAILED
+                    available_at = now
+                cursor = conn.execute(
+                    "UPDATE jobs SET status = ?, error = ?, result = ?, owner = NULL, lease_expires_at = NULL, "
+                    "updated_at = ?, available_at = ? WHERE id = ? AND (? IS NULL OR owner = ?)",
+                    (status, error, json.dumps(result, ensure_ascii=False, default=str) if result else None,
+                     now, available_at, job_id, owner, owner)
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        if cursor.rowcount == 0:
+            logger.warning(f"任务 {job_id} 已不由当前执行者持有，忽略失败结果")
+            return row["status"]
+        return status
+
+    def recover(self) -> Dict[str, int]:
+        """
+        处理租约已到期的执行中任务（执行者异常退出），仍在续约的任务不受影响
+
+        Returns:
+            {"requeued": 重新排队的任务数, "failed": 执行次数用完而标记失败的任务数}
+        """
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = self._reclaim_expired(conn, time.time())
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return result
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """查询任务"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return Job.from_row(row) if row else None
+
+    def list_jobs(self, status: Optional[str] = None, limit: int = 100) -> List[Job]:
+        """
+        按提交时间倒序列出任务
+
+        Args:
+            status: 只列出该状态的任务（可选）
+            limit: 最多返回条数
+        """
+        with self._connect() as conn:
+            if status is None:
+                rows = conn.execute("SELECT * FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,)).fetchall()
+            else:
+                rows = conn.execute("SELECT * FROM jobs WHERE status = ? ORDER BY created_at DESC LIMIT ?",
+                                    (status, limit)).fetchall()
+        return [Job.from_row(row) for row in rows]
+
+    def counts(self) -> Dict[str, int]:
+        """各状态的任务数"""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+        return {row["status"]: row["n"] for row in rows}
+
+
+class InvestigationWorkerPool:
+    """
+    排查工作线程池：各线程从队列领取任务并调用 coordinator.investigate
+
+    用法：
+        queue = JobQueue("jobs.db")
+        pool = InvestigationWorkerPool(coordinator, queue, workers=8)
+        pool.start()
+        queue.submit("订单创建失败，错误提示为'数据校验失败'")
+    """
+
+    def __init__(self, coordinator, queue: JobQueue, workers: int = 4,
+                 poll_interval: float = 1.0, lease_seconds: float = DEFAULT_LEASE_SECONDS):
+        """
+        初始化工作线程池
+
+        Args:
+            coordinator: CoordinatorAgent 实例（可被多个线程并发调用）
+            queue: 任务队列
+            workers: 工作线程数
+            poll_interval: 队列为空时的轮询间隔（秒）
+            lease_seconds: 任务租约时长（秒），每隔三分之一租约续约一次
+        """
+        self.coordinator = coordinator
+        self.queue = queue
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        # 每个工作线程使用独立的执行者标识：同一进程内其他线程领取了该任务时，租约到期的旧线程不能写回结果
+        self.owners: List[str] = []
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def start(self) -> None:
+        """启动工作线程和续约线程，并处理租约已到期的任务"""
+        if self._threads:
+            return
+        self.queue.recover()
+        self._stop.clear()
+        self.owners = [default_owner() for _ in range(self.workers)]
+        for i, owner in enumerate(self.owners):
+            thread = threading.Thread(target=self._work, args=(owner,), name=f"investigation-worker-{i}",
+                                      daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        heartbeat = threading.Thread(target=self._heartbeat, args=(list(self._threads), list(self.owners)),
+                                     name="investigation-heartbeat", daemon=True)
+        heartbeat.start()
+        self._threads.append(heartbeat)
+        logger.info(f"排查工作线程已启动: {self.workers} 个（执行者 {', '.join(self.owners)}）")
+
+    def stop(self, wait: bool = True, timeout: Optional[float] = None) -> None:
+        """
+        停止领取新任务
+
+        Args:
+            wait: 是否等待执行中的任务完成
+            timeout: 等待超时时间（秒）
+        """
+        self._stop.set()
+        if wait:
+            for thread in self._threads:
+                thread.join(timeout)
+        self._threads = []
+
+    def _heartbeat(self, workers: List[threading.Thread], owners: List[str]) -> None:
+        # 停止领取新任务后继续为执行中的任务续约，直到所有工作线程退出
+        interval = self.lease_seconds / 3
+        next_beat = time.monotonic() + interval
+        while any(worker.is_alive() for worker in workers):
+            time.sleep(min(interval, self.poll_interval))
+            if time.monotonic() < next_beat:
+                continue
+            next_beat = time.monotonic() + interval
+            for owner in owners:
+                try:
+                    self.queue.heartbeat(owner, self.lease_seconds)
+                except sqlite3.Error as e:
+                    logger.error(f"任务续约失败（{owner}）: {str(e)}")
+
+    def _work(self, owner: str) -> None:
+        while not self._stop.is_set():
+            try:
+                job = self.queue.claim(owner, self.lease_seconds)
+            except sqlite3.Error as e:
+                logger.error(f"领取任务失败: {str(e)}")
+                job = None
+            if job is None:
+                self._stop.wait(self.poll_interval)
+                continue
+            self.run_job(job)
+
+    def run_job(self, job: Job) -> None:
+        """执行单个任务并写回结果（只有任务仍由领取时的执行者 job.owner 持有时才写入）"""
+        logger.info(f"执行排查任务 {job.id}（第 {job.attempts}/{job.max_attempts} 次）")
+        try:
+            # 配置了排查检查点存储时以任务ID作为排查ID，重试时从上次中断的检查点继续
+            store = getattr(self.coordinator, "store", None)
+            if store is not None and store.load(job.id) is not None:
+                result = self.coordinator.resume(job.id)
+            else:
+                result = self.coordinator.investigate(job.problem_description, max_rounds=job.max_rounds,
+                                                      investigation_id=job.id)
+        except Exception as e:
+            status = self.queue.fail(job.id, str(e), owner=job.owner)
+            logger.error(f"排查任务 {job.id} 失败（{status}）: {str(e)}")
+            return
+
+        if result.get("status") == "error":
+            status = self.queue.fail(job.id, result.get("error", ""), result, owner=job.owner)
+            logger.error(f"排查任务 {job.id} 失败（{status}）: {result.get('error')}")
+        elif self.queue.complete(job.id, result, owner=job.owner):
+            logger.info(f"排查任务 {job.id} 完成")
+        else:
+            logger.warning(f"排查任务 {job.id} 完成，但租约已到期，结果未写入")
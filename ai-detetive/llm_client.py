@@ -0,0 +1,268 @@
+"""
+共享的大模型客户端
+功能：所有Agent共用同一组带连接池的HTTP客户端，相同配置的聊天模型只创建一次，
+后续调用复用已建立的keep-alive连接，避免每个Agent各自创建客户端
+"""
+import asyncio
+import logging
+import threading
+from typing import Callable, Dict, Optional, Set, Tuple
+
+import httpx
+from langchain.chat_models import init_chat_model
+from langchain_core.rate_limiters import InMemoryRateLimiter
+
+from cassette import Cassette
+from resilient_transport import (
+    AsyncResilientTransport,
+    ResiliencePolicy,
+    ResilienceState,
+    ResilientTransport,
+)
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 默认模型
+DEFAULT_MODEL = "deepseek-chat"
+
+# 连接池配置
+MAX_CONNECTIONS = 100
+MAX_KEEPALIVE_CONNECTIONS = 20
+KEEPALIVE_EXPIRY = 60.0
+
+# 请求超时（秒）
+REQUEST_TIMEOUT = httpx.Timeout(120.0, connect=10.0)
+
+_lock = threading.RLock()
+_http_client: Optional[httpx.Client] = None
+_async_http_client: Optional[httpx.AsyncClient] = None
+_chat_models: Dict[Tuple, object] = {}
+_rate_limiter: Optional[InMemoryRateLimiter] = None
+# 自定义聊天模型工厂（离线测试、基准测试时替换真实模型）
+_chat_model_factory: Optional[Callable[..., object]] = None
+# 录制回放（离线复现排查时使用）
+_cassette: Optional[Cassette] = None
+# 重试、熔断和对冲状态，同步和异步客户端共享
+_resilience = ResilienceState()
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=MAX_CONNECTIONS,
+        max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=KEEPALIVE_EXPIRY,
+    )
+
+
+def get_http_client() -> httpx.Client:
+    """获取共享的同步HTTP客户端"""
+    global _http_client
+    if _http_client is None:
+        with _lock:
+            if _http_client is None:
+                transport = ResilientTransport(httpx.HTTPTransport(limits=_limits()), _resilience)
+                if _cassette is not None:
+                    transport = _cassette.transport(transport)
+                _http_client = httpx.Client(transport=transport, timeout=REQUEST_TIMEOUT)
+    return _http_client
+
+
+def get_async_http_client() -> httpx.AsyncClient:
+    """获取共享的异步HTTP客户端"""
+    global _async_http_client
+    if _async_http_client is None:
+        with _lock:
+            if _async_http_client is None:
+                transport = AsyncResilientTransport(httpx.AsyncHTTPTransport(limits=_limits()), _resilience)
+                if _cassette is not None:
+                    transport = _cassette.async_transport(transport)
+                _async_http_client = httpx.AsyncClient(transport=transport, timeout=REQUEST_TIMEOUT)
+    return _async_http_client
+
+
+def set_resilience_policy(policy: ResiliencePolicy) -> None:
+    """
+    设置共享HTTP客户端的重试、熔断和对冲策略（对已创建的客户端同样生效）
+
+    Args:
+        policy: 策略，如 ResiliencePolicy(max_retries=3, hedge_percentile=0.95)
+    """
+    _resilience.set_policy(policy)
+    logger.info(f"大模型请求策略: {policy}")
+
+
+def transport_stats() -> dict:
+    """各大模型接口的请求、重试、熔断和对冲统计"""
+    return _resilience.stats()
+
+
+def set_rate_limit(requests_per_second: Optional[float], max_burst: int = 1) -> None:
+    """
+    设置聊天接口的全局令牌桶限流，所有共享聊天模型（含已创建的）共用同一个令牌桶，
+    传输层的重试和对冲请求同样取令牌，多个排查并发执行时请求速率也不会超过服务商限制
+
+    Args:
+        requests_per_second: 每秒请求数，None 表示取消限流
+        max_burst: 令牌桶容量（允许的突发请求数）
+    """
+    global _rate_limiter
+    with _lock:
+        if requests_per_second is None:
+            _rate_limiter = None
+        else:
+            _rate_limiter = InMemoryRateLimiter(
+                requests_per_second=requests_per_second,
+                check_every_n_seconds=min(0.1, 1.0 / requests_per_second),
+                max_bucket_size=max_burst,
+            )
+        for chat_model in _chat_models.values():
+            chat_model.rate_limiter = _rate_limiter
+        # 传输层的重试和对冲请求共用同一个令牌桶
+        _resilience.rate_limiter = _rate_limiter
+    logger.info(f"聊天接口限流: {requests_per_second or '不限'} 次/秒, 突发 {max_burst}")
+
+
+def set_chat_model_factory(factory: Optional[Callable[..., object]]) -> None:
+    """
+    设置聊天模型工厂：之后 get_chat_model 调用 factory(api_key=, base_url=, model=, temperature=)
+    创建模型（如 fake_llm.FakeChatModel），用于离线测试和基准测试；None 恢复使用真实模型。
+    已创建的共享模型会被清空，需在创建Agent之前调用
+
+    Args:
+        factory: 模型工厂，None 表示恢复默认
+    """
+    global _chat_model_factory
+    with _lock:
+        _chat_model_factory = factory
+        _chat_models.clear()
+    logger.info(f"聊天模型工厂: {'自定义' if factory else '默认'}")
+
+
+def set_cassette(cassette: Optional[Cassette]) -> None:
+    """
+    录制或回放共享HTTP客户端上的所有大模型请求（聊天补全、向量化），None 表示取消。
+    已创建的客户端和共享模型会被重建，需在创建Agent之前调用
+
+    Args:
+        cassette: 录像（cassette.Cassette）
+    """
+    global _cassette
+    with _lock:
+        _cassette = cassette
+        close_clients()
+    logger.info(f"大模型请求录像: {cassette.path + '（' + cassette.mode + '）' if cassette else '关闭'}")
+
+
+def get_chat_model(api_key: str, base_url: str, model: str = DEFAULT_MODEL,
+                   temperature: float = 0, metadata: Optional[Dict] = None):
+    """
+    获取共享的聊天模型，相同配置只创建一次
+
+    Args:
+        api_key: API密钥
+        base_url: API基础URL
+        model: 模型名称
+        temperature: 温度
+        metadata: 模型调用时传给回调的元数据（可选，如 model_routing 的路由信息，链路追踪据此记录），
+                  不同元数据的模型是同一模型的副本，共用连接池和限流
+
+    Returns:
+        聊天模型实例
+    """
+    if metadata:
+        key = (api_key, base_url, model, temperature, tuple(sorted(metadata.items())))
+        chat_model = _chat_models.get(key)
+        if chat_model is None:
+            base_model = get_chat_model(api_key, base_url, model, temperature)
+            with _lock:
+                chat_model = _chat_models.get(key)
+                if chat_model is None:
+                    chat_model = base_model.model_copy(update={"metadata": {**(base_model.metadata or {}),
+                                                                            **metadata}})
+                    _chat_models[key] = chat_model
+        return chat_model
+
+    key = (api_key, base_url, model, temperature)
+    chat_model = _chat_models.get(key)
+    if chat_model is not None:
+        return chat_model
+
+    with _lock:
+        chat_model = _chat_models.get(key)
+        if chat_model is None and _chat_model_factory is not None:
+            chat_model = _chat_model_factory(api_key=api_key, base_url=base_url, model=model,
+                                             temperature=temperature)
+            chat_model.rate_limiter = _rate_limiter
+            _chat_models[key] = chat_model
+        elif chat_model is None:
+            chat_model = init_chat_model(
+                model=model,
+                model_provider="openai",
+                api_key=api_key,
+                base_url=base_url,
+                temperature=temperature,
+                http_client=get_http_client(),
+                http_async_client=get_async_http_client(),
+                rate_limiter=_rate_limiter,
+                # 重试由共享HTTP客户端的传输层统一处理，避免SDK重试叠加
+                max_retries=0,
+            )
+            _chat_models[key] = chat_model
+            logger.info(f"创建共享聊天模型: {model} @ {base_url}")
+    return chat_model
+
+
+# 同步关闭时交给当前事件循环执行的异步客户端关闭任务（保留引用直到完成）
+_closing_tasks: Set[asyncio.Task] = set()
+
+
+def _detach_clients() -> Tuple[Optional[httpx.Client], Optional[httpx.AsyncClient]]:
+    """清空模型缓存并取出共享HTTP客户端，由调用方关闭"""
+    global _http_client, _async_http_client
+    with _lock:
+        _chat_models.clear()
+        clients = (_http_client, _async_http_client)
+        _http_client = None
+        _async_http_client = None
+    return clients
+
+
+def _close_async_client(client: httpx.AsyncClient) -> None:
+    """在同步代码中关闭异步客户端：事件循环中调用时交给该循环，否则新建事件循环关闭"""
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        loop = None
+    if loop is not None:
+        task = loop.create_task(client.aclose())
+        _closing_tasks.add(task)
+        task.add_done_callback(_closing_tasks.discard)
+        return
+    try:
+        asyncio.run(client.aclose())
+    except RuntimeError as e:
+        # 连接属于已经结束的事件循环，只能在原事件循环中通过 aclose_clients 关闭
+        logger.warning(f"异步HTTP客户端未能关闭（连接所属的事件循环已结束，请在该事件循环中调用 aclose_clients）: {str(e)}")
+
+
+def close_clients() -> None:
+    """
+    关闭共享HTTP客户端（同步和异步）并清空模型缓存（进程退出或测试时使用）；
+    在事件循环中使用过异步客户端时，应在该事件循环结束前调用 aclose_clients
+    """
+    http_client, async_client = _detach_clients()
+    if http_client is not None:
+        http_client.close()
+    if async_client is not None:
+        _close_async_client(async_client)
+
+
+async def aclose_clients() -> None:
+    """在事件循环中关闭共享HTTP客户端（同步和异步）并清空模型缓存"""
+    http_client, async_client = _detach_clients()
+    if http_client is not None:
+        http_client.close()
+    if async_client is not None:
+        await async_client.aclose()
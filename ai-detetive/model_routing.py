@@ -0,0 +1,235 @@
+"""
+模型路由
+功能：按Agent和任务类型把模型调用路由到不同的模型层级：默认子Agent的检索类任务和每轮结论的结构化提取使用快速模型，
+只有协调者的分析与综合使用强模型；模型调用失败时改用后备层级的模型。
+路由信息作为模型调用的元数据传给回调，链路追踪记录在LLM span上（model_route、model_tier、fallback_for、cost），
+trace_report 按层级汇总耗时、token数和费用。
+各层级的默认模型可通过环境变量 AI_DETECTIVE_FAST_MODEL / AI_DETECTIVE_STRONG_MODEL 配置，
+两个层级是同一个模型时路由和后备都不生效，创建路由时会给出警告
+"""
+import logging
+import os
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from langchain.agents.middleware import AgentMiddleware, ModelFallbackMiddleware
+from langchain_core.language_models import BaseChatModel
+from langchain_core.runnables import Runnable
+
+from llm_client import DEFAULT_MODEL, get_chat_model
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 模型层级
+TIER_FAST = "fast"
+TIER_STRONG = "strong"
+
+# 配置各层级默认模型的环境变量
+FAST_MODEL_ENV = "AI_DETECTIVE_FAST_MODEL"
+STRONG_MODEL_ENV = "AI_DETECTIVE_STRONG_MODEL"
+
+# 任务类型
+TASK_SYNTHESIS = "synthesis"    # 协调者：规划collector调用、分析和综合结论
+TASK_VERDICT = "verdict"        # 协调者：未提交结论时从本轮回复中提取结构化结论
+TASK_RETRIEVAL = "retrieval"    # 子Agent：按要求检索日志、数据、文档和代码
+
+# 协调者的Agent名称（子Agent使用 coordinator_agent.COLLECTORS 中的属性名，如 log_agent）
+COORDINATOR = "coordinator"
+
+# 默认路由：键为 "Agent.任务"、"Agent" 或 "*.任务"，依次匹配
+DEFAULT_ROUTES = {
+    COORDINATOR: TIER_STRONG,
+    f"{COORDINATOR}.{TASK_VERDICT}": TIER_FAST,
+    f"*.{TASK_RETRIEVAL}": TIER_FAST,
+}
+
+# 默认后备：快速模型失败时改用强模型，强模型失败时降级到快速模型
+DEFAULT_FALLBACKS = {
+    TIER_FAST: [TIER_STRONG],
+    TIER_STRONG: [TIER_FAST],
+}
+
+
+@dataclass(frozen=True)
+class ModelTier:
+    """模型层级配置"""
+    model: str = DEFAULT_MODEL
+    # 不同服务商的模型可单独指定接口地址和密钥，None 表示使用Agent的配置
+    base_url: Optional[str] = None
+    api_key: Optional[str] = None
+    temperature: float = 0
+    # 每百万token的价格（可选），配置后链路追踪记录每次调用的费用
+    input_price: float = 0.0
+    output_price: float = 0.0
+
+
+@dataclass(frozen=True)
+class Route:
+    """一次路由决策"""
+    key: str
+    tier: str
+    fallbacks: Tuple[str, ...] = ()
+
+
+@dataclass
+class RoutedModel:
+    """路由得到的模型及其后备模型"""
+    route: Route
+    model: BaseChatModel
+    fallbacks: List[BaseChatModel] = field(default_factory=list)
+
+    def middleware(self) -> List[AgentMiddleware]:
+        """create_agent 使用的中间件：模型调用失败时依次改用后备模型"""
+        return [ModelFallbackMiddleware(*self.fallbacks)] if self.fallbacks else []
+
+    def with_structured_output(self, schema, **kwargs) -> Runnable:
+        """结构化输出，失败时依次改用后备模型"""
+        runnable = self.model.with_structured_output(schema, **kwargs)
+        if not self.fallbacks:
+            return runnable
+        return runnable.with_fallbacks([model.with_structured_output(schema, **kwargs) for model in self.fallbacks])
+
+
+def default_tiers() -> Dict[str, ModelTier]:
+    """
+    默认的模型层级：模型名称取自环境变量，未配置时使用 DEFAULT_MODEL
+
+    Returns:
+        层级名称到模型配置的映射
+    """
+    return {
+        TIER_FAST: ModelTier(model=os.environ.get(FAST_MODEL_ENV) or DEFAULT_MODEL),
+        TIER_STRONG: ModelTier(model=os.environ.get(STRONG_MODEL_ENV) or DEFAULT_MODEL),
+    }
+
+
+class ModelRouter:
+    """按Agent和任务类型选择模型层级"""
+
+    def __init__(self, tiers: Optional[Dict[str, ModelTier]] = None, routes: Optional[Dict[str, str]] = None,
+                 fallbacks: Optional[Dict[str, Sequence[str]]] = None, default_tier: str = TIER_STRONG):
+        """
+        初始化模型路由
+
+        Args:
+            tiers: 层级名称到模型配置的映射，与默认配置合并（默认配置见 default_tiers）
+            routes: 路由表，键为 "Agent.任务"、"Agent" 或 "*.任务"，值为层级名称，与 DEFAULT_ROUTES 合并
+            fallbacks: 层级名称到后备层级列表的映射（可选，默认 DEFAULT_FALLBACKS）
+            default_tier: 未匹配到路由时使用的层级
+        """
+        self.tiers = {**default_tiers(), **(tiers or {})}
+        self.routes = {**DEFAULT_ROUTES, **(routes or {})}
+        self.fallbacks = {tier: list(names) for tier, names in (fallbacks or DEFAULT_FALLBACKS).items()}
+        self.default_tier = default_tier
+        for tier in [default_tier, *self.routes.values(), *(name for names in self.fallbacks.values()
+                                                            for name in names)]:
+            if tier not in self.tiers:
+                raise ValueError(f"未配置的模型层级: {tier}")
+        self._warn_collapsed_tiers()
+
+    def _warn_collapsed_tiers(self) -> None:
+        """路由用到的层级是同一个模型时给出警告：此时路由不会节省费用，后备也会被跳过"""
+        used = sorted({self.default_tier, *self.routes.values()})
+        models = {}
+        for tier_name in used:
+            tier = self.tiers[tier_name]
+            models.setdefault((tier.model, tier.base_url, tier.api_key), []).append(tier_name)
+        for (model, _, _), names in models.items():
+            if len(names) > 1:
+                logger.warning(f"模型层级 {', '.join(names)} 使用同一模型 {model}，模型路由和后备不生效；"
+                               f"可通过 tiers 参数或环境变量 {FAST_MODEL_ENV} / {STRONG_MODEL_ENV} 配置不同的模型")
+
+    def route(self, agent: str, task: Optional[str] = None) -> Route:
+        """
+        路由决策
+
+        Args:
+            agent: Agent名称（coordinator 或子Agent属性名）
+            task: 任务类型（可选）
+
+        Returns:
+            匹配的路由键、层级和后备层级
+        """
+        candidates = [f"{agent}.{task}", agent, f"*.{task}"] if task else [agent]
+        key = next((candidate for candidate in candidates if candidate in self.routes), "*")
+        tier = self.routes.get(key, self.default_tier)
+        return Route(key=f"{agent}.{task}" if task else agent, tier=tier,
+                     fallbacks=tuple(self.fallbacks.get(tier, [])))
+
+    def _chat_model(self, api_key: str, base_url: str, route: Route, tier_name: str,
+                    fallback_for: Optional[str] = None) -> BaseChatModel:
+        tier = self.tiers[tier_name]
+        metadata = {"model_route": route.key, "model_tier": tier_name}
+        if fallback_for is not None:
+            metadata["fallback_for"] = fallback_for
+        if tier.input_price or tier.output_price:
+            metadata["input_price"] = tier.input_price
+            metadata["output_price"] = tier.output_price
+        return get_chat_model(tier.api_key or api_key, tier.base_url or base_url, tier.model,
+                              tier.temperature, metadata=metadata)
+
+    def _endpoint(self, api_key: str, base_url: str, tier_name: str) -> Tuple:
+        tier = self.tiers[tier_name]
+        return tier.api_key or api_key, tier.base_url or base_url, tier.model, tier.temperature
+
+    def model(self, api_key: str, base_url: str, agent: str, task: Optional[str] = None) -> RoutedModel:
+        """
+        获取路由后的模型
+
+        Args:
+            api_key: Agent的API密钥（层级未单独配置时使用）
+            base_url: Agent的API基础URL（层级未单独配置时使用）
+            agent: Agent名称
+            task: 任务类型（可选）
+
+        Returns:
+            路由后的模型及后备模型（与主模型配置相同的后备层级会被跳过）
+        """
+        route = self.route(agent, task)
+        model = self._chat_model(api_key, base_url, route, route.tier)
+        endpoints = {self._endpoint(api_key, base_url, route.tier)}
+        fallbacks = []
+        for tier_name in route.fallbacks:
+            endpoint = self._endpoint(api_key, base_url, tier_name)
+            if endpoint in endpoints:
+                continue
+            endpoints.add(endpoint)
+            fallbacks.append(self._chat_model(api_key, base_url, route, tier_name, fallback_for=route.tier))
+        logger.info(f"模型路由: {route.key} -> {route.tier}（{self.tiers[route.tier].model}）"
+                    + (f"，后备 {', '.join(route.fallbacks)}" if fallbacks else ""))
+        return RoutedModel(route=route, model=model, fallbacks=fallbacks)
+
+
+_lock = threading.Lock()
+_router: Optional[ModelRouter] = None
+
+
+def set_model_router(router: Optional[ModelRouter]) -> None:
+    """
+    设置所有Agent共用的模型路由（需在创建Agent之前调用），None 恢复默认路由
+
+    Args:
+        router: 模型路由
+    """
+    global _router
+    with _lock:
+        _router = router
+    logger.info(f"模型路由: {router.routes if router else '默认'}")
+
+
+def get_model_router() -> ModelRouter:
+    """获取当前的模型路由"""
+    global _router
+    if _router is None:
+        with _lock:
+            if _router is None:
+                _router = ModelRouter()
+    return _router
+
+
+def route_model(api_key: str, base_url: str, agent: str, task: Optional[str] = None) -> RoutedModel:
+    """按当前的模型路由获取模型，参数同 ModelRouter.model"""
+    return get_model_router().model(api_key, base_url, agent, task)
@@ -0,0 +1,239 @@
+"""
+本地预路由
+功能：从问题描述中提取traceId、Java/Python调用栈、异常类、SQL表名和服务名，
+对明显需要的collector（按traceId查日志、按调用栈查代码和错误日志、按表名查数据库）直接生成调用，
+由协调者在第一轮开始前并发执行，结果作为第一轮的工具结果交给模型，省去一次决定调用哪些collector的LLM调用
+"""
+import logging
+import re
+from dataclasses import dataclass, field
+from typing import List, Optional, Sequence
+
+from alert_intake import alert_signature
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 预路由最多发起的collector调用数
+DEFAULT_MAX_PRE_ROUTED_CALLS = 3
+
+# 查询中保留的调用栈帧数（从栈顶开始）
+MAX_QUERY_FRAMES = 5
+
+# 以下模式使用 re.ASCII：标识符与前后的中文之间也视为单词边界（如 "用户表user_table查询"）
+
+# traceId：traceId=xxx、trace_id: xxx、TID:xxx，以及W3C traceparent中的trace-id
+_TRACE_ID_PATTERNS = [
+    re.compile(r"\btrace[_\- ]?id\s*[=:：]?\s*[\"'“]?([0-9A-Za-z][0-9A-Za-z\-]{7,63})",
+               re.IGNORECASE | re.ASCII),
+    re.compile(r"\bTID\s*[:：]\s*([0-9A-Za-z][\w.\-]{7,63})", re.ASCII),
+    re.compile(r"\b00-([0-9a-f]{32})-[0-9a-f]{16}-[0-9a-f]{2}\b", re.ASCII),
+]
+
+# Java调用栈帧：at com.foo.Bar.method(Bar.java:42)
+_JAVA_FRAME_PATTERN = re.compile(r"\bat\s+((?:[\w$]+\.)+[\w$<>]+)\(([\w$]+\.java):(\d+)\)", re.ASCII)
+
+# Python调用栈帧：File "x.py", line 12, in func
+_PYTHON_FRAME_PATTERN = re.compile(r'File "([^"]+)", line (\d+), in ([\w<>]+)')
+
+# 表名（可带库名和引号）
+_TABLE_NAME = r"[`\"']?((?:[A-Za-z_]\w*\.)?[A-Za-z_]\w*)[`\"']?"
+
+# 任意大小写的SQL语句（select ... from、update t set、insert into、delete from、alter/truncate table），
+# 到分号、句号或换行为止；表名只从SQL语句和数据库报错中提取，"ERROR FROM upstream" 这类描述中的 FROM 不算
+_SQL_STATEMENT_PATTERN = re.compile(
+    r"\b(?:select\b[^;；。\n]*?\bfrom|update\s+" + _TABLE_NAME + r"\s+set|insert\s+into|delete\s+from"
+    r"|(?:alter|truncate)\s+table)\b[^;；。\n]*",
+    re.IGNORECASE | re.ASCII
+)
+
+# SQL语句中的表名
+_SQL_CLAUSE_TABLE_PATTERN = re.compile(r"\b(?:FROM|JOIN|UPDATE|INTO|TABLE)\s+" + _TABLE_NAME,
+                                       re.IGNORECASE | re.ASCII)
+
+# 数据库报错中的表名：Table 'db.t' doesn't exist、relation "t" does not exist（表名带引号）
+_SQL_ERROR_TABLE_PATTERN = re.compile(r"\b(?:Table|relation)\s+[`\"']((?:[A-Za-z_]\w*\.)?[A-Za-z_]\w*)[`\"']",
+                                      re.IGNORECASE | re.ASCII)
+
+# 中文描述中的表名：用户表user_table、表 t_order、t_order表；
+# 排除以“表”结尾的常见词（列表、代表、发表、图表、报表等）和以“表”开头的常见词（表示、表明、表单等）
+_CN_TABLE_PATTERNS = [
+    re.compile(r"(?<![列代发图报仪外手钟课价])表\s*[`\"'“]?([A-Za-z_][\w.]*)", re.ASCII),
+    re.compile(r"(?<![\w.])([A-Za-z_][\w.]*)[`\"'”]?\s*(?:数据)?表(?![示达明现单格情态])", re.ASCII),
+]
+
+# 不是表名的SQL关键字和常见单词
+_NOT_TABLES = {"select", "set", "where", "values", "dual", "the", "a", "an", "table", "if", "exists", "not"}
+
+# 服务名：order-service、user-api、pay-gateway（service=xxx 形式由 alert_intake 提取）
+_SERVICE_NAME_PATTERN = re.compile(r"\b([a-z][a-z0-9]*(?:-[a-z0-9]+)*-(?:service|svc|server|api|gateway))\b",
+                                   re.ASCII)
+
+
+def _unique(values: Sequence[str]) -> List[str]:
+    return list(dict.fromkeys(value for value in values if value))
+
+
+def _unique_tables(tables: Sequence[str]) -> List[str]:
+    """去重，同时出现 shop.orders 和 orders 时只保留带库名的"""
+    tables = _unique(table for table in tables if table.lower() not in _NOT_TABLES)
+    qualified = {table.rsplit(".", 1)[-1] for table in tables if "." in table}
+    return [table for table in tables if "." in table or table not in qualified]
+
+
+@dataclass
+class ProblemEntities:
+    """从问题描述中提取的实体"""
+
+    trace_ids: List[str] = field(default_factory=list)
+    exceptions: List[str] = field(default_factory=list)
+    java_frames: List[str] = field(default_factory=list)
+    python_frames: List[str] = field(default_factory=list)
+    tables: List[str] = field(default_factory=list)
+    services: List[str] = field(default_factory=list)
+
+    @property
+    def frames(self) -> List[str]:
+        """调用栈帧（从栈顶开始）"""
+        return self.java_frames + self.python_frames
+
+    @property
+    def has_stack(self) -> bool:
+        return bool(self.exceptions or self.frames)
+
+
+def extract_entities(text: str) -> ProblemEntities:
+    """
+    提取问题描述中的实体
+
+    Args:
+        text: 问题描述
+
+    Returns:
+        ProblemEntities
+    """
+    trace_ids = [match for pattern in _TRACE_ID_PATTERNS for match in pattern.findall(text)]
+    java_frames = [f"{method}({file}:{line})" for method, file, line in _JAVA_FRAME_PATTERN.findall(text)]
+    python_frames = [f"{path}:{line} in {func}" for path, line, func in _PYTHON_FRAME_PATTERN.findall(text)]
+    tables = ([match for statement in _SQL_STATEMENT_PATTERN.finditer(text)
+               for match in _SQL_CLAUSE_TABLE_PATTERN.findall(statement.group(0))]
+              + _SQL_ERROR_TABLE_PATTERN.findall(text)
+              + [match for pattern in _CN_TABLE_PATTERNS for match in pattern.findall(text)])
+    signature = alert_signature(text)
+    return ProblemEntities(
+        trace_ids=_unique(trace_ids),
+        exceptions=signature["exceptions"],
+        java_frames=_unique(java_frames),
+        python_frames=_unique(python_frames),
+        tables=_unique_tables(tables),
+        services=_unique([signature["service"]] + _SERVICE_NAME_PATTERN.findall(text)),
+    )
+
+
+@dataclass(frozen=True)
+class PlannedCall:
+    """预路由生成的collector调用"""
+
+    tool: str
+    query: str
+    # 触发该调用的实体，如 "traceId 4bf92f3577b34da6"
+    reason: str
+
+
+class PreRouter:
+    """按问题描述中的实体确定第一轮必然需要的collector调用（确定性，不调用模型）"""
+
+    def __init__(self, max_calls: int = DEFAULT_MAX_PRE_ROUTED_CALLS):
+        """
+        Args:
+            max_calls: 最多发起的collector调用数
+        """
+        self.max_calls = max_calls
+
+    def plan(self, problem_description: str, entities: Optional[ProblemEntities] = None) -> List[PlannedCall]:
+        """
+        生成collector调用
+
+        Args:
+            problem_description: 问题描述
+            entities: 已提取的实体（可选，默认从问题描述中提取）
+
+        Returns:
+            PlannedCall 列表，没有明显需要的调用时为空
+        """
+        entities = entities or extract_entities(problem_description)
+        service = f"服务{'、'.join(entities.services)}中" if entities.services else ""
+        exceptions = "、".join(entities.exceptions)
+        frames = "\n".join(entities.frames[:MAX_QUERY_FRAMES])
+        calls = []
+
+        if entities.trace_ids:
+            trace_ids = "、".join(entities.trace_ids)
+            calls.append(PlannedCall(
+                "log_collector",
+                f"请查询{service}traceId为{trace_ids}的所有关联日志，包括完整的调用链路，"
+                f"请按时间顺序列出日志，并标注关键节点和错误信息",
+                f"traceId {trace_ids}"
+            ))
+        if entities.has_stack:
+            stack = "\n".join(part for part in [f"异常：{exceptions}" if exceptions else "",
+                                                f"调用栈：\n{frames}" if frames else ""] if part)
+            calls.append(PlannedCall(
+                "code_collector",
+                f"请根据以下错误信息定位{service}相关代码，给出出错位置的代码片段并分析可能的原因：\n{stack}",
+                f"调用栈 {exceptions or entities.frames[0]}"
+            ))
+            if not entities.trace_ids:
+                top_frame = f"（出错位置 {entities.frames[0]}）" if entities.frames else ""
+                calls.append(PlannedCall(
+                    "log_collector",
+                    f"请查询{service}与{exceptions or '调用栈'}{top_frame}相关的错误日志，"
+                    f"给出首次出现时间、出现频率和上下文日志",
+                    f"调用栈 {exceptions or entities.frames[0]}"
+                ))
+        if entities.tables:
+            tables = "、".join(entities.tables)
+            calls.append(PlannedCall(
+                "db_collector",
+                f"请查询数据库表{tables}的状态：表结构、索引、数据量，以及近期的慢查询、锁等待和异常数据",
+                f"表 {tables}"
+            ))
+        if not calls and entities.services:
+            services = "、".join(entities.services)
+            calls.append(PlannedCall(
+                "log_collector",
+                f"请查询服务{services}近期的错误日志，给出错误类型、首次出现时间、出现频率和上下文日志",
+                f"服务 {services}"
+            ))
+
+        calls = calls[:self.max_calls]
+        if calls:
+            logger.info(f"预路由: {', '.join(f'{call.tool}（{call.reason}）' for call in calls)}")
+        return calls
+
+
+if __name__ == "__main__":
+    # 表名提取自检：SQL语句和中文描述中的表名应提取，普通的中英文描述不应生成数据库查询
+    for text, expected in [
+        ("SELECT * FROM shop.orders o JOIN t_user u ON o.uid = u.id 执行很慢", ["shop.orders", "t_user"]),
+        ("select id from t_order where status = 1 超时", ["t_order"]),
+        ("update t_order set status = 2 时锁等待超时", ["t_order"]),
+        ("Table 'shop.t_refund' doesn't exist", ["shop.t_refund"]),
+        ('ERROR: relation "t_coupon" does not exist', ["t_coupon"]),
+        ("ALTER TABLE t_order ADD COLUMN remark 执行卡住", ["t_order"]),
+        ("用户表user_table查询报错", ["user_table"]),
+        ("t_order表数据量过大", ["t_order"]),
+        ("用户下单时报错 request timed out from upstream gateway", []),
+        ("订单列表 page 加载很慢", []),
+        ("报表 export 一直失败", []),
+        ("接口返回 error 表示参数不合法", []),
+        ("data imported into warehouse yesterday is missing", []),
+        ("ERROR FROM upstream: connection refused", []),
+        ("Request INTO payment TIMEOUT after 3 retries", []),
+    ]:
+        tables = extract_entities(text).tables
+        calls = [call.tool for call in PreRouter().plan(text)]
+        print(f"{tables}  {calls}  {text}")
+        assert tables == expected, text
+        assert ("db_collector" in calls) == bool(expected), text
@@ -0,0 +1,504 @@
+"""
+高可用的大模型HTTP传输层
+功能：作为共享HTTP客户端的 transport，所有Agent的大模型请求都经过这里：
+- 网络错误、超时、429/5xx 时按带抖动的指数退避重试（优先遵循 Retry-After）
+- 每个接口（host + path）一个熔断器，连续失败后快速失败，冷却后放行探测请求
+- 可选的对冲请求：请求耗时超过该接口近期耗时的指定分位数后，再发一个相同请求，先返回者胜出
+- 每次调用（含重试、退避和对冲）有总时长上限，每次尝试的超时缩短为剩余时间；
+  在 request_deadline 范围内（如排查预算的截止时间）以更早的截止时间为准
+- 设置了全局限流时，重试和对冲请求同样从令牌桶取令牌：对冲取不到令牌时不发送，重试等待令牌
+上游接口变慢或故障时，单次排查的尾延迟仍然有上限
+"""
+import asyncio
+import logging
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError as FutureTimeoutError, wait
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Dict, Iterator, Optional, Tuple
+
+import httpx
+from langchain_core.rate_limiters import BaseRateLimiter
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 需要重试的HTTP状态码
+RETRY_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
+
+# 计入熔断的HTTP状态码（429 是限流，不代表接口故障）
+BREAKER_STATUS_CODES = frozenset({500, 502, 503, 504})
+
+# 熔断器状态
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+# 单次调用（含重试、退避和对冲）的默认总时长上限（秒）
+DEFAULT_TOTAL_TIMEOUT = 180.0
+
+# 当前上下文中大模型请求的截止时间（time.monotonic），由 request_deadline 设置
+_request_deadline: ContextVar[Optional[float]] = ContextVar("llm_request_deadline", default=None)
+
+
+@contextmanager
+def request_deadline(deadline: Optional[float]) -> Iterator[None]:
+    """
+    在此范围内发出的大模型请求（含重试和对冲）不晚于 deadline 结束，嵌套时以更早者为准
+
+    Args:
+        deadline: 截止时间（time.monotonic），None 表示不额外限制
+    """
+    current = _request_deadline.get()
+    if deadline is not None and (current is None or deadline < current):
+        token = _request_deadline.set(deadline)
+    else:
+        token = None
+    try:
+        yield
+    finally:
+        if token is not None:
+            _request_deadline.reset(token)
+
+
+@dataclass
+class ResiliencePolicy:
+    """重试、熔断和对冲配置"""
+
+    max_retries: int = 3
+    backoff_base: float = 0.5
+    backoff_max: float = 20.0
+    failure_threshold: int = 5
+    recovery_timeout: float = 30.0
+    # 对冲请求的耗时分位数（如 0.95），None 表示不发对冲请求
+    hedge_percentile: Optional[float] = None
+    # 计算分位数所需的最少样本数
+    hedge_min_samples: int = 20
+    # 对冲等待时间下限（秒），避免对很快的请求也重复发送
+    hedge_min_delay: float = 1.0
+    # 单次调用的总时长上限（秒），None 表示只受 request_deadline 限制
+    total_timeout: Optional[float] = DEFAULT_TOTAL_TIMEOUT
+
+    def deadline(self, started: float) -> Optional[float]:
+        """本次调用的截止时间：总时长上限与上下文截止时间中更早者"""
+        candidates = [started + self.total_timeout if self.total_timeout is not None else None,
+                      _request_deadline.get()]
+        candidates = [value for value in candidates if value is not None]
+        return min(candidates) if candidates else None
+
+    def backoff(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """
+        第 attempt 次重试前的等待时间（full jitter）
+
+        Args:
+            attempt: 重试序号（从0开始）
+            retry_after: 服务端 Retry-After 指定的秒数
+        """
+        if retry_after is not None:
+            return min(retry_after, self.backoff_max)
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+
+class CircuitOpenError(httpx.TransportError):
+    """接口熔断中，请求未发送"""
+
+
+class DeadlineExceededError(httpx.TimeoutException):
+    """调用已到截止时间，不再发送请求或重试"""
+
+
+class CircuitBreaker:
+    """熔断器：连续失败 failure_threshold 次后打开，recovery_timeout 后半开放行一个探测请求"""
+
+    def __init__(self, failure_threshold: int, recovery_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = STATE_CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.open_count = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """是否允许发送请求"""
+        with self._lock:
+            if self.state == STATE_CLOSED:
+                return True
+            if self.state == STATE_OPEN and time.monotonic() - self.opened_at >= self.recovery_timeout:
+                self.state = STATE_HALF_OPEN
+                self._probing = False
+            if self.state == STATE_HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = STATE_CLOSED
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.state == STATE_HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != STATE_OPEN:
+                    self.open_count += 1
+                self.state = STATE_OPEN
+                self.opened_at = time.monotonic()
+                self._probing = False
+
+
+class EndpointHealth:
+    """单个接口的熔断器、近期耗时和统计"""
+
+    def __init__(self, policy: ResiliencePolicy, window: int = 200):
+        self.breaker = CircuitBreaker(policy.failure_threshold, policy.recovery_timeout)
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "retries": 0, "failures": 0, "rejected": 0,
+                      "hedged": 0, "hedge_wins": 0, "hedge_throttled": 0, "deadline_exceeded": 0}
+
+    def record_latency(self, seconds: float) -> None:
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def count(self, metric: str) -> None:
+        with self._lock:
+            self.stats[metric] += 1
+
+    def hedge_delay(self, policy: ResiliencePolicy) -> Optional[float]:
+        """对冲请求的等待时间，未启用或样本不足时返回 None"""
+        if policy.hedge_percentile is None:
+            return None
+        with self._lock:
+            if len(self._latencies) < policy.hedge_min_samples:
+                return None
+            latencies = sorted(self._latencies)
+        index = min(len(latencies) - 1, int(len(latencies) * policy.hedge_percentile))
+        return max(policy.hedge_min_delay, latencies[index])
+
+
+class ResilienceState:
+    """各接口的健康状态，由同步和异步传输层共享"""
+
+    def __init__(self, policy: Optional[ResiliencePolicy] = None):
+        self.policy = policy or ResiliencePolicy()
+        # 全局限流（llm_client.set_rate_limit 设置），重试和对冲请求同样取令牌
+        self.rate_limiter: Optional[BaseRateLimiter] = None
+        self._endpoints: Dict[Tuple[str, str], EndpointHealth] = {}
+        self._lock = threading.Lock()
+
+    def set_policy(self, policy: ResiliencePolicy) -> None:
+        """更换策略，已有接口的熔断阈值同时更新"""
+        with self._lock:
+            self.policy = policy
+            for health in self._endpoints.values():
+                health.breaker.failure_threshold = policy.failure_threshold
+                health.breaker.recovery_timeout = policy.recovery_timeout
+
+    def endpoint(self, request: httpx.Request) -> EndpointHealth:
+        key = (request.url.host, request.url.path)
+        health = self._endpoints.get(key)
+        if health is None:
+            with self._lock:
+                health = self._endpoints.setdefault(key, EndpointHealth(self.policy))
+        return health
+
+    def stats(self) -> Dict[str, Dict]:
+        """
+        各接口统计
+
+        Returns:
+            {"host/path": {requests, retries, failures, rejected, hedged, hedge_wins, circuit, circuit_opens}}
+        """
+        return {
+            f"{host}{path}": dict(health.stats, circuit=health.breaker.state,
+                                  circuit_opens=health.breaker.open_count)
+            for (host, path), health in list(self._endpoints.items())
+        }
+
+
+def _retry_after(response: httpx.Response) -> Optional[float]:
+    value = response.headers.get("retry-after")
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def _remaining(deadline: Optional[float]) -> Optional[float]:
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def _limit_timeout(request: httpx.Request, base_timeout: Dict[str, Optional[float]],
+                   remaining: Optional[float]) -> None:
+    """本次尝试的超时不超过剩余时间"""
+    if remaining is None:
+        return
+    request.extensions["timeout"] = {
+        key: remaining if base_timeout.get(key) is None else min(base_timeout[key], remaining)
+        for key in ("connect", "read", "write", "pool")
+    }
+
+
+def _deadline_exceeded(request: httpx.Request, health: "EndpointHealth") -> DeadlineExceededError:
+    health.count("deadline_exceeded")
+    return DeadlineExceededError(f"大模型请求已到截止时间: {request.url.host}{request.url.path}", request=request)
+
+
+def _acquire_token(limiter: Optional[BaseRateLimiter], deadline: Optional[float]) -> bool:
+    """等待限流令牌，截止时间前取不到时返回 False"""
+    if limiter is None:
+        return True
+    while not limiter.acquire(blocking=False):
+        remaining = _remaining(deadline)
+        if remaining is not None and remaining <= 0:
+            return False
+        time.sleep(0.05 if remaining is None else min(0.05, remaining))
+    return True
+
+
+async def _aacquire_token(limiter: Optional[BaseRateLimiter], deadline: Optional[float]) -> bool:
+    """_acquire_token 的异步版本"""
+    if limiter is None:
+        return True
+    while not await limiter.aacquire(blocking=False):
+        remaining = _remaining(deadline)
+        if remaining is not None and remaining <= 0:
+            return False
+        await asyncio.sleep(0.05 if remaining is None else min(0.05, remaining))
+    return True
+
+
+def _copy_request(request: httpx.Request) -> httpx.Request:
+    """复制请求（请求体已读入内存），用于对冲"""
+    return httpx.Request(request.method, request.url, headers=request.headers,
+                         content=request.content, extensions=request.extensions)
+
+
+def _should_retry(health: EndpointHealth, response: Optional[httpx.Response]) -> bool:
+    """记录一次尝试的结果（response 为 None 表示网络错误或超时），返回是否需要重试"""
+    if response is None:
+        health.breaker.record_failure()
+        health.count("failures")
+        return True
+    if response.status_code in BREAKER_STATUS_CODES:
+        health.breaker.record_failure()
+    else:
+        health.breaker.record_success()
+    if response.status_code in RETRY_STATUS_CODES:
+        health.count("failures")
+        return True
+    return False
+
+
+class ResilientTransport(httpx.BaseTransport):
+    """同步传输层：重试、熔断、对冲"""
+
+    def __init__(self, transport: httpx.BaseTransport, state: ResilienceState,
+                 hedge_workers: int = 16):
+        self._transport = transport
+        self._state = state
+        self._hedge_workers = hedge_workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self._hedge_workers,
+                                                        thread_name_prefix="llm-hedge")
+        return self._executor
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        policy = self._state.policy
+        health = self._state.endpoint(request)
+        request.read()
+        deadline = policy.deadline(time.monotonic())
+        base_timeout = dict(request.extensions.get("timeout") or {})
+
+        for attempt in range(policy.max_retries + 1):
+            remaining = _remaining(deadline)
+            if remaining is not None and remaining <= 0:
+                raise _deadline_exceeded(request, health)
+            if not health.breaker.allow():
+                health.count("rejected")
+                raise CircuitOpenError(f"接口熔断中: {request.url.host}{request.url.path}")
+            _limit_timeout(request, base_timeout, remaining)
+            health.count("requests")
+            started = time.monotonic()
+            response, error = None, None
+            try:
+                response = self._send(request, health, deadline)
+            except (httpx.TimeoutException, httpx.NetworkError) as e:
+                error = e
+
+            if not _should_retry(health, response):
+                health.record_latency(time.monotonic() - started)
+                return response
+
+            delay = policy.backoff(attempt, _retry_after(response) if response is not None else None)
+            remaining = _remaining(deadline)
+            # 重试次数用完，或退避后已没有剩余时间时返回最后一次的结果
+            if attempt == policy.max_retries or (remaining is not None and delay >= remaining):
+                if response is not None:
+                    return response
+                raise error
+
+            if response is not None:
+                response.close()
+            health.count("retries")
+            logger.warning(f"大模型请求失败（{error or response.status_code}），{delay:.1f}秒后第 {attempt + 1} 次重试")
+            time.sleep(delay)
+            # 重试请求同样受全局限流约束
+            if not _acquire_token(self._state.rate_limiter, deadline):
+                raise _deadline_exceeded(request, health)
+
+    def _send(self, request: httpx.Request, health: EndpointHealth, deadline: Optional[float]) -> httpx.Response:
+        delay = health.hedge_delay(self._state.policy)
+        remaining = _remaining(deadline)
+        if delay is None or (remaining is not None and delay >= remaining):
+            return self._transport.handle_request(request)
+
+        primary = self.executor.submit(self._transport.handle_request, request)
+        try:
+            return primary.result(timeout=delay)
+        except FutureTimeoutError:
+            pass
+
+        limiter = self._state.rate_limiter
+        if limiter is not None and not limiter.acquire(blocking=False):
+            # 限流令牌不足时不发对冲请求，避免对冲本身触发429
+            health.count("hedge_throttled")
+            return primary.result()
+
+        health.count("hedged")
+        hedge = self.executor.submit(self._transport.handle_request, _copy_request(request))
+        pending = {primary, hedge}
+        first_error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            winners = [future for future in done if future.exception() is None]
+            if not winners:
+                first_error = first_error or next(iter(done)).exception()
+                continue
+            winner = winners[0]
+            # 落败的请求完成后关闭响应，释放连接
+            for loser in (done | pending) - {winner}:
+                loser.add_done_callback(_close_response)
+            if winner is hedge:
+                health.count("hedge_wins")
+            return winner.result()
+        raise first_error
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+        self._transport.close()
+
+
+def _close_response(future) -> None:
+    if future.exception() is None:
+        future.result().close()
+
+
+class AsyncResilientTransport(httpx.AsyncBaseTransport):
+    """异步传输层：重试、熔断、对冲"""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, state: ResilienceState):
+        self._transport = transport
+        self._state = state
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        policy = self._state.policy
+        health = self._state.endpoint(request)
+        await request.aread()
+        deadline = policy.deadline(time.monotonic())
+        base_timeout = dict(request.extensions.get("timeout") or {})
+
+        for attempt in range(policy.max_retries + 1):
+            remaining = _remaining(deadline)
+            if remaining is not None and remaining <= 0:
+                raise _deadline_exceeded(request, health)
+            if not health.breaker.allow():
+                health.count("rejected")
+                raise CircuitOpenError(f"接口熔断中: {request.url.host}{request.url.path}")
+            _limit_timeout(request, base_timeout, remaining)
+            health.count("requests")
+            started = time.monotonic()
+            response, error = None, None
+            try:
+                response = await self._send(request, health, deadline)
+            except (httpx.TimeoutException, httpx.NetworkError) as e:
+                error = e
+
+            if not _should_retry(health, response):
+                health.record_latency(time.monotonic() - started)
+                return response
+
+            delay = policy.backoff(attempt, _retry_after(response) if response is not None else None)
+            remaining = _remaining(deadline)
+            if attempt == policy.max_retries or (remaining is not None and delay >= remaining):
+                if response is not None:
+                    return response
+                raise error
+
+            if response is not None:
+                await response.aclose()
+            health.count("retries")
+            logger.warning(f"大模型请求失败（{error or response.status_code}），{delay:.1f}秒后第 {attempt + 1} 次重试")
+            await asyncio.sleep(delay)
+            if not await _aacquire_token(self._state.rate_limiter, deadline):
+                raise _deadline_exceeded(request, health)
+
+    async def _send(self, request: httpx.Request, health: EndpointHealth,
+                    deadline: Optional[float]) -> httpx.Response:
+        delay = health.hedge_delay(self._state.policy)
+        remaining = _remaining(deadline)
+        if delay is None or (remaining is not None and delay >= remaining):
+            return await self._transport.handle_async_request(request)
+
+        primary = asyncio.ensure_future(self._transport.handle_async_request(request))
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done:
+            return primary.result()
+
+        limiter = self._state.rate_limiter
+        if limiter is not None and not await limiter.aacquire(blocking=False):
+            health.count("hedge_throttled")
+            return await primary
+
+        health.count("hedged")
+        hedge = asyncio.ensure_future(self._transport.handle_async_request(_copy_request(request)))
+        pending = {primary, hedge}
+        first_error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                winners = [task for task in done if task.exception() is None]
+                if not winners:
+                    first_error = first_error or next(iter(done)).exception()
+                    continue
+                winner = winners[0]
+                for loser in winners[1:]:
+                    await loser.result().aclose()
+                if winner is hedge:
+                    health.count("hedge_wins")
+                return winner.result()
+            raise first_error
+        finally:
+            # 落败的请求直接取消
+            for task in pending:
+                task.cancel()
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
@@ -0,0 +1,7 @@
+"""
+测试配置：ai-detetive 的模块按目录内的平铺方式相互导入，测试时把该目录加入导入路径
+"""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,81 @@
+"""告警合并：同指纹告警共享排查，失败的排查不再合并"""
+import asyncio
+import threading
+
+import pytest
+
+from alert_intake import AlertCoalescer
+
+ALERT = """order-service 出现空指针异常
+java.lang.NullPointerException
+    at com.example.OrderService.createOrder(OrderService.java:45)"""
+
+
+class ScriptedCoordinator:
+    """按顺序返回预设结果的协调者：结果为异常时抛出"""
+
+    def __init__(self, outcomes, gate=None):
+        self.outcomes = list(outcomes)
+        self.gate = gate
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _next(self):
+        with self._lock:
+            self.calls += 1
+            outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    def investigate(self, problem_description, max_rounds=3):
+        if self.gate is not None:
+            self.gate.wait(5)
+        return self._next()
+
+    async def ainvestigate(self, problem_description, max_rounds=3):
+        await asyncio.sleep(0.01)
+        return self._next()
+
+
+def test_duplicates_share_one_investigation():
+    gate = threading.Event()
+    coordinator = ScriptedCoordinator([{"status": "success"}], gate=gate)
+    coalescer = AlertCoalescer(coordinator)
+    futures = [coalescer.submit(ALERT) for _ in range(3)]
+    gate.set()
+    results = [future.result(5) for future in futures]
+    assert coordinator.calls == 1
+    assert all(result["coalesced_alerts"] == 3 for result in results)
+    assert coalescer.submit(ALERT).result(5)["status"] == "success"
+    assert coordinator.calls == 1
+    coalescer.shutdown()
+
+
+@pytest.mark.parametrize("failure", [RuntimeError("collector down"), {"status": "error", "error": "x"}])
+def test_failed_investigation_is_not_joined(failure):
+    coordinator = ScriptedCoordinator([failure, {"status": "success"}])
+    coalescer = AlertCoalescer(coordinator, window_seconds=300)
+    first = coalescer.submit(ALERT)
+    if isinstance(failure, Exception):
+        with pytest.raises(RuntimeError):
+            first.result(5)
+    else:
+        assert first.result(5)["status"] == "error"
+    assert coalescer.submit(ALERT).result(5)["status"] == "success"
+    assert coordinator.calls == 2
+    assert coalescer.stats()["investigations"] == 2
+    coalescer.shutdown()
+
+
+def test_async_failed_investigation_is_not_joined():
+    coordinator = ScriptedCoordinator([RuntimeError("collector down"), {"status": "success"}])
+    coalescer = AlertCoalescer(coordinator)
+
+    async def run():
+        with pytest.raises(RuntimeError):
+            await coalescer.asubmit(ALERT)
+        return await coalescer.asubmit(ALERT)
+
+    assert asyncio.run(run())["status"] == "success"
+    assert coordinator.calls == 2
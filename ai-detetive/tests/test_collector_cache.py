@@ -0,0 +1,43 @@
+"""collector结果缓存：查询归一化和缓存键"""
+import pytest
+
+from cassette import collector_key
+from collector_cache import CollectorCache, normalize_query
+from investigation import InvestigationContext
+
+
+@pytest.mark.parametrize("left, right", [
+    ("查询 user_table 状态", "查询user_table状态"),
+    ("查询user_table  状态", "查询 user_table 状态 "),
+    ("ＳＥＬＥＣＴ　id FROM t_order", "SELECT id FROM t_order"),
+    ("amount > 100", "amount>100"),
+])
+def test_equivalent_queries_share_key(left, right):
+    assert normalize_query(left) == normalize_query(right)
+
+
+@pytest.mark.parametrize("left, right", [
+    ("查询 amount > 100 的订单", "查询 amount < 100 的订单"),
+    ("status != 1 的记录", "status = 1 的记录"),
+    ("耗时超过 1.5 秒的请求", "耗时超过 15 秒的请求"),
+    ("查询 (a or b) and c", "查询 a or (b and c)"),
+    ("select a from b", "selectafromb"),
+    ("查询订单!", "查询订单?"),
+])
+def test_different_queries_do_not_collide(left, right):
+    assert normalize_query(left) != normalize_query(right)
+    assert collector_key("db_collector", left) != collector_key("db_collector", right)
+
+
+def test_cache_does_not_return_other_query_result():
+    cache = CollectorCache()
+    cache.put("db_collector", "查询 amount > 100 的订单", "大于100")
+    assert cache.get("db_collector", "查询 amount < 100 的订单") is None
+    assert cache.get("db_collector", "查询amount>100的订单") == "大于100"
+
+
+def test_replay_matches_only_same_query():
+    context = InvestigationContext(problem_description="p", max_rounds=1,
+                                   replay_results={("db_collector", normalize_query("status = 1 的记录")): "r"})
+    assert context.replay("db_collector", "status = 1 的记录") == "r"
+    assert context.replay("db_collector", "status != 1 的记录") is None
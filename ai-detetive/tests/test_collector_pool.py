@@ -0,0 +1,78 @@
+"""采集执行池：超时、卡住线程计数与线程池更换"""
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import pytest
+
+from collector_pool import CollectorPool, CollectorTimeoutError
+
+
+def wait_until(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_result_and_exception_pass_through():
+    pool = CollectorPool(max_workers=2, default_timeout=1.0)
+    try:
+        assert pool.run("log_collector", lambda x, y=0: x + y, 1, y=2) == 3
+        with pytest.raises(ValueError):
+            pool.run("log_collector", lambda: (_ for _ in ()).throw(ValueError("boom")))
+        assert pool.stuck_workers == 0
+    finally:
+        pool.shutdown()
+
+
+def test_stuck_call_is_counted_until_it_returns():
+    pool = CollectorPool(max_workers=1, default_timeout=0.05)
+    release = threading.Event()
+    try:
+        with pytest.raises(CollectorTimeoutError):
+            pool.run("metric_collector", release.wait, 5)
+        assert pool.stuck_workers == 1
+        assert pool.replaced == 1
+        # 唯一的线程被卡住，新调用仍能在新线程池中执行
+        assert pool.run("log_collector", lambda: "ok") == "ok"
+        release.set()
+        assert wait_until(lambda: pool.stuck_workers == 0)
+    finally:
+        release.set()
+        pool.shutdown()
+
+
+def test_queue_wait_does_not_count_towards_timeout():
+    pool = CollectorPool(max_workers=1, default_timeout=0.3)
+    try:
+        with ThreadPoolExecutor(max_workers=2) as callers:
+            first = callers.submit(pool.run, "a_collector", time.sleep, 0.2)
+            second = callers.submit(pool.run, "b_collector", time.sleep, 0.2)
+            first.result()
+            second.result()
+        assert pool.stuck_workers == 0
+    finally:
+        pool.shutdown()
+
+
+def test_call_returning_before_its_future_completes_is_not_counted_as_stuck(monkeypatch):
+    # 调用已返回、但线程池尚未写入结果时发生超时：此时不应再计为卡住的线程
+    set_result = Future.set_result
+
+    def delayed_set_result(self, result):
+        if threading.current_thread().name.startswith("collector"):
+            time.sleep(0.15)
+        set_result(self, result)
+
+    monkeypatch.setattr(Future, "set_result", delayed_set_result)
+    pool = CollectorPool(max_workers=1, default_timeout=0.05)
+    try:
+        with pytest.raises(CollectorTimeoutError):
+            pool.run("log_collector", time.sleep, 0.01)
+        time.sleep(0.3)
+        assert pool.stuck_workers == 0
+    finally:
+        pool.shutdown()
@@ -0,0 +1,130 @@
+"""排查任务队列：失败重试、租约到期回收与执行者校验"""
+import threading
+import time
+
+import pytest
+
+import job_queue
+from job_queue import (
+    STATUS_FAILED,
+    STATUS_PENDING,
+    STATUS_RUNNING,
+    STATUS_SUCCEEDED,
+    InvestigationWorkerPool,
+    JobQueue,
+)
+
+
+@pytest.fixture
+def queue(tmp_path, monkeypatch):
+    # 重试不等待退避时间
+    monkeypatch.setattr(job_queue, "RETRY_BACKOFF_SECONDS", 0.0)
+    return JobQueue(str(tmp_path / "jobs.db"))
+
+
+def test_failed_job_is_retried_until_attempts_run_out(queue):
+    job_id = queue.submit("订单创建失败", max_attempts=2)
+
+    job = queue.claim("worker-a")
+    assert job.id == job_id and job.attempts == 1
+    assert queue.fail(job_id, "第一次失败", owner="worker-a") == STATUS_PENDING
+
+    job = queue.claim("worker-a")
+    assert job.attempts == 2
+    assert queue.fail(job_id, "第二次失败", owner="worker-a") == STATUS_FAILED
+    assert queue.claim("worker-a") is None
+
+    job = queue.get(job_id)
+    assert job.status == STATUS_FAILED and job.error == "第二次失败" and job.owner is None
+
+
+def test_fail_from_previous_owner_is_ignored(queue):
+    job_id = queue.submit("订单创建失败")
+    queue.claim("worker-a")
+
+    assert queue.fail(job_id, "不是我的任务", owner="worker-b") == STATUS_RUNNING
+    job = queue.get(job_id)
+    assert job.status == STATUS_RUNNING and job.owner == "worker-a" and job.error is None
+
+
+def test_expired_lease_is_reclaimed_by_another_owner(queue):
+    job_id = queue.submit("订单创建失败")
+    stale = queue.claim("worker-a", lease_seconds=0.01)
+    time.sleep(0.05)
+
+    job = queue.claim("worker-b")
+    assert job.id == job_id and job.owner == "worker-b" and job.attempts == 2
+    # 租约到期的旧执行者不能再写回结果
+    assert not queue.complete(stale.id, {"status": "completed"}, owner="worker-a")
+    assert queue.complete(job.id, {"status": "completed"}, owner="worker-b")
+    assert queue.get(job_id).status == STATUS_SUCCEEDED
+
+
+def test_expired_lease_without_attempts_left_is_failed(queue):
+    job_id = queue.submit("订单创建失败", max_attempts=1)
+    queue.claim("worker-a", lease_seconds=0.01)
+    time.sleep(0.05)
+
+    assert queue.recover() == {"requeued": 0, "failed": 1}
+    assert queue.get(job_id).status == STATUS_FAILED
+
+
+def test_heartbeat_keeps_lease_alive(queue):
+    job_id = queue.submit("订单创建失败")
+    queue.claim("worker-a", lease_seconds=0.05)
+    time.sleep(0.03)
+    assert queue.heartbeat("worker-a", lease_seconds=60) == 1
+    time.sleep(0.05)
+
+    assert queue.recover() == {"requeued": 0, "failed": 0}
+    assert queue.get(job_id).owner == "worker-a"
+
+
+class RecordingCoordinator:
+    """记录执行线程的协调者"""
+
+    def __init__(self):
+        self.threads = set()
+        self._lock = threading.Lock()
+
+    def investigate(self, problem_description, max_rounds=3, investigation_id=None):
+        with self._lock:
+            self.threads.add(threading.current_thread().name)
+        time.sleep(0.05)
+        return {"status": "completed", "investigation_id": investigation_id}
+
+
+def test_worker_threads_claim_with_their_own_owner(queue):
+    job_ids = [queue.submit(f"告警 {i}") for i in range(4)]
+    owners = set()
+    claim = queue.claim
+
+    def recording_claim(owner=None, lease_seconds=60):
+        owners.add(owner)
+        return claim(owner, lease_seconds)
+
+    queue.claim = recording_claim
+    pool = InvestigationWorkerPool(RecordingCoordinator(), queue, workers=2, poll_interval=0.01)
+    pool.start()
+    try:
+        deadline = time.monotonic() + 5
+        while queue.counts().get(STATUS_SUCCEEDED, 0) < len(job_ids) and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        pool.stop()
+
+    assert all(queue.get(job_id).status == STATUS_SUCCEEDED for job_id in job_ids)
+    assert owners == set(pool.owners) and len(owners) == 2
+
+
+def test_result_is_not_written_after_job_moved_to_another_worker(queue):
+    job_id = queue.submit("订单创建失败")
+    stale = queue.claim("worker-a", lease_seconds=0.01)
+    time.sleep(0.05)
+    queue.claim("worker-b")
+
+    pool = InvestigationWorkerPool(RecordingCoordinator(), queue, workers=1)
+    pool.run_job(stale)
+
+    job = queue.get(job_id)
+    assert job.status == STATUS_RUNNING and job.owner == "worker-b" and job.result is None
@@ -0,0 +1,54 @@
+"""共享HTTP客户端的关闭：同步和异步客户端都要关闭"""
+import asyncio
+
+import pytest
+
+import llm_client
+from fake_llm import FakeOpenAIServer
+
+
+@pytest.fixture
+def server():
+    with FakeOpenAIServer() as server:
+        yield server
+    llm_client.close_clients()
+
+
+def _chat(client, base_url):
+    return client.post(f"{base_url}/chat/completions",
+                       json={"model": "fake-chat", "messages": [{"role": "user", "content": "hi"}]})
+
+
+def test_close_clients_closes_both_clients():
+    client = llm_client.get_http_client()
+    async_client = llm_client.get_async_http_client()
+
+    llm_client.close_clients()
+
+    assert client.is_closed and async_client.is_closed
+    assert llm_client.get_http_client() is not client
+    assert llm_client.get_async_http_client() is not async_client
+    llm_client.close_clients()
+
+
+def test_aclose_clients_closes_async_client_after_use(server):
+    async def run():
+        client = llm_client.get_async_http_client()
+        response = await _chat(client, server.base_url)
+        await llm_client.aclose_clients()
+        return response, client
+
+    response, client = asyncio.run(run())
+    assert response.status_code == 200
+    assert client.is_closed
+
+
+def test_close_clients_inside_event_loop_schedules_async_close(server):
+    async def run():
+        client = llm_client.get_async_http_client()
+        await _chat(client, server.base_url)
+        llm_client.close_clients()
+        await asyncio.sleep(0)
+        return client
+
+    assert asyncio.run(run()).is_closed
@@ -0,0 +1,85 @@
+"""从检查点恢复排查：已完成的轮次不再执行，中断前已返回的collector调用直接回放"""
+import copy
+
+import pytest
+
+import llm_client
+from coordinator_agent import CoordinatorAgent
+from fake_llm import DEFAULT_SCRIPT, FakeChatModel, LatencyDistribution, ScriptedTranscript
+from investigation_store import STATUS_COMPLETED, InvestigationStore
+
+INVESTIGATION_ID = "inv-resume"
+
+
+@pytest.fixture(autouse=True)
+def fake_model():
+    transcript = ScriptedTranscript(copy.deepcopy(DEFAULT_SCRIPT))
+    latency = LatencyDistribution.parse("fixed:0")
+    llm_client.set_chat_model_factory(
+        lambda **kwargs: FakeChatModel(transcript=transcript, latency=latency, model_name=kwargs["model"]))
+    yield
+    llm_client.set_chat_model_factory(None)
+
+
+@pytest.fixture
+def store(tmp_path):
+    return InvestigationStore(str(tmp_path / "investigations.db"))
+
+
+def make_coordinator(store, calls):
+    coordinator = CoordinatorAgent("key", "http://localhost", enable_cache=False, enable_pre_route=False,
+                                   store=store)
+    call_sub_agent = coordinator._call_sub_agent
+
+    def counting_call(name, query, *args, **kwargs):
+        calls.append(name)
+        return call_sub_agent(name, query, *args, **kwargs)
+
+    coordinator._call_sub_agent = counting_call
+    return coordinator
+
+
+def interrupt_in_round_two(coordinator):
+    """执行到第二轮的collector返回后中断（不关闭事件流，模拟进程退出）"""
+    stream = coordinator.stream_investigate("订单创建失败", max_rounds=3, investigation_id=INVESTIGATION_ID)
+    for event in stream:
+        if event.type.value == "tool_result" and event.round == 2:
+            return stream
+    pytest.fail("排查没有进入第二轮")
+
+
+def test_resume_replays_finished_collector_calls(store):
+    first_calls = []
+    stream = interrupt_in_round_two(make_coordinator(store, first_calls))
+    assert sorted(first_calls) == ["code_collector", "db_collector", "log_collector", "prd_collector"]
+
+    checkpoint = store.load(INVESTIGATION_ID)
+    assert checkpoint["status"] != STATUS_COMPLETED
+    assert [finding["round"] for finding in checkpoint["state"]["findings"]] == [1]
+
+    resumed_calls = []
+    result = make_coordinator(store, resumed_calls).resume(INVESTIGATION_ID)
+
+    # 第一轮不再执行，第二轮中断前已返回的 prd_collector 结果直接回放
+    assert resumed_calls == []
+    assert result["status"] == "success"
+    assert result["rounds_completed"] == 2
+    assert result["confidence"] == 85.0
+    assert [finding["round"] for finding in result["findings"]] == [1, 2]
+    assert store.load(INVESTIGATION_ID)["status"] == STATUS_COMPLETED
+    stream.close()
+
+
+def test_resume_completed_investigation_returns_saved_result(store):
+    calls = []
+    coordinator = make_coordinator(store, calls)
+    result = coordinator.investigate("订单创建失败", max_rounds=3, investigation_id=INVESTIGATION_ID)
+    calls.clear()
+
+    assert coordinator.resume(INVESTIGATION_ID) == result
+    assert calls == []
+
+
+def test_resume_unknown_investigation_raises(store):
+    with pytest.raises(ValueError):
+        make_coordinator(store, []).resume("missing")
@@ -0,0 +1,61 @@
+"""提交结论：与collector在同一次回复中调用的 submit_verdict 不生效，协调者看到collector结果后再提交"""
+import asyncio
+import copy
+
+import pytest
+
+import llm_client
+from coordinator_agent import CoordinatorAgent
+from fake_llm import DEFAULT_SCRIPT, FakeChatModel, LatencyDistribution, ScriptedTranscript
+from investigation_verdict import VERDICT_TOOL, lone_verdict_call
+
+QUERY = {"query": "查询错误日志"}
+
+
+@pytest.mark.parametrize("tool_calls, expected", [
+    ([{"name": VERDICT_TOOL, "args": {"confidence": 90}}], {"confidence": 90}),
+    ([{"name": "log_collector", "args": QUERY}, {"name": VERDICT_TOOL, "args": {"confidence": 90}}], None),
+    ([{"name": "log_collector", "args": QUERY}], None),
+    ([], None),
+])
+def test_lone_verdict_call(tool_calls, expected):
+    assert lone_verdict_call(tool_calls) == expected
+
+
+@pytest.fixture(params=[True, False], ids=["resubmitted", "not-resubmitted"])
+def coordinator(request):
+    # 看到collector结果后重新提交结论，或只回复文本（由单独的结构化输出补齐）
+    script = copy.deepcopy(DEFAULT_SCRIPT)
+    script["rounds"] = [{
+        "tool_calls": [{"name": "log_collector", "args": QUERY}],
+        "early_verdict": "置信度: 95",
+        "answer": "结论: 订单校验失败 置信度: 60",
+        "submit_verdict": request.param,
+    }]
+    transcript = ScriptedTranscript(script)
+    latency = LatencyDistribution.parse("fixed:0")
+    llm_client.set_chat_model_factory(
+        lambda **kwargs: FakeChatModel(transcript=transcript, latency=latency, model_name=kwargs["model"]))
+    yield CoordinatorAgent("key", "http://localhost", enable_cache=False, enable_pre_route=False)
+    llm_client.set_chat_model_factory(None)
+
+
+def _check(events):
+    result = events[-1].data["result"]
+    tool_results = [event.data["tool"] for event in events if event.type.value == "tool_result"]
+    confidences = [event.data["confidence"] for event in events if event.type.value == "confidence"]
+    assert tool_results == ["log_collector"]
+    # 采用看到collector结果后提交的结论，而不是与collector一起提前提交的结论
+    assert confidences == [60.0]
+    assert result["confidence"] == 60.0
+
+
+def test_early_verdict_is_deferred_until_collector_results(coordinator):
+    _check(list(coordinator.stream_investigate("订单创建失败", max_rounds=1)))
+
+
+def test_early_verdict_is_deferred_until_collector_results_async(coordinator):
+    async def collect():
+        return [event async for event in coordinator.astream_investigate("订单创建失败", max_rounds=1)]
+
+    _check(asyncio.run(collect()))
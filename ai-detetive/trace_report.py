@@ -0,0 +1,199 @@
+"""
+排查耗时分析命令行工具
+功能：读取 tracing 导出的span文件（JSON lines 或 OTLP/JSON），按排查输出火焰图式的耗时分解：
+每个span的耗时、占根span的比例、排队时间、token数、模型层级、缓存命中和错误，以及按类型和模型层级汇总的耗时
+
+用法：
+    python trace_report.py traces.jsonl                  # 列出文件中的排查
+    python trace_report.py traces.jsonl <排查ID>         # 输出该排查的耗时分解
+    python trace_report.py traces.jsonl --latest         # 输出最近一次排查的耗时分解
+"""
+import argparse
+import sys
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+from tracing import KIND_INVESTIGATION, KIND_LLM, load_spans, trace_id_for
+
+# 耗时条的最大宽度（字符）
+BAR_WIDTH = 30
+
+
+def group_traces(spans: List[Dict]) -> Dict[str, List[Dict]]:
+    """按trace ID分组"""
+    traces: Dict[str, List[Dict]] = defaultdict(list)
+    for span in spans:
+        traces[span["trace_id"]].append(span)
+    return traces
+
+
+def _root(spans: List[Dict]) -> Optional[Dict]:
+    span_ids = {span["span_id"] for span in spans}
+    roots = [span for span in spans if not span.get("parent_id") or span["parent_id"] not in span_ids]
+    return min(roots, key=lambda span: span["start_time"]) if roots else None
+
+
+def list_investigations(spans: List[Dict]) -> List[Dict]:
+    """
+    列出文件中的排查
+
+    Returns:
+        [{"investigation_id", "trace_id", "start_time", "duration", "status", "problem"}]，按开始时间排序
+    """
+    investigations = []
+    for span in spans:
+        if span.get("kind") != KIND_INVESTIGATION:
+            continue
+        attributes = span.get("attributes", {})
+        investigations.append({
+            "investigation_id": attributes.get("investigation_id", span["trace_id"]),
+            "trace_id": span["trace_id"],
+            "start_time": span["start_time"],
+            "duration": span["duration"],
+            "status": span["status"],
+            "problem": attributes.get("problem", "")
+        })
+    return sorted(investigations, key=lambda item: item["start_time"])
+
+
+def _details(span: Dict) -> str:
+    attributes = span.get("attributes", {})
+    details = []
+    if attributes.get("queue_time"):
+        details.append(f"排队 {attributes['queue_time']:.3f}s")
+    if span.get("kind") == KIND_LLM:
+        details.append(f"tokens {attributes.get('prompt_tokens', 0)}/{attributes.get('completion_tokens', 0)}")
+        if attributes.get("model_tier"):
+            fallback = f"，{attributes['fallback_for']}的后备" if attributes.get("fallback_for") else ""
+            details.append(f"层级 {attributes['model_tier']}{fallback}")
+        if attributes.get("cost"):
+            details.append(f"费用 {attributes['cost']:.6f}")
+    if attributes.get("cache"):
+        details.append(f"缓存 {attributes['cache']}")
+    if "confidence" in attributes:
+        details.append(f"置信度 {attributes['confidence']:g}")
+    if span.get("status") == "error":
+        details.append(f"错误: {span.get('error')}")
+    return "  ".join(details)
+
+
+def format_trace(spans: List[Dict]) -> str:
+    """
+    火焰图式的耗时分解：按开始时间缩进展示span树，耗时条按占根span的比例绘制
+
+    Args:
+        spans: 同一trace的span
+
+    Returns:
+        多行文本
+    """
+    root = _root(spans)
+    if root is None:
+        return "没有span"
+    children: Dict[str, List[Dict]] = defaultdict(list)
+    for span in spans:
+        if span is not root and span.get("parent_id"):
+            children[span["parent_id"]].append(span)
+    total = root["duration"] or 1e-9
+    lines = []
+
+    def walk(span: Dict, prefix: str, is_last: bool, depth: int) -> None:
+        branch = "" if depth == 0 else ("└─ " if is_last else "├─ ")
+        offset = int(BAR_WIDTH * (span["start_time"] - root["start_time"]) / total)
+        width = max(1, int(BAR_WIDTH * span["duration"] / total))
+        bar = (" " * offset + "█" * width)[:BAR_WIDTH].ljust(BAR_WIDTH)
+        label = f"{prefix}{branch}{span['name']}"
+        lines.append(f"{label:<48} {span['duration']:>9.3f}s {100 * span['duration'] / total:>5.1f}% |{bar}| "
+                     f"{_details(span)}".rstrip())
+        kids = sorted(children.get(span["span_id"], []), key=lambda item: item["start_time"])
+        child_prefix = prefix + ("" if depth == 0 else ("   " if is_last else "│  "))
+        for i, child in enumerate(kids):
+            walk(child, child_prefix, i == len(kids) - 1, depth + 1)
+
+    walk(root, "", True, 0)
+    return "\n".join(lines)
+
+
+def summarize_trace(spans: List[Dict]) -> str:
+    """
+    按span类型汇总：数量、累计耗时、错误数、token数和缓存命中，以及按模型层级汇总LLM调用
+
+    Args:
+        spans: 同一trace的span
+
+    Returns:
+        多行文本
+    """
+    by_kind: Dict[str, Dict] = defaultdict(lambda: {"count": 0, "seconds": 0.0, "errors": 0})
+    by_tier: Dict[str, Dict] = defaultdict(lambda: {"count": 0, "seconds": 0.0, "tokens": 0, "cost": 0.0,
+                                                    "fallbacks": 0})
+    prompt_tokens = completion_tokens = 0
+    cache: Dict[str, int] = defaultdict(int)
+    for span in spans:
+        stats = by_kind[span.get("kind", "")]
+        stats["count"] += 1
+        stats["seconds"] += span["duration"]
+        stats["errors"] += span.get("status") == "error"
+        attributes = span.get("attributes", {})
+        prompt_tokens += attributes.get("prompt_tokens", 0) or 0
+        completion_tokens += attributes.get("completion_tokens", 0) or 0
+        if attributes.get("cache"):
+            cache[attributes["cache"]] += 1
+        if span.get("kind") == KIND_LLM and attributes.get("model_tier"):
+            tier = by_tier[attributes["model_tier"]]
+            tier["count"] += 1
+            tier["seconds"] += span["duration"]
+            tier["tokens"] += (attributes.get("prompt_tokens", 0) or 0) + (attributes.get("completion_tokens", 0) or 0)
+            tier["cost"] += attributes.get("cost", 0.0) or 0.0
+            tier["fallbacks"] += bool(attributes.get("fallback_for"))
+
+    # 表头为中文（每个字符占两列），按显示宽度对齐
+    lines = [f"{'类型':<14}{'数量':>4}{'累计耗时':>10}{'错误':>4}"]
+    for kind, stats in by_kind.items():
+        lines.append(f"{kind:<16}{stats['count']:>6}{stats['seconds']:>13.3f}s{stats['errors']:>6}")
+    lines.append(f"token: 提示词 {prompt_tokens}，输出 {completion_tokens}")
+    if cache:
+        lines.append("collector缓存: " + "，".join(f"{key} {value}" for key, value in sorted(cache.items())))
+    for name, tier in sorted(by_tier.items()):
+        # 平均耗时和费用用于比较各模型层级
+        lines.append(f"模型层级 {name}: 调用 {tier['count']}，平均耗时 {tier['seconds'] / tier['count']:.3f}s，"
+                     f"token {tier['tokens']}，费用 {tier['cost']:.6f}"
+                     + (f"，作为后备 {tier['fallbacks']}" if tier["fallbacks"] else ""))
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="排查耗时分析")
+    parser.add_argument("path", help="span文件（JSON lines 或 OTLP/JSON）")
+    parser.add_argument("investigation_id", nargs="?", help="排查ID（省略时列出文件中的排查）")
+    parser.add_argument("--latest", action="store_true", help="输出最近一次排查的耗时分解")
+    args = parser.parse_args(argv)
+
+    spans = load_spans(args.path)
+    traces = group_traces(spans)
+    investigations = list_investigations(spans)
+
+    if args.investigation_id is None and not args.latest:
+        for item in investigations:
+            print(f"{item['investigation_id']}  {item['duration']:>9.3f}s  {item['status']:<5}  {item['problem'][:60]}")
+        return 0
+
+    if args.latest:
+        if not investigations:
+            print("文件中没有排查", file=sys.stderr)
+            return 1
+        trace_id = investigations[-1]["trace_id"]
+    else:
+        trace_id = trace_id_for(args.investigation_id)
+    if trace_id not in traces:
+        print(f"未找到排查: {args.investigation_id}", file=sys.stderr)
+        return 1
+
+    print(format_trace(traces[trace_id]))
+    print()
+    print(summarize_trace(traces[trace_id]))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
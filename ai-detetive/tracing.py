@@ -0,0 +1,469 @@
+"""
+排查链路追踪
+功能：记录一次排查中嵌套的耗时区间（span）：排查 → 轮次 → collector调用 → 子Agent → LLM调用，
+包含耗时、排队时间、提示词和输出token数、缓存命中和错误；结束的span导出为JSON lines
+或OTLP/JSON文件，可用 trace_report.py 查看每次排查的耗时分布
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Callable, Deque, Dict, List, Optional, Union
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# span类型
+KIND_INVESTIGATION = "investigation"
+KIND_ROUND = "round"
+KIND_TOOL = "tool"
+KIND_AGENT = "agent"
+KIND_LLM = "llm"
+
+# 默认服务名（OTLP resource 的 service.name）
+DEFAULT_SERVICE_NAME = "ai-detective"
+
+# 属性中保留的最大文本长度
+MAX_ATTRIBUTE_CHARS = 200
+
+# 从模型调用元数据记录到LLM span的路由信息（见 model_routing）
+ROUTING_ATTRIBUTES = ("model_route", "model_tier", "fallback_for")
+
+_HEX32_PATTERN = re.compile(r"[0-9a-f]{32}")
+
+
+def trace_id_for(investigation_id: str) -> str:
+    """
+    排查ID对应的trace ID（32位十六进制，符合OTLP要求）
+
+    Args:
+        investigation_id: 排查ID
+
+    Returns:
+        trace ID
+    """
+    if _HEX32_PATTERN.fullmatch(investigation_id):
+        return investigation_id
+    return hashlib.md5(investigation_id.encode("utf-8")).hexdigest()
+
+
+def _truncate(value: Any) -> Any:
+    if isinstance(value, str) and len(value) > MAX_ATTRIBUTE_CHARS:
+        return value[:MAX_ATTRIBUTE_CHARS] + "..."
+    return value
+
+
+@dataclass
+class Span:
+    """一个耗时区间；可作为上下文管理器使用，退出时记录异常并结束"""
+
+    name: str
+    kind: str
+    trace_id: str
+    span_id: str = field(default_factory=lambda: os.urandom(8).hex())
+    parent_id: Optional[str] = None
+    start_time: float = field(default_factory=time.time)
+    end_time: Optional[float] = None
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    status: str = "ok"
+    error: Optional[str] = None
+    tracer: Optional["Tracer"] = field(default=None, repr=False, compare=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    @property
+    def duration(self) -> float:
+        """耗时（秒），未结束时为到当前为止的耗时"""
+        return (self.end_time or time.time()) - self.start_time
+
+    def set(self, **attributes) -> "Span":
+        """设置属性"""
+        with self._lock:
+            self.attributes.update({key: _truncate(value) for key, value in attributes.items()})
+        return self
+
+    def add(self, key: str, amount: float) -> None:
+        """累加数值属性（如token数）"""
+        with self._lock:
+            self.attributes[key] = self.attributes.get(key, 0) + amount
+
+    def record_error(self, error: Union[BaseException, str]) -> None:
+        """记录错误"""
+        self.status = "error"
+        self.error = _truncate(str(error) or type(error).__name__)
+
+    def end(self) -> None:
+        """结束并导出（重复调用无效）"""
+        with self._lock:
+            if self.end_time is not None:
+                return
+            self.end_time = time.time()
+        if self.tracer is not None:
+            self.tracer.export(self)
+
+    def __enter__(self) -> "Span":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc is not None:
+            self.record_error(exc)
+        self.end()
+
+    def to_dict(self) -> Dict:
+        """导出为可JSON序列化的字典"""
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "kind": self.kind,
+            "start_time": self.start_time,
+            "end_time": self.end_time,
+            "duration": round(self.duration, 6),
+            "attributes": dict(self.attributes),
+            "status": self.status,
+            "error": self.error
+        }
+
+
+class JsonlSpanExporter:
+    """每个span一行JSON"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, span: Span) -> None:
+        line = json.dumps(span.to_dict(), ensure_ascii=False, default=str)
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+class InMemorySpanExporter:
+    """在内存中保留最近结束的span（用于测试和基准测试）"""
+
+    def __init__(self, max_spans: int = 100_000):
+        self.spans: Deque[Dict] = deque(maxlen=max_spans)
+
+    def export(self, span: Span) -> None:
+        self.spans.append(span.to_dict())
+
+
+def _otlp_value(value: Any) -> Dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": value if isinstance(value, str) else json.dumps(value, ensure_ascii=False, default=str)}
+
+
+def _otlp_attributes(attributes: Dict) -> List[Dict]:
+    return [{"key": key, "value": _otlp_value(value)} for key, value in attributes.items() if value is not None]
+
+
+class OtlpJsonSpanExporter:
+    """
+    OTLP/JSON文件：每行一个 ExportTraceServiceRequest（与 OpenTelemetry Collector 的 file exporter 格式一致），
+    可被支持OTLP的工具导入
+    """
+
+    def __init__(self, path: str, service_name: str = DEFAULT_SERVICE_NAME):
+        self.path = path
+        self.service_name = service_name
+        self._lock = threading.Lock()
+
+    def export(self, span: Span) -> None:
+        otlp_span = {
+            "traceId": span.trace_id,
+            "spanId": span.span_id,
+            "name": span.name,
+            "kind": 1,
+            "startTimeUnixNano": str(int(span.start_time * 1e9)),
+            "endTimeUnixNano": str(int((span.end_time or span.start_time) * 1e9)),
+            "attributes": _otlp_attributes(dict(span.attributes, **{"span.kind": span.kind})),
+            "status": {"code": 2, "message": span.error or ""} if span.status == "error" else {"code": 1}
+        }
+        if span.parent_id:
+            otlp_span["parentSpanId"] = span.parent_id
+        request = {"resourceSpans": [{
+            "resource": {"attributes": _otlp_attributes({"service.name": self.service_name})},
+            "scopeSpans": [{"scope": {"name": "ai-detetive.tracing"}, "spans": [otlp_span]}]
+        }]}
+        line = json.dumps(request, ensure_ascii=False, default=str)
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+class Tracer:
+    """
+    链路追踪器：创建span，span结束时交给各导出器
+
+    用法：
+        tracer = Tracer([JsonlSpanExporter("traces.jsonl")])
+        coordinator = CoordinatorAgent(api_key, base_url, tracer=tracer)
+    """
+
+    enabled = True
+
+    def __init__(self, exporters: Optional[List[Any]] = None):
+        """
+        Args:
+            exporters: 导出器列表（实现 export(span) 方法）
+        """
+        self.exporters = list(exporters or [])
+
+    def start_span(self, name: str, kind: str, parent: Optional[Span] = None,
+                   trace_id: Optional[str] = None, **attributes) -> Span:
+        """
+        开始一个span
+
+        Args:
+            name: 名称
+            kind: 类型（investigation / round / tool / agent / llm）
+            parent: 父span（可选），没有时开始新的trace
+            trace_id: 新trace的ID（可选，没有父span时使用，默认随机生成）
+            **attributes: 属性
+
+        Returns:
+            span
+        """
+        if parent is not None and parent.tracer is self:
+            trace_id, parent_id = parent.trace_id, parent.span_id
+        else:
+            trace_id, parent_id = trace_id or os.urandom(16).hex(), None
+        span = Span(name=name, kind=kind, trace_id=trace_id, parent_id=parent_id, tracer=self)
+        if attributes:
+            span.set(**attributes)
+        return span
+
+    def export(self, span: Span) -> None:
+        for exporter in self.exporters:
+            try:
+                exporter.export(span)
+            except Exception as e:
+                logger.warning(f"导出span失败: {str(e)}")
+
+    def callback_handler(self, parent: Union[Span, Callable[[], Optional[Span]], None],
+                         agent: str = "", trace_tools: bool = True) -> Optional["TracingCallbackHandler"]:
+        """
+        LLM调用的追踪回调
+
+        Args:
+            parent: 父span，或在每次LLM调用开始时返回父span的函数
+            agent: 发起调用的Agent名称
+            trace_tools: 是否同时追踪工具调用（子Agent内部的工具）
+
+        Returns:
+            回调处理器
+        """
+        return TracingCallbackHandler(self, parent, agent, trace_tools)
+
+
+class _NoopSpan:
+    """不追踪时使用的空span"""
+
+    start_time = 0.0
+    duration = 0.0
+
+    def set(self, **attributes) -> "_NoopSpan":
+        return self
+
+    def add(self, key: str, amount: float) -> None:
+        pass
+
+    def record_error(self, error) -> None:
+        pass
+
+    def end(self) -> None:
+        pass
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class NoopTracer(Tracer):
+    """不追踪：span不记录任何内容，不添加回调"""
+
+    enabled = False
+
+    def start_span(self, name: str, kind: str, parent=None, trace_id=None, **attributes):
+        return _NOOP_SPAN
+
+    def callback_handler(self, parent, agent: str = "", trace_tools: bool = True):
+        return None
+
+
+def _usage(response: LLMResult) -> Dict[str, int]:
+    """从LLM返回结果中读取提示词和输出token数"""
+    prompt_tokens = completion_tokens = 0
+    for generations in response.generations:
+        for generation in generations:
+            usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if usage:
+                prompt_tokens += usage.get("input_tokens", 0)
+                completion_tokens += usage.get("output_tokens", 0)
+    if not prompt_tokens and not completion_tokens and response.llm_output:
+        usage = response.llm_output.get("token_usage") or {}
+        prompt_tokens = usage.get("prompt_tokens", 0) or 0
+        completion_tokens = usage.get("completion_tokens", 0) or 0
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens}
+
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    """把LLM调用（以及可选的工具调用）记录为span"""
+
+    # 异步调用时在事件循环中直接执行，保证span的开始时间准确
+    run_inline = True
+
+    def __init__(self, tracer: Tracer, parent: Union[Span, Callable[[], Optional[Span]], None],
+                 agent: str = "", trace_tools: bool = True):
+        self.tracer = tracer
+        self.parent = parent
+        self.agent = agent
+        self.trace_tools = trace_tools
+        self._spans: Dict[UUID, Span] = {}
+        self._prices: Dict[UUID, tuple] = {}
+        self._lock = threading.Lock()
+
+    def _parent_span(self, parent_run_id: Optional[UUID]) -> Optional[Span]:
+        with self._lock:
+            span = self._spans.get(parent_run_id) if parent_run_id else None
+        if span is not None:
+            return span
+        return self.parent() if callable(self.parent) else self.parent
+
+    def _start(self, run_id: UUID, parent_run_id: Optional[UUID], name: str, kind: str, **attributes) -> None:
+        span = self.tracer.start_span(name, kind, parent=self._parent_span(parent_run_id), **attributes)
+        with self._lock:
+            self._spans[run_id] = span
+
+    def _end(self, run_id: UUID, error: Optional[BaseException] = None, **attributes) -> None:
+        with self._lock:
+            span = self._spans.pop(run_id, None)
+        if span is None:
+            return
+        if attributes:
+            span.set(**attributes)
+        if error is not None:
+            span.record_error(error)
+        span.end()
+
+    def _start_llm(self, serialized: Dict[str, Any], run_id: UUID, parent_run_id: Optional[UUID],
+                   kwargs: Dict[str, Any]) -> None:
+        params = kwargs.get("invocation_params") or {}
+        model = params.get("model") or params.get("model_name") or (serialized or {}).get("name", "")
+        # 调用时带有标签的（如每轮的结构化结论）在名称中标出，忽略 langgraph 内部的 "seq:step:1" 等标签
+        step = ",".join(tag for tag in kwargs.get("tags") or [] if ":" not in tag)
+        name = f"llm {model} ({step})" if step else f"llm {model}"
+        # model_routing 的路由信息（路由键、模型层级、作为哪个层级的后备）
+        metadata = kwargs.get("metadata") or {}
+        routing = {key: metadata[key] for key in ROUTING_ATTRIBUTES if key in metadata}
+        if metadata.get("input_price") or metadata.get("output_price"):
+            with self._lock:
+                self._prices[run_id] = (metadata.get("input_price", 0.0), metadata.get("output_price", 0.0))
+        self._start(run_id, parent_run_id, name, KIND_LLM, model=model, agent=self.agent, step=step, **routing)
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages, *, run_id: UUID,
+                            parent_run_id: Optional[UUID] = None, **kwargs: Any) -> None:
+        self._start_llm(serialized, run_id, parent_run_id, kwargs)
+
+    def on_llm_start(self, serialized: Dict[str, Any], prompts, *, run_id: UUID,
+                     parent_run_id: Optional[UUID] = None, **kwargs: Any) -> None:
+        self._start_llm(serialized, run_id, parent_run_id, kwargs)
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        usage = _usage(response)
+        with self._lock:
+            prices = self._prices.pop(run_id, None)
+        if prices is not None:
+            # 价格为每百万token
+            cost = usage["prompt_tokens"] * prices[0] + usage["completion_tokens"] * prices[1]
+            usage["cost"] = round(cost / 1e6, 8)
+        self._end(run_id, **usage)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        with self._lock:
+            self._prices.pop(run_id, None)
+        self._end(run_id, error=error)
+
+    def on_tool_start(self, serialized: Dict[str, Any], input_str: str, *, run_id: UUID,
+                      parent_run_id: Optional[UUID] = None, **kwargs: Any) -> None:
+        if self.trace_tools:
+            name = (serialized or {}).get("name") or kwargs.get("name") or "tool"
+            self._start(run_id, parent_run_id, name, KIND_TOOL, agent=self.agent, input=input_str)
+
+    def on_tool_end(self, output: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id)
+
+    def on_tool_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id, error=error)
+
+
+def _from_otlp(span: Dict) -> Dict:
+    """OTLP/JSON span 转换为 Span.to_dict 的格式"""
+    attributes = {}
+    for attribute in span.get("attributes", []):
+        value = attribute.get("value", {})
+        if "intValue" in value:
+            attributes[attribute["key"]] = int(value["intValue"])
+        else:
+            attributes[attribute["key"]] = next(iter(value.values()), None)
+    start = int(span["startTimeUnixNano"]) / 1e9
+    end = int(span["endTimeUnixNano"]) / 1e9
+    error = span.get("status", {}).get("code") == 2
+    return {
+        "trace_id": span["traceId"],
+        "span_id": span["spanId"],
+        "parent_id": span.get("parentSpanId"),
+        "name": span["name"],
+        "kind": attributes.pop("span.kind", ""),
+        "start_time": start,
+        "end_time": end,
+        "duration": end - start,
+        "attributes": attributes,
+        "status": "error" if error else "ok",
+        "error": span["status"].get("message") if error else None
+    }
+
+
+def load_spans(path: str) -> List[Dict]:
+    """
+    读取导出的span（自动识别JSON lines和OTLP/JSON格式）
+
+    Args:
+        path: 文件路径
+
+    Returns:
+        span字典列表（Span.to_dict 的格式）
+    """
+    spans = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if "resourceSpans" in record:
+                for resource_spans in record["resourceSpans"]:
+                    for scope_spans in resource_spans.get("scopeSpans", []):
+                        spans.extend(_from_otlp(span) for span in scope_spans.get("spans", []))
+            else:
+                spans.append(record)
+    return spans
@@ -0,0 +1,126 @@
+"""
+耗时分组统计
+
+latency_analysis（按服务、SQL、时间桶）和 sql_fingerprint（按语句指纹）共用的
+向量化分组分位数计算，以及逐条读取归档日志时使用的流式分位数统计 DurationDigest。
+放在独立模块中，使依赖只有 latency_analysis -> sql_fingerprint 一个方向。
+"""
+
+import math
+from typing import Dict, Sequence
+
+import numpy as np
+
+# 输出的分位数
+PERCENTILES = (50, 95, 99)
+
+# 流式分位数的相对误差：估计值与真实分位数的相对偏差不超过 1%
+DEFAULT_RELATIVE_ACCURACY = 0.01
+
+# 不超过该值（毫秒）的耗时计入零值桶
+MIN_POSITIVE_DURATION = 1e-3
+
+
+def grouped_percentiles(codes: np.ndarray, durations: np.ndarray,
+                        percentiles: Sequence[float] = PERCENTILES) -> Dict[str, np.ndarray]:
+    """
+    向量化计算分组分位数（线性插值，与 np.percentile 默认方法一致）
+
+    Args:
+        codes: 分组编码
+        durations: 延迟
+        percentiles: 分位数列表
+
+    Returns:
+        {"group": 组编码, "count": 组大小, "mean": 均值, "p50": ..., ...}
+    """
+    if durations.size == 0:
+        empty = np.empty(0)
+        result = {"group": np.empty(0, dtype=np.int64), "count": np.empty(0, dtype=np.int64), "mean": empty}
+        result.update({f"p{int(q)}": empty for q in percentiles})
+        return result
+
+    order = np.lexsort((durations, codes))
+    sorted_codes = codes[order]
+    sorted_durations = durations[order]
+
+    starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+    counts = np.diff(np.r_[starts, sorted_codes.size])
+    sums = np.add.reduceat(sorted_durations, starts)
+
+    result = {
+        "group": sorted_codes[starts],
+        "count": counts,
+        "mean": sums / counts,
+    }
+    for q in percentiles:
+        position = starts + (counts - 1) * (q / 100.0)
+        lower = np.floor(position).astype(np.int64)
+        upper = np.minimum(lower + 1, starts + counts - 1)
+        fraction = position - lower
+        result[f"p{int(q)}"] = (
+            sorted_durations[lower] * (1 - fraction) + sorted_durations[upper] * fraction
+        )
+    return result
+
+
+class DurationDigest:
+    """
+    流式耗时统计（DDSketch）：按对数宽度的桶计数，桶数只与耗时的数量级范围有关，与日志条数无关；
+    分位数的相对误差不超过 relative_accuracy，条数、均值、最小值和最大值是精确的
+    """
+
+    __slots__ = ("count", "total", "min", "max", "_zero", "_buckets", "_gamma", "_log_gamma")
+
+    def __init__(self, relative_accuracy: float = DEFAULT_RELATIVE_ACCURACY):
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self._zero = 0
+        self._buckets: Dict[int, int] = {}
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+
+    def add(self, value: float) -> None:
+        """记录一次耗时"""
+        self.count += 1
+        self.total += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        if value <= MIN_POSITIVE_DURATION:
+            self._zero += 1
+        else:
+            index = math.ceil(math.log(value) / self._log_gamma)
+            self._buckets[index] = self._buckets.get(index, 0) + 1
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, q: float) -> float:
+        """
+        估计分位数（与 np.percentile 相同的排名位置）
+
+        Args:
+            q: 分位数（0-100）
+
+        Returns:
+            分位数估计值，没有数据时为 0
+        """
+        if not self.count:
+            return 0.0
+        rank = math.floor((self.count - 1) * q / 100.0)
+        if rank >= self.count - 1:
+            return self.max
+        if rank < self._zero:
+            return max(self.min, 0.0)
+        seen = self._zero
+        for index in sorted(self._buckets):
+            seen += self._buckets[index]
+            if seen > rank:
+                value = 2 * self._gamma ** index / (self._gamma + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
@@ -0,0 +1,442 @@
+"""
+基于 context.duration_ms 的延迟分析
+
+将日志中的 context.duration_ms、context.query、service、timestamp 抽取为
+numpy 列，按服务、SQL 指纹、时间桶分组，向量化计算 p50/p95/p99 与直方图，
+并标记延迟回归。所有分组统计都在一次排序后按组边界完成，百万级日志可在秒级完成。
+
+逐条读取归档日志时使用 LatencyAccumulator 流式累积，不保留日志本身，
+分位数为 DurationDigest 的近似值（相对误差 1%）。
+"""
+
+from bisect import bisect_right
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+
+from duration_stats import PERCENTILES, DurationDigest, grouped_percentiles
+from sql_fingerprint import normalize_sql
+
+# 直方图桶边界（毫秒），最后一个桶为 >= 10000ms
+HISTOGRAM_EDGES_MS = (0, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+# 默认时间桶宽度（秒）
+DEFAULT_BUCKET_SECONDS = 60
+
+# 时间桶 p95 超过该服务基线 p95 的倍数即视为回归
+DEFAULT_REGRESSION_RATIO = 2.0
+
+# 服务或 SQL 的 p95 超过该值（毫秒）即视为慢
+DEFAULT_SLOW_P95_MS = 1000.0
+
+# 参与回归判断的最少样本数
+MIN_GROUP_COUNT = 5
+
+def _encode(values: List[str]) -> Tuple[np.ndarray, List[str]]:
+    """将字符串列编码为整数列，返回 (编码数组, 标签列表)"""
+    labels: Dict[str, int] = {}
+    codes = np.fromiter(
+        (labels.setdefault(value, len(labels)) for value in values),
+        dtype=np.int64,
+        count=len(values),
+    )
+    return codes, list(labels)
+
+
+def _parse_timestamps(values: List[str]) -> np.ndarray:
+    """解析时间戳为 datetime64[s]，无法解析的记为 NaT"""
+    try:
+        return np.array(values, dtype="datetime64[s]")
+    except ValueError:
+        parsed = np.empty(len(values), dtype="datetime64[s]")
+        for i, value in enumerate(values):
+            try:
+                parsed[i] = np.datetime64(value, "s")
+            except ValueError:
+                parsed[i] = np.datetime64("NaT")
+        return parsed
+
+
+def _duration_fields(log: Mapping[str, Any]) -> Optional[Tuple[float, str, str, str]]:
+    """抽取 (duration, service, query, timestamp)，没有 duration_ms 的日志返回 None"""
+    context = log.get("context")
+    if not isinstance(context, Mapping):
+        return None
+    duration = context.get("duration_ms")
+    if not isinstance(duration, (int, float)) or isinstance(duration, bool):
+        return None
+    query = context.get("query")
+    return (
+        float(duration),
+        log.get("service") or "",
+        query if isinstance(query, str) else "",
+        log.get("timestamp") or "NaT",
+    )
+
+
+def build_latency_frame(logs: Iterable[Mapping[str, Any]]) -> Dict[str, Any]:
+    """
+    抽取带 duration_ms 的日志为列式数据
+
+    Args:
+        logs: 日志列表或迭代器（dict 或 LogRecord）
+
+    Returns:
+        列式数据字典：duration、service、query 编码列及其标签、timestamp 列
+    """
+    durations: List[float] = []
+    services: List[str] = []
+    queries: List[str] = []
+    timestamps: List[str] = []
+
+    for log in logs:
+        fields = _duration_fields(log)
+        if fields is None:
+            continue
+        durations.append(fields[0])
+        services.append(fields[1])
+        queries.append(fields[2])
+        timestamps.append(fields[3])
+
+    service_codes, service_labels = _encode(services)
+    # 只对去重后的原始 SQL 做归一化，再把编码映射到归一化后的分组
+    raw_codes, raw_labels = _encode(queries)
+    key_codes, query_labels = _encode([normalize_sql(raw) if raw else "" for raw in raw_labels])
+    query_codes = key_codes[raw_codes]
+    return {
+        "duration": np.asarray(durations, dtype=np.float64),
+        "service": service_codes,
+        "service_labels": service_labels,
+        "query": query_codes,
+        "query_labels": query_labels,
+        "timestamp": _parse_timestamps(timestamps),
+    }
+
+
+def grouped_histogram(codes: np.ndarray, durations: np.ndarray, groups: int,
+                      edges: Sequence[float] = HISTOGRAM_EDGES_MS) -> np.ndarray:
+    """
+    向量化计算分组直方图
+
+    Args:
+        codes: 分组编码
+        durations: 延迟
+        groups: 分组数量
+        edges: 桶边界
+
+    Returns:
+        形状为 (groups, len(edges)) 的计数矩阵
+    """
+    bins = len(edges)
+    bin_index = np.clip(np.searchsorted(edges, durations, side="right") - 1, 0, bins - 1)
+    counts = np.bincount(codes * bins + bin_index, minlength=groups * bins)
+    return counts.reshape(groups, bins)
+
+
+def _group_table(codes: np.ndarray, durations: np.ndarray, labels: Sequence[Any]) -> List[Dict[str, Any]]:
+    """生成分组统计表，按 p95 降序"""
+    stats = grouped_percentiles(codes, durations)
+    histogram = grouped_histogram(codes, durations, len(labels)) if len(labels) else None
+    rows = []
+    for i, group in enumerate(stats["group"]):
+        row = {
+            "key": labels[group],
+            "count": int(stats["count"][i]),
+            "mean": round(float(stats["mean"][i]), 1),
+        }
+        for q in PERCENTILES:
+            row[f"p{q}"] = round(float(stats[f"p{q}"][i]), 1)
+        row["histogram"] = histogram[group].tolist()
+        rows.append(row)
+    rows.sort(key=lambda row: row["p95"], reverse=True)
+    return rows
+
+
+def _bucket_regressions(services: np.ndarray, p95: np.ndarray, counts: np.ndarray,
+                        starts: np.ndarray, service_labels: Sequence[str],
+                        regression_ratio: float) -> List[Dict[str, Any]]:
+    """以服务各时间桶 p95 的中位数为基线，标记明显升高的时间桶"""
+    regressions = []
+    eligible = counts >= MIN_GROUP_COUNT
+    for service in np.unique(services[eligible]):
+        mask = eligible & (services == service)
+        baseline = float(np.median(p95[mask]))
+        if baseline <= 0:
+            continue
+        for i in np.flatnonzero(mask & (p95 >= baseline * regression_ratio)):
+            regressions.append({
+                "kind": "time_bucket",
+                "service": service_labels[service],
+                "bucket_start": str(starts[i]).replace("T", " "),
+                "p95": round(float(p95[i]), 1),
+                "baseline_p95": round(baseline, 1),
+                "ratio": round(float(p95[i]) / baseline, 2),
+            })
+    return regressions
+
+
+def _slow_regressions(report: Dict[str, Any], slow_p95_ms: float) -> List[Dict[str, Any]]:
+    """标记 p95 超过阈值的服务和 SQL"""
+    regressions = []
+    for dimension in ("by_service", "by_query"):
+        for row in report[dimension]:
+            if row["p95"] >= slow_p95_ms:
+                regressions.append({
+                    "kind": "slow_" + dimension[3:],
+                    "key": row["key"],
+                    "count": row["count"],
+                    "p95": row["p95"],
+                })
+    return regressions
+
+
+def _empty_report(total: int) -> Dict[str, Any]:
+    return {
+        "total": total,
+        "histogram_edges_ms": list(HISTOGRAM_EDGES_MS),
+        "overall": {},
+        "by_service": [],
+        "by_query": [],
+        "by_time_bucket": [],
+        "regressions": [],
+    }
+
+
+def analyze_latency(logs: Iterable[Mapping[str, Any]],
+                    bucket_seconds: int = DEFAULT_BUCKET_SECONDS,
+                    regression_ratio: float = DEFAULT_REGRESSION_RATIO,
+                    slow_p95_ms: float = DEFAULT_SLOW_P95_MS) -> Dict[str, Any]:
+    """
+    计算延迟分位数、直方图并标记回归
+
+    Args:
+        logs: 日志列表或迭代器
+        bucket_seconds: 时间桶宽度（秒）
+        regression_ratio: 时间桶 p95 相对服务基线 p95 的回归倍数
+        slow_p95_ms: 慢服务/慢 SQL 的 p95 阈值（毫秒）
+
+    Returns:
+        延迟分析结果字典
+    """
+    frame = build_latency_frame(logs)
+    durations = frame["duration"]
+    report = _empty_report(int(durations.size))
+    if durations.size == 0:
+        return report
+
+    overall = np.percentile(durations, PERCENTILES)
+    report["overall"] = {f"p{q}": round(float(v), 1) for q, v in zip(PERCENTILES, overall)}
+    report["by_service"] = _group_table(frame["service"], durations, frame["service_labels"])
+
+    has_query = np.array([bool(label) for label in frame["query_labels"]])[frame["query"]]
+    if has_query.any():
+        report["by_query"] = _group_table(
+            frame["query"][has_query], durations[has_query], frame["query_labels"]
+        )
+
+    # 时间桶：按 (服务, 桶) 组合分组
+    timestamps = frame["timestamp"]
+    valid = ~np.isnat(timestamps)
+    if valid.any():
+        seconds = timestamps[valid].astype(np.int64)
+        buckets = seconds // bucket_seconds
+        bucket_codes, bucket_labels = np.unique(buckets, return_inverse=True)
+        service_codes = frame["service"][valid]
+        combined = service_codes * len(bucket_codes) + bucket_labels
+        stats = grouped_percentiles(combined, durations[valid])
+
+        group_service = stats["group"] // len(bucket_codes)
+        group_bucket = bucket_codes[stats["group"] % len(bucket_codes)]
+        starts = (group_bucket * bucket_seconds).astype("datetime64[s]")
+        for i in range(stats["group"].size):
+            report["by_time_bucket"].append({
+                "service": frame["service_labels"][group_service[i]],
+                "bucket_start": str(starts[i]).replace("T", " "),
+                "count": int(stats["count"][i]),
+                "p50": round(float(stats["p50"][i]), 1),
+                "p95": round(float(stats["p95"][i]), 1),
+                "p99": round(float(stats["p99"][i]), 1),
+            })
+
+        report["regressions"] = _bucket_regressions(
+            group_service, stats["p95"], stats["count"], starts,
+            frame["service_labels"], regression_ratio,
+        )
+
+    report["regressions"].extend(_slow_regressions(report, slow_p95_ms))
+    return report
+
+
+class _DigestGroup:
+    """LatencyAccumulator 的一个分组：流式分位数 + 直方图"""
+
+    __slots__ = ("digest", "histogram")
+
+    def __init__(self):
+        self.digest = DurationDigest()
+        self.histogram = [0] * len(HISTOGRAM_EDGES_MS)
+
+    def add(self, duration: float) -> None:
+        self.digest.add(duration)
+        self.histogram[max(bisect_right(HISTOGRAM_EDGES_MS, duration) - 1, 0)] += 1
+
+    def row(self, key: Any) -> Dict[str, Any]:
+        row = {"key": key, "count": self.digest.count, "mean": round(self.digest.mean, 1)}
+        for q in PERCENTILES:
+            row[f"p{q}"] = round(self.digest.percentile(q), 1)
+        row["histogram"] = list(self.histogram)
+        return row
+
+
+class LatencyAccumulator:
+    """
+    流式延迟统计：逐条 add 日志，内存只与服务、SQL 指纹和时间桶的数量有关，与日志条数无关。
+    report() 的结构与 analyze_latency 相同，分位数为近似值
+    """
+
+    def __init__(self, bucket_seconds: int = DEFAULT_BUCKET_SECONDS):
+        """
+        Args:
+            bucket_seconds: 时间桶宽度（秒）
+        """
+        self.bucket_seconds = bucket_seconds
+        self.total = 0
+        self._overall = DurationDigest()
+        self._services: Dict[str, _DigestGroup] = {}
+        self._queries: Dict[str, _DigestGroup] = {}
+        self._buckets: Dict[Tuple[str, int], DurationDigest] = {}
+        # 同一秒内的日志共用一次时间戳解析
+        self._last_timestamp: Optional[str] = None
+        self._last_bucket: Optional[int] = None
+
+    def _bucket(self, timestamp: str) -> Optional[int]:
+        """时间戳所在的时间桶序号，无法解析时返回 None"""
+        if timestamp != self._last_timestamp:
+            try:
+                seconds = np.datetime64(timestamp, "s")
+            except ValueError:
+                seconds = np.datetime64("NaT")
+            self._last_timestamp = timestamp
+            self._last_bucket = None if np.isnat(seconds) else int(seconds.astype(np.int64)) // self.bucket_seconds
+        return self._last_bucket
+
+    def add(self, log: Mapping[str, Any]) -> None:
+        """累积一条日志，没有 duration_ms 的日志被忽略"""
+        fields = _duration_fields(log)
+        if fields is None:
+            return
+        duration, service, query, timestamp = fields
+        self.total += 1
+        self._overall.add(duration)
+
+        group = self._services.get(service)
+        if group is None:
+            group = self._services[service] = _DigestGroup()
+        group.add(duration)
+
+        if query:
+            key = normalize_sql(query)
+            group = self._queries.get(key)
+            if group is None:
+                group = self._queries[key] = _DigestGroup()
+            group.add(duration)
+
+        bucket = self._bucket(timestamp)
+        if bucket is not None:
+            digest = self._buckets.get((service, bucket))
+            if digest is None:
+                digest = self._buckets[(service, bucket)] = DurationDigest()
+            digest.add(duration)
+
+    def report(self, regression_ratio: float = DEFAULT_REGRESSION_RATIO,
+               slow_p95_ms: float = DEFAULT_SLOW_P95_MS) -> Dict[str, Any]:
+        """
+        生成延迟分析结果
+
+        Args:
+            regression_ratio: 时间桶 p95 相对服务基线 p95 的回归倍数
+            slow_p95_ms: 慢服务/慢 SQL 的 p95 阈值（毫秒）
+
+        Returns:
+            与 analyze_latency 结构相同的结果字典
+        """
+        report = _empty_report(self.total)
+        if not self.total:
+            return report
+
+        report["overall"] = {f"p{q}": round(self._overall.percentile(q), 1) for q in PERCENTILES}
+        for dimension, groups in (("by_service", self._services), ("by_query", self._queries)):
+            rows = [group.row(key) for key, group in groups.items()]
+            rows.sort(key=lambda row: row["p95"], reverse=True)
+            report[dimension] = rows
+
+        if self._buckets:
+            service_labels = list(self._services)
+            service_codes = {service: i for i, service in enumerate(service_labels)}
+            keys = sorted(self._buckets, key=lambda key: (service_codes[key[0]], key[1]))
+            digests = [self._buckets[key] for key in keys]
+            services = np.array([service_codes[service] for service, _ in keys], dtype=np.int64)
+            p95 = np.array([digest.percentile(95) for digest in digests])
+            counts = np.array([digest.count for digest in digests], dtype=np.int64)
+            starts = (np.array([bucket for _, bucket in keys], dtype=np.int64)
+                      * self.bucket_seconds).astype("datetime64[s]")
+            for i, digest in enumerate(digests):
+                report["by_time_bucket"].append({
+                    "service": keys[i][0],
+                    "bucket_start": str(starts[i]).replace("T", " "),
+                    "count": digest.count,
+                    "p50": round(digest.percentile(50), 1),
+                    "p95": round(float(p95[i]), 1),
+                    "p99": round(digest.percentile(99), 1),
+                })
+            report["regressions"] = _bucket_regressions(
+                services, p95, counts, starts, service_labels, regression_ratio,
+            )
+
+        report["regressions"].extend(_slow_regressions(report, slow_p95_ms))
+        return report
+
+
+def format_latency_report(report: Dict[str, Any], top_n: int = 10) -> str:
+    """
+    将延迟分析结果格式化为文本
+
+    Args:
+        report: analyze_latency 的返回值
+        top_n: 每个维度最多列出的条数
+
+    Returns:
+        延迟分析文本
+    """
+    if not report["total"]:
+        return "无 duration_ms 数据"
+
+    overall = report["overall"]
+    lines = [
+        f"带耗时的日志: {report['total']} 条，"
+        f"整体 p50={overall['p50']}ms p95={overall['p95']}ms p99={overall['p99']}ms",
+        "",
+        "按服务 (p50/p95/p99 ms, 条数):",
+    ]
+    for row in report["by_service"][:top_n]:
+        lines.append(f"  {row['key'] or '(未知)'}: {row['p50']}/{row['p95']}/{row['p99']}, {row['count']}")
+
+    if report["by_query"]:
+        lines.append("")
+        lines.append("按 SQL (p50/p95/p99 ms, 条数):")
+        for row in report["by_query"][:top_n]:
+            lines.append(f"  {row['key']}: {row['p50']}/{row['p95']}/{row['p99']}, {row['count']}")
+
+    if report["regressions"]:
+        lines.append("")
+        lines.append("延迟回归:")
+        for item in report["regressions"][:top_n]:
+            if item["kind"] == "time_bucket":
+                lines.append(
+                    f"  [{item['service']}] {item['bucket_start']} p95={item['p95']}ms，"
+                    f"为基线 {item['baseline_p95']}ms 的 {item['ratio']} 倍"
+                )
+            else:
+                lines.append(f"  [{item['kind']}] {item['key']}: p95={item['p95']}ms ({item['count']} 条)")
+
+    return "\n".join(lines)
@@ -5,6 +5,7 @@
 from langchain.chat_models import init_chat_model
 from langchain.tools import tool
 from langchain.agents import create_agent
+import itertools
 import json
 import re
 from typing import Dict, List, Any, Optional
@@ -12,6 +13,13 @@ from datetime import datetime
 import subprocess
 import os
 
+from log_record import json_default, to_log_records
+from log_serializer import serialize_logs
+from log_sampler import DEFAULT_SAMPLE_SIZE, StratifiedLogSampler, sample_logs
+from latency_analysis import LatencyAccumulator, analyze_latency, format_latency_report
+from log_sources import read_log_files
+from sql_fingerprint import SqlAggregator, aggregate_sql, extract_tables, format_top_statements, normalize_sql
+
 
 # ==================== 预留的输入数据接口 ====================
 
@@ -49,6 +57,9 @@ TARGET_FILES = [
     # "api/routes/payment.py"
 ]
 
+# 从归档日志文件读取的日志条数上限
+DEFAULT_MAX_FILE_LOGS = 5_000_000
+
 
 # ==================== 工具函数 ====================
 
@@ -196,7 +207,7 @@ def extract_key_logs(logs: List[Dict], keywords: List[str] = None) -> List[Dict]
     key_logs = []
     
     for log in logs:
-        log_str = json.dumps(log, ensure_ascii=False).lower()
+        log_str = json.dumps(log, ensure_ascii=False, default=json_default).lower()
         for keyword in keywords:
             if keyword.lower() in log_str:
                 key_logs.append(log)
@@ -278,6 +289,20 @@ def analyze_logs(logs: List[Dict]) -> str:
     return result
 
 
+@tool
+def analyze_log_latency(logs: List[Dict]) -> str:
+    """
+    统计日志 context.duration_ms 的延迟分位数，按服务、SQL、时间桶分组并标记延迟回归
+    
+    Args:
+        logs: SelectDB JSON 格式日志列表
+        
+    Returns:
+        延迟分析结果摘要
+    """
+    return format_latency_report(analyze_latency(logs))
+
+
 @tool
 def search_code(code_files: Dict[str, str], search_term: str) -> str:
     """
@@ -356,13 +381,23 @@ def correlate_log_with_code(logs: List[Dict], code_files: Dict[str, str]) -> str
     """
     error_logs = [log for log in logs if log.get("level") == "ERROR"]
     
+    # 相同错误（消息、异常、服务、SQL 指纹一致）只关联一次代码
+    groups: Dict[tuple, Dict[str, Any]] = {}
+    for log in error_logs:
+        context = log.get("context")
+        query = context.get("query") if isinstance(context, dict) else None
+        statement = normalize_sql(query) if isinstance(query, str) and query.strip() else ""
+        key = (log.get("message", ""), log.get("exception", ""), log.get("service", ""), statement)
+        group = groups.get(key)
+        if group is None:
+            groups[key] = {"query": query if statement else None, "count": 1}
+        else:
+            group["count"] += 1
+    
     correlations = []
+    code_cache: Dict[tuple, Dict[str, str]] = {}
     
-    for log in error_logs:
-        message = log.get("message", "")
-        exception = log.get("exception", "")
-        service = log.get("service", "")
-        
+    for (message, exception, service, statement), group in groups.items():
         # 提取可能的函数名和关键词
         error_keywords = []
         
@@ -376,12 +411,21 @@ def correlate_log_with_code(logs: List[Dict], code_files: Dict[str, str]) -> str
         words = re.findall(r'\b\w+\b', message)
         error_keywords.extend(words[:5])  # 取前5个词
         
-        # 搜索相关代码
-        relevant_code = extract_relevant_code(code_files, error_keywords)
+        # SQL 涉及的表名
+        if group["query"]:
+            error_keywords.extend(extract_tables(group["query"]))
+        
+        # 搜索相关代码，相同关键词只搜索一次
+        keyword_key = tuple(error_keywords)
+        if keyword_key not in code_cache:
+            code_cache[keyword_key] = extract_relevant_code(code_files, error_keywords)
+        relevant_code = code_cache[keyword_key]
         
-        correlation = f"\n=== 错误: {message} ===\n"
+        correlation = f"\n=== 错误: {message} (共 {group['count']} 条) ===\n"
         correlation += f"服务: {service}\n"
         correlation += f"异常: {exception}\n"
+        if statement:
+            correlation += f"SQL: {statement}\n"
         correlation += f"可能的关键词: {', '.join(error_keywords[:5])}\n"
         
         if relevant_code:
@@ -422,6 +466,7 @@ class LogAnalysisAgent:
         # 定义工具
         self.tools = [
             analyze_logs,
+            analyze_log_latency,
             search_code,
             get_function_context,
             correlate_log_with_code
@@ -485,13 +530,43 @@ class LogAnalysisAgent:
 6. 置信度要客观，证据充分时给高分，证据不足时给低分
 """
     
-    def analyze(self, logs: List[Dict], code_files: Dict[str, str]) -> str:
+    def analyze(self, logs: List[Dict], code_files: Dict[str, str],
+                sample_size: int = DEFAULT_SAMPLE_SIZE) -> str:
         """
         分析日志和代码
         
         Args:
             logs: SelectDB JSON 格式日志列表
             code_files: 代码文件字典（文件名: 代码内容）
+            sample_size: 日志超过该数量时按服务和模板分层采样
+            
+        Returns:
+            格式化的分析结果
+        """
+        # 日志过多时分层采样，represents 列表示该条样本代表的日志条数
+        if len(logs) > sample_size:
+            sampled = sample_logs(logs, sample_size=sample_size)
+            prompt_logs = _sampled_prompt_logs(sampled)
+            log_title = _sampled_title(len(logs), sampled)
+        else:
+            prompt_logs = logs
+            log_title = f"共 {len(logs)} 条"
+        
+        # 延迟统计和 SQL 聚合基于全部日志计算，而不是采样结果
+        return self._analyze_prompt(prompt_logs, log_title, analyze_latency(logs),
+                                    aggregate_sql(logs), code_files)
+    
+    def _analyze_prompt(self, prompt_logs: List[Dict], log_title: str, latency_report: Dict[str, Any],
+                        statements: List[Dict[str, Any]], code_files: Dict[str, str]) -> str:
+        """
+        组装提示词并调用 Agent
+        
+        Args:
+            prompt_logs: 写入提示词的日志（全部日志或采样结果）
+            log_title: 日志标题（条数和采样说明）
+            latency_report: 延迟统计（analyze_latency 或 LatencyAccumulator.report 的结果）
+            statements: SQL 指纹聚合结果（aggregate_sql 或 SqlAggregator.result 的结果）
+            code_files: 代码文件字典
             
         Returns:
             格式化的分析结果
@@ -500,9 +575,16 @@ class LogAnalysisAgent:
         user_message = f"""
 请分析以下系统日志和代码，找出问题原因并按照指定格式输出结果。
 
-== 系统日志 (共 {len(logs)} 条) ==
-{json.dumps(logs, ensure_ascii=False, indent=2)[:5000]}
-
+== 系统日志 ({log_title}) ==
+{serialize_logs(prompt_logs, max_chars=5000)}
+"""
+        if latency_report["total"]:
+            user_message += f"\n== 延迟统计 ==\n{format_latency_report(latency_report)}\n"
+        
+        if statements:
+            user_message += f"\n== 问题 SQL 语句 (按指纹聚合) ==\n{format_top_statements(statements)}\n"
+        
+        user_message += f"""
 == 代码文件 (共 {len(code_files)} 个) ==
 """
         for file_path, code in code_files.items():
@@ -515,6 +597,69 @@ class LogAnalysisAgent:
         )
         
         return result.get("messages")[-1].content
+    
+    def analyze_files(self, patterns: List[str], code_files: Dict[str, str],
+                      start: Optional[str] = None, end: Optional[str] = None,
+                      sample_size: int = DEFAULT_SAMPLE_SIZE,
+                      max_logs: int = DEFAULT_MAX_FILE_LOGS) -> str:
+        """
+        从归档日志文件读取日志并分析
+        
+        归并后的日志流只遍历一次：逐条送入分层采样器、流式延迟统计和 SQL 聚合，
+        不在内存中保存日志列表，内存只与模板、服务、SQL 指纹和时间桶的数量有关
+        
+        Args:
+            patterns: 日志文件通配符列表（支持 .gz / .zst）
+            code_files: 代码文件字典（文件名: 代码内容）
+            start: 开始时间（可选），如 "2026-01-04 10:00:00"
+            end: 结束时间（可选）
+            sample_size: 日志超过该数量时按服务和模板分层采样
+            max_logs: 最多读取的日志条数，超出部分不再读取
+            
+        Returns:
+            格式化的分析结果
+        """
+        sampler = StratifiedLogSampler(sample_size)
+        # 日志不超过 sample_size 条时直接全部写入提示词
+        head: List[Dict] = []
+        latency = LatencyAccumulator()
+        sql = SqlAggregator()
+        for log in itertools.islice(read_log_files(patterns, start=start, end=end), max_logs):
+            sampler.add(log)
+            if len(head) <= sample_size:
+                head.append(log)
+            if log.context_raw is not None:
+                latency.add(log)
+                sql.add(log)
+        
+        total = sampler.total
+        truncated = f"（已达读取上限 {max_logs} 条，其余未读取）" if total >= max_logs else ""
+        if total > sample_size:
+            sampled = sampler.result()
+            prompt_logs = _sampled_prompt_logs(sampled)
+            log_title = _sampled_title(total, sampled, truncated)
+        else:
+            prompt_logs = head
+            log_title = f"共 {total} 条{truncated}"
+        
+        return self._analyze_prompt(prompt_logs, log_title, latency.report(), sql.result(), code_files)
+
+
+def _sampled_title(total: int, sampled: Dict[str, Any], truncated: str = "") -> str:
+    """采样日志的标题：总条数、分层数和样本数，以及未入选分层的汇总"""
+    title = f"共 {total} 条{truncated}，按 {sampled['strata']} 类模板分层采样 {sampled['sample_size']} 条"
+    omitted = sampled["omitted"]
+    if omitted["strata"]:
+        services = "，".join(f"{service or '(未知)'}: {count}"
+                            for service, count in sorted(omitted["by_service"].items(),
+                                                         key=lambda item: item[1], reverse=True))
+        title += f"；另有 {omitted['strata']} 类模板共 {omitted['logs']} 条未入选（{services}）"
+    return title
+
+
+def _sampled_prompt_logs(sampled: Dict[str, Any]) -> List[Dict]:
+    """采样结果转为提示词日志，represents 列表示该条样本代表的日志条数"""
+    return [{**item["log"], "represents": item["represents"]} for item in sampled["samples"]]
 
 
 # ==================== 主函数示例 ====================
@@ -540,7 +685,8 @@ def main():
             print(f"  - {file_path}")
         
         print("\n=== 开始分析... ===")
-        result = agent.analyze(SELECTDB_LOGS, code_files)
+        # 转换为列式存储的 LogTable，减少大批量日志的内存占用
+        result = agent.analyze(to_log_records(SELECTDB_LOGS), code_files)
         print("\n" + result)
     
     # ==================== 方式2: 直接传入日志和代码 ====================
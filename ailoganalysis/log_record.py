@@ -0,0 +1,430 @@
+"""
+紧凑的日志记录表示
+
+SelectDB 导出的每条日志原本是一个完整的 dict，重复的键名以及 "ERROR"、
+"payment-service" 这类低基数取值在百万级日志下会占用数 GB 内存。
+LogRecord 使用 __slots__ 存储固定字段，对低基数字段做字符串驻留，
+context 以原始 JSON 字节保存、仅在访问时解析（同一批次内相同的 context 共享字节对象），同时通过 Mapping 接口
+保持与原有基于 dict 的工具函数兼容（log.get("level") 等写法无需修改）。
+
+需要整批常驻内存的日志由 LogTable 按列存储：每个字段每条记录只占 4 字节编码，
+不同的取值以 UTF-8 拼接在一块连续内存中只存一份，访问某条记录时才生成 LogRecord。
+每条记录不再对应任何常驻的 Python 对象，内存约为原始 dict 的十分之一。
+"""
+
+import json
+import sys
+from array import array
+from collections.abc import Mapping, Sequence
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Union
+
+
+# 按原始日志字段顺序排列的固定字段
+FIELDS = (
+    "timestamp",
+    "level",
+    "service",
+    "message",
+    "exception",
+    "request_id",
+    "user_id",
+    "trace_id",
+)
+
+_CONTEXT = "context"
+
+
+# 每个批次的 context 字节去重池的容量上限，超过后不再收录新值
+CONTEXT_POOL_SIZE = 65536
+
+# LogTable 每列构建时的去重池容量上限，超过后新取值不再去重（与上一条相同的取值仍然共享）
+COLUMN_POOL_SIZE = 65536
+
+# LogTable 中不同取值不超过该数量的列，解码后的取值常驻内存，访问时不再解码
+DECODED_VALUES_LIMIT = 4096
+
+# LogTable 列编码中表示缺失值
+_MISSING = 0xFFFFFFFF
+
+# 非字符串取值在列中以该前缀加紧凑 JSON 保存
+_JSON_PREFIX = b"\x00"
+
+
+def _intern(value: Any) -> Any:
+    """对字符串做驻留，非字符串原样返回"""
+    if isinstance(value, str):
+        return sys.intern(value)
+    return value
+
+
+def _share_context(raw: bytes, pool: Optional[Dict[bytes, bytes]]) -> bytes:
+    """相同内容的 context 字节共享同一对象（去重池随批次释放，不在进程内常驻）"""
+    if pool is None:
+        return raw
+    shared = pool.get(raw)
+    if shared is not None:
+        return shared
+    if len(pool) < CONTEXT_POOL_SIZE:
+        pool[raw] = raw
+    return raw
+
+
+class LogRecord(Mapping):
+    """
+    紧凑日志记录
+
+    固定字段存放在 slot 中，缺失字段为 None；context 保存为紧凑 JSON 字节，
+    其他未知字段放在 _extra 中（没有时为 None，不额外分配 dict）。
+    """
+
+    __slots__ = FIELDS + ("_context_raw", "_extra")
+
+    def __init__(self, timestamp: str = None, level: str = None, service: str = None,
+                 message: str = None, exception: str = None, request_id: str = None,
+                 user_id: str = None, trace_id: str = None,
+                 context_raw: Optional[bytes] = None, extra: Optional[Dict[str, Any]] = None):
+        self.timestamp = timestamp
+        # level、service、exception 重复度高，驻留后所有记录共享同一字符串对象；
+        # message 多为拼接了参数的自由文本，基数高，不做驻留
+        self.level = _intern(level)
+        self.service = _intern(service)
+        self.message = message
+        self.exception = _intern(exception)
+        self.request_id = request_id
+        self.user_id = user_id
+        self.trace_id = trace_id
+        self._context_raw = context_raw
+        self._extra = extra or None
+
+    # ==================== 构造 ====================
+
+    @classmethod
+    def from_dict(cls, log: Dict[str, Any], context_pool: Optional[Dict[bytes, bytes]] = None) -> "LogRecord":
+        """
+        从原始日志 dict 构造
+
+        Args:
+            log: SelectDB JSON 日志
+            context_pool: 当前批次的 context 去重池（可选，为 None 时不去重）
+
+        Returns:
+            LogRecord 实例
+        """
+        extra = None
+        context_raw = None
+        for key, value in log.items():
+            if key in FIELDS:
+                continue
+            if key == _CONTEXT:
+                if value is not None:
+                    context_raw = _share_context(json.dumps(
+                        value, ensure_ascii=False, separators=(",", ":")
+                    ).encode("utf-8"), context_pool)
+                continue
+            if extra is None:
+                extra = {}
+            extra[sys.intern(key)] = value
+
+        return cls(
+            timestamp=log.get("timestamp"),
+            level=log.get("level"),
+            service=log.get("service"),
+            message=log.get("message"),
+            exception=log.get("exception"),
+            request_id=log.get("request_id"),
+            user_id=log.get("user_id"),
+            trace_id=log.get("trace_id"),
+            context_raw=context_raw,
+            extra=extra,
+        )
+
+    @classmethod
+    def from_json(cls, line: Union[str, bytes], context_pool: Optional[Dict[bytes, bytes]] = None) -> "LogRecord":
+        """
+        从一行 JSON 文本构造
+
+        Args:
+            line: 一行 JSONL 日志
+            context_pool: 当前批次的 context 去重池（可选）
+
+        Returns:
+            LogRecord 实例
+        """
+        return cls.from_dict(json.loads(line), context_pool)
+
+    # ==================== context 延迟解析 ====================
+
+    @property
+    def context_raw(self) -> Optional[bytes]:
+        """context 的原始 JSON 字节"""
+        return self._context_raw
+
+    @property
+    def context(self) -> Optional[Dict[str, Any]]:
+        """访问时才解析 context，不缓存解析结果以保持记录紧凑"""
+        if self._context_raw is None:
+            return None
+        return json.loads(self._context_raw)
+
+    def context_get(self, key: str, default: Any = None) -> Any:
+        """读取 context 中的单个字段"""
+        context = self.context
+        if not isinstance(context, dict):
+            return default
+        return context.get(key, default)
+
+    # ==================== Mapping 接口 ====================
+
+    def __getitem__(self, key: str) -> Any:
+        if key in FIELDS:
+            value = getattr(self, key)
+        elif key == _CONTEXT:
+            value = self.context
+        elif self._extra is not None and key in self._extra:
+            return self._extra[key]
+        else:
+            raise KeyError(key)
+
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __iter__(self) -> Iterator[str]:
+        for key in FIELDS:
+            if getattr(self, key) is not None:
+                yield key
+        if self._context_raw is not None:
+            yield _CONTEXT
+        if self._extra is not None:
+            yield from self._extra
+
+    def __len__(self) -> int:
+        count = sum(1 for key in FIELDS if getattr(self, key) is not None)
+        if self._context_raw is not None:
+            count += 1
+        if self._extra is not None:
+            count += len(self._extra)
+        return count
+
+    def __contains__(self, key: object) -> bool:
+        if key in FIELDS:
+            return getattr(self, key) is not None
+        if key == _CONTEXT:
+            return self._context_raw is not None
+        return self._extra is not None and key in self._extra
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, Mapping):
+            return self.to_dict() == dict(other)
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return f"LogRecord({self.to_dict()!r})"
+
+    def to_dict(self) -> Dict[str, Any]:
+        """还原为普通 dict（字段顺序与原始日志一致）"""
+        return {key: self[key] for key in self}
+
+
+# ==================== 列式存储 ====================
+
+def _encode_value(value: Any) -> bytes:
+    """字符串存为 UTF-8，其他取值存为带前缀的紧凑 JSON"""
+    if isinstance(value, str) and not value.startswith("\x00"):
+        return value.encode("utf-8")
+    return _JSON_PREFIX + json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _decode_value(raw: bytes) -> Any:
+    if raw.startswith(_JSON_PREFIX):
+        return json.loads(raw[1:])
+    return raw.decode("utf-8")
+
+
+class _Column:
+    """
+    字典编码的列：每条记录保存 4 字节编码，不同取值拼接在 data 中只存一份
+
+    构建时用有上限的去重池查找已有取值，freeze() 后释放去重池
+    """
+
+    __slots__ = ("codes", "_data", "_offsets", "_pool", "_last", "_last_code", "_values", "_intern")
+
+    def __init__(self, intern: bool = False):
+        self.codes = array("I")
+        self._data = bytearray()
+        self._offsets = array("Q", [0])
+        self._pool: Optional[Dict[bytes, int]] = {}
+        self._last: Optional[bytes] = None
+        self._last_code = _MISSING
+        self._values: Optional[List[Any]] = None
+        self._intern = intern
+
+    def append(self, value: Any, raw: Optional[bytes] = None) -> None:
+        """追加一个取值（None 表示缺失）；raw 为已编码的字节（context）"""
+        if value is None and raw is None:
+            self.codes.append(_MISSING)
+            return
+        if raw is None:
+            raw = _encode_value(value)
+        if raw == self._last:
+            self.codes.append(self._last_code)
+            return
+        code = self._pool.get(raw) if self._pool is not None else None
+        if code is None:
+            code = len(self._offsets) - 1
+            self._data += raw
+            self._offsets.append(len(self._data))
+            if self._pool is not None and len(self._pool) < COLUMN_POOL_SIZE:
+                self._pool[raw] = code
+        self._last, self._last_code = raw, code
+        self.codes.append(code)
+
+    def freeze(self) -> None:
+        """构建完成：释放去重池，低基数列预先解码"""
+        self._pool = None
+        self._last = None
+        self._data = bytes(self._data)
+        if len(self._offsets) - 1 <= DECODED_VALUES_LIMIT:
+            self._values = [self._decode(code) for code in range(len(self._offsets) - 1)]
+
+    def _decode(self, code: int) -> Any:
+        value = _decode_value(self.raw(code))
+        return _intern(value) if self._intern else value
+
+    def raw(self, code: int) -> bytes:
+        return bytes(self._data[self._offsets[code]:self._offsets[code + 1]])
+
+    def value(self, index: int) -> Any:
+        code = self.codes[index]
+        if code == _MISSING:
+            return None
+        if self._values is not None:
+            return self._values[code]
+        return self._decode(code)
+
+    def raw_value(self, index: int) -> Optional[bytes]:
+        code = self.codes[index]
+        return None if code == _MISSING else self.raw(code)
+
+    def nbytes(self) -> int:
+        """编码、取值和偏移占用的字节数（不含预先解码的低基数取值）"""
+        return (self.codes.itemsize * len(self.codes) + len(self._data)
+                + self._offsets.itemsize * len(self._offsets))
+
+
+class LogTable(Sequence):
+    """
+    列式存储的日志批次
+
+    每个字段一列（见 _Column），context 以原始 JSON 字节存放在同样的列中，
+    未知字段只为带有它们的记录保存。按下标或迭代访问时生成 LogRecord，
+    因此现有基于 LogRecord / dict 的工具函数无需修改。
+    """
+
+    # 低基数字段：预先解码时做字符串驻留，与 LogRecord 一致
+    _INTERNED = ("level", "service", "exception")
+
+    def __init__(self, logs: Iterable[Union[Dict[str, Any], LogRecord]] = ()):
+        """
+        Args:
+            logs: 日志 dict 或 LogRecord
+        """
+        self._columns = {key: _Column(intern=key in self._INTERNED) for key in FIELDS}
+        self._context = _Column()
+        self._extra: Dict[int, Dict[str, Any]] = {}
+        self._length = 0
+        for log in logs:
+            self._append(log)
+        for column in self._all_columns():
+            column.freeze()
+
+    def _all_columns(self) -> List[_Column]:
+        return list(self._columns.values()) + [self._context]
+
+    def _append(self, log: Union[Dict[str, Any], LogRecord]) -> None:
+        if not isinstance(log, LogRecord):
+            log = LogRecord.from_dict(log)
+        for key, column in self._columns.items():
+            column.append(getattr(log, key))
+        self._context.append(None, log.context_raw)
+        if log._extra is not None:
+            self._extra[self._length] = log._extra
+        self._length += 1
+
+    def __len__(self) -> int:
+        return self._length
+
+    def _record(self, index: int) -> LogRecord:
+        return LogRecord(
+            context_raw=self._context.raw_value(index),
+            extra=self._extra.get(index),
+            **{key: column.value(index) for key, column in self._columns.items()},
+        )
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._record(i) for i in range(*index.indices(self._length))]
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("LogTable index out of range")
+        return self._record(index)
+
+    def __iter__(self) -> Iterator[LogRecord]:
+        for index in range(self._length):
+            yield self._record(index)
+
+    def nbytes(self) -> int:
+        """列数据占用的字节数（编码、取值和偏移，不含未知字段）"""
+        return sum(column.nbytes() for column in self._all_columns())
+
+
+# ==================== 工具函数 ====================
+
+def to_log_records(logs: Iterable[Union[Dict[str, Any], LogRecord]]) -> LogTable:
+    """
+    将日志列表转换为列式存储的 LogTable，按下标或迭代访问时得到 LogRecord
+
+    Args:
+        logs: 日志 dict 或 LogRecord 列表
+
+    Returns:
+        LogTable（LogRecord 序列）
+    """
+    return LogTable(logs)
+
+
+def iter_log_records(lines: Iterable[Union[str, bytes]]) -> Iterator[LogRecord]:
+    """
+    流式解析 JSONL 日志，跳过空行和无法解析的行，相同的 context 在本次调用解析的记录间共享
+
+    Args:
+        lines: JSONL 文本行
+
+    Returns:
+        LogRecord 迭代器
+    """
+    context_pool: Dict[bytes, bytes] = {}
+    for line in lines:
+        if not line or not line.strip():
+            continue
+        try:
+            log = json.loads(line)
+        except ValueError:
+            continue
+        if isinstance(log, dict):
+            yield LogRecord.from_dict(log, context_pool)
+
+
+def json_default(obj: Any) -> Any:
+    """json.dumps 的 default 回调，使 LogRecord、LogTable 可以直接序列化"""
+    if isinstance(obj, LogRecord):
+        return obj.to_dict()
+    if isinstance(obj, LogTable):
+        return list(obj)
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
@@ -0,0 +1,250 @@
+"""
+分层日志采样
+
+一次事故可能有十万条 ERROR 日志，直接截取前 5000 个字符往往全是同一种错误。
+这里按 (服务, 日志模板) 分层，一次流式遍历中为每层记录最早、最晚的日志，
+并用蓄水池采样保留随机样本；遍历结束后在固定样本量内为每层分配名额，
+入选的分层总是保留最早和最晚的日志，稀有模板（离群点）优先入选，每条样本标注其代表的日志条数。
+分层数超出样本量时，未入选的分层汇总为 omitted，使 represents 与 omitted 之和等于日志总数。
+"""
+
+import math
+import random
+import re
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Tuple
+
+# 模板化时替换的可变部分，顺序即匹配优先级
+_TEMPLATE_PATTERNS = [
+    (re.compile(r"[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}"), "<uuid>"),
+    (re.compile(r"\b\d{1,3}(?:\.\d{1,3}){3}(?::\d+)?\b"), "<ip>"),
+    (re.compile(r"'[^']*'|\"[^\"]*\""), "<str>"),
+    (re.compile(r"\b0x[0-9a-fA-F]+\b|\b[0-9a-fA-F]*\d[0-9a-fA-F]*[a-fA-F][0-9a-fA-F]*\b"), "<hex>"),
+    (re.compile(r"\b[A-Za-z]+[_-]?\d+\w*\b"), "<id>"),
+    (re.compile(r"\d+(?:\.\d+)?"), "<num>"),
+]
+
+# 默认样本量
+DEFAULT_SAMPLE_SIZE = 50
+
+# 样本入选原因
+REASON_EARLIEST = "earliest"
+REASON_LATEST = "latest"
+REASON_RANDOM = "reservoir"
+
+
+def message_template(message: Optional[str]) -> str:
+    """
+    将日志消息中的可变部分替换为占位符，得到日志模板
+
+    Args:
+        message: 日志消息
+
+    Returns:
+        日志模板
+    """
+    if not message:
+        return ""
+    template = message
+    for pattern, placeholder in _TEMPLATE_PATTERNS:
+        template = pattern.sub(placeholder, template)
+    return template
+
+
+def _exception_class(exception: Optional[str]) -> str:
+    """提取异常类名（冒号前的部分）"""
+    if not exception:
+        return ""
+    return exception.split(":", 1)[0].strip()
+
+
+def stratum_key(log: Mapping[str, Any]) -> Tuple[str, str]:
+    """日志所属的分层：(服务, 模板)"""
+    template = message_template(log.get("message"))
+    exception = _exception_class(log.get("exception"))
+    if exception:
+        template = f"{template} [{exception}]"
+    return log.get("service") or "", template
+
+
+class _Stratum:
+    """单个分层的流式统计"""
+
+    __slots__ = ("count", "earliest", "earliest_ts", "latest", "latest_ts", "reservoir")
+
+    def __init__(self):
+        self.count = 0
+        self.earliest = None
+        self.earliest_ts = None
+        self.latest = None
+        self.latest_ts = None
+        self.reservoir: List[Any] = []
+
+
+class StratifiedLogSampler:
+    """
+    按服务和日志模板分层的流式采样器
+
+    用法：逐条 add() 日志后调用 result()。内存占用为 分层数 × sample_size。
+    """
+
+    def __init__(self, sample_size: int = DEFAULT_SAMPLE_SIZE, seed: Optional[int] = None):
+        """
+        初始化采样器
+
+        Args:
+            sample_size: 最终样本量上限
+            seed: 随机种子（可选，用于复现）
+        """
+        if sample_size <= 0:
+            raise ValueError("sample_size 必须为正整数")
+        self.sample_size = sample_size
+        self.total = 0
+        self._random = random.Random(seed)
+        self._strata: Dict[Tuple[str, str], _Stratum] = {}
+
+    def add(self, log: Mapping[str, Any]) -> None:
+        """加入一条日志"""
+        self.total += 1
+        key = stratum_key(log)
+        stratum = self._strata.get(key)
+        if stratum is None:
+            stratum = self._strata[key] = _Stratum()
+
+        stratum.count += 1
+        # 没有时间戳时按到达顺序处理
+        ts = log.get("timestamp") or ""
+        if stratum.earliest is None or ts < stratum.earliest_ts:
+            stratum.earliest, stratum.earliest_ts = log, ts
+        if stratum.latest is None or ts >= stratum.latest_ts:
+            stratum.latest, stratum.latest_ts = log, ts
+
+        # 蓄水池采样 (Algorithm R)
+        if len(stratum.reservoir) < self.sample_size:
+            stratum.reservoir.append(log)
+        else:
+            index = self._random.randrange(stratum.count)
+            if index < self.sample_size:
+                stratum.reservoir[index] = log
+
+    def extend(self, logs: Iterable[Mapping[str, Any]]) -> "StratifiedLogSampler":
+        """批量加入日志"""
+        for log in logs:
+            self.add(log)
+        return self
+
+    def _allocate(self) -> Dict[Tuple[str, str], int]:
+        """在样本量内为各分层分配名额"""
+        by_count = sorted(self._strata.items(), key=lambda item: item[1].count, reverse=True)
+        # 每层的基本名额：最早和最晚的日志各一条
+        base = {key: min(stratum.count, 2) for key, stratum in by_count}
+
+        if sum(base.values()) > self.sample_size:
+            # 分层过多时，一半名额给高频模板，其余给最稀有的模板，入选的分层都保留最早和最晚的日志
+            quota: Dict[Tuple[str, str], int] = {}
+            budget = math.ceil(self.sample_size / 2)
+            for key, _ in by_count:
+                if base[key] > budget:
+                    break
+                quota[key] = base[key]
+                budget -= base[key]
+            budget = self.sample_size - sum(quota.values())
+            for key, _ in reversed(by_count):
+                if budget <= 0:
+                    break
+                if key not in quota and base[key] <= budget:
+                    quota[key] = base[key]
+                    budget -= base[key]
+            # 凑不出完整分层的零头名额给入选的高频模板
+            for key, stratum in by_count:
+                if budget <= 0:
+                    break
+                if key in quota and quota[key] < stratum.count:
+                    quota[key] += 1
+                    budget -= 1
+            if not quota:
+                # sample_size 为 1 且没有只出现一次的模板：只保留最高频模板的最早一条
+                quota[by_count[0][0]] = 1
+            return quota
+
+        # 每层先保留最早和最晚的日志，剩余名额按日志数量比例分配
+        quota = dict(base)
+        remaining = self.sample_size - sum(quota.values())
+        if remaining > 0 and self.total:
+            for key, stratum in by_count:
+                extra = int(remaining * stratum.count / self.total)
+                quota[key] += extra
+            leftover = self.sample_size - sum(quota.values())
+            for key, _ in by_count:
+                if leftover <= 0:
+                    break
+                quota[key] += 1
+                leftover -= 1
+
+        return {key: min(n, self._strata[key].count) for key, n in quota.items()}
+
+    def result(self) -> Dict[str, Any]:
+        """
+        生成采样结果
+
+        Returns:
+            采样结果字典，samples 中每项包含 log、represents（代表的日志条数）、
+            service、template、reason；omitted 汇总未入选的分层：strata（分层数）、
+            logs（日志条数）、by_service（各服务的日志条数）
+        """
+        samples = []
+        allocation = self._allocate()
+        for key, quota in allocation.items():
+            stratum = self._strata[key]
+            picked: List[Tuple[Any, str]] = [(stratum.earliest, REASON_EARLIEST)]
+            if quota >= 2 and stratum.latest is not stratum.earliest:
+                picked.append((stratum.latest, REASON_LATEST))
+            for log in stratum.reservoir:
+                if len(picked) >= quota:
+                    break
+                if all(log is not chosen for chosen, _ in picked):
+                    picked.append((log, REASON_RANDOM))
+
+            represents = stratum.count / len(picked)
+            service, template = key
+            for log, reason in picked:
+                samples.append({
+                    "log": log,
+                    "represents": round(represents, 1),
+                    "service": service,
+                    "template": template,
+                    "reason": reason,
+                })
+
+        omitted = {"strata": 0, "logs": 0, "by_service": {}}
+        for key, stratum in self._strata.items():
+            if key in allocation:
+                continue
+            service = key[0]
+            omitted["strata"] += 1
+            omitted["logs"] += stratum.count
+            omitted["by_service"][service] = omitted["by_service"].get(service, 0) + stratum.count
+
+        samples.sort(key=lambda item: item["log"].get("timestamp") or "")
+        return {
+            "total": self.total,
+            "strata": len(self._strata),
+            "sample_size": len(samples),
+            "samples": samples,
+            "omitted": omitted,
+        }
+
+
+def sample_logs(logs: Iterable[Mapping[str, Any]], sample_size: int = DEFAULT_SAMPLE_SIZE,
+                seed: Optional[int] = None) -> Dict[str, Any]:
+    """
+    对日志做分层采样
+
+    Args:
+        logs: 日志列表或迭代器（dict 或 LogRecord）
+        sample_size: 样本量上限
+        seed: 随机种子（可选）
+
+    Returns:
+        采样结果字典，见 StratifiedLogSampler.result
+    """
+    return StratifiedLogSampler(sample_size, seed).extend(logs).result()
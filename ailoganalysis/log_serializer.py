@@ -0,0 +1,183 @@
+"""
+面向提示词的日志紧凑序列化
+
+逐条 pretty-print 嵌套 JSON 会在每条日志上重复所有键名。这里先推断本批日志的
+字段结构，只保留有用字段：所有行取值相同的字段提升为公共字段只写一次，
+其余字段写一次表头，之后每条日志一行、以分隔符连接。与上一行相同的值用 "^"
+省略，定长且前缀相同的值（如同一天的时间戳）用 "~" 加后缀缩写；本身以 "^" 或 "~"
+开头的原值前加 "\\" 转义，避免被误读为缩写。
+"""
+
+import json
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Sequence
+
+# 字段分隔符
+DELIMITER = "|"
+
+# 与上一行相同
+DITTO = "^"
+
+# 与上一行同长度、仅后缀不同：~后缀 表示用后缀替换上一行值的末尾
+SUFFIX = "~"
+
+# 原值以缩写标记开头时添加的转义前缀（原值中的 "\" 已转义为 "\\"，不会产生歧义）
+ESCAPE = "\\"
+
+# 前缀缩写的最小公共前缀长度
+MIN_SHARED_PREFIX = 4
+
+# 嵌套字段展开的键（只展开一层）
+NESTED_FIELDS = ("context",)
+
+# 默认优先排在前面的字段
+PREFERRED_ORDER = (
+    "timestamp",
+    "level",
+    "service",
+    "message",
+    "exception",
+    "trace_id",
+    "request_id",
+    "user_id",
+)
+
+
+def _flatten(log: Mapping[str, Any]) -> Dict[str, Any]:
+    """展开一层嵌套字段，如 context.query"""
+    flat = {}
+    for key, value in log.items():
+        if key in NESTED_FIELDS and isinstance(value, Mapping):
+            for sub_key, sub_value in value.items():
+                flat[f"{key}.{sub_key}"] = sub_value
+        else:
+            flat[key] = value
+    return flat
+
+
+def _format_value(value: Any) -> str:
+    """将单个值格式化为单行文本，并转义分隔符"""
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        text = value
+    elif isinstance(value, (dict, list)):
+        text = json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+    else:
+        text = str(value)
+    text = text.replace("\\", "\\\\").replace(DELIMITER, "\\" + DELIMITER)
+    return text.replace("\r", "\\r").replace("\n", "\\n")
+
+
+def _escape_marker(text: str) -> str:
+    """原值以 "^" 或 "~" 开头时转义，使其与缩写区分"""
+    if text.startswith((DITTO, SUFFIX)):
+        return ESCAPE + text
+    return text
+
+
+def _abbreviate(text: str, previous: Optional[str]) -> str:
+    """根据上一行的值省略或缩写当前值"""
+    if previous is None or text == "":
+        return _escape_marker(text)
+    if text == previous:
+        return DITTO
+    if len(text) == len(previous):
+        shared = 0
+        for a, b in zip(text, previous):
+            if a != b:
+                break
+            shared += 1
+        if shared >= MIN_SHARED_PREFIX:
+            return SUFFIX + text[shared:]
+    return _escape_marker(text)
+
+
+def infer_schema(flat_logs: Sequence[Dict[str, Any]],
+                 fields: Optional[Sequence[str]] = None,
+                 exclude: Iterable[str] = ()) -> Dict[str, Any]:
+    """
+    推断日志字段结构
+
+    Args:
+        flat_logs: 展开后的日志列表
+        fields: 指定保留的字段（可选，默认自动推断）
+        exclude: 需要排除的字段
+
+    Returns:
+        {"columns": 逐行输出的字段, "constants": 所有行相同的公共字段}
+    """
+    excluded = set(exclude)
+    seen: Dict[str, int] = {}
+    for log in flat_logs:
+        for key, value in log.items():
+            if value is None or value == "":
+                continue
+            seen[key] = seen.get(key, 0) + 1
+
+    if fields is not None:
+        candidates = [f for f in fields if f in seen and f not in excluded]
+    else:
+        candidates = [f for f in PREFERRED_ORDER if f in seen and f not in excluded]
+        candidates += [f for f in seen if f not in candidates and f not in excluded]
+
+    columns = []
+    constants = {}
+    total = len(flat_logs)
+    for field in candidates:
+        if total > 1 and seen[field] == total:
+            first = _format_value(flat_logs[0].get(field))
+            if all(_format_value(log.get(field)) == first for log in flat_logs[1:]):
+                constants[field] = first
+                continue
+        columns.append(field)
+
+    return {"columns": columns, "constants": constants}
+
+
+def serialize_logs(logs: Sequence[Mapping[str, Any]],
+                   max_chars: Optional[int] = None,
+                   fields: Optional[Sequence[str]] = None,
+                   exclude: Iterable[str] = ()) -> str:
+    """
+    将日志序列化为紧凑的表格文本
+
+    Args:
+        logs: 日志列表（dict 或 LogRecord）
+        max_chars: 输出字符上限，超出后省略剩余行（可选）
+        fields: 指定保留的字段（可选）
+        exclude: 需要排除的字段
+
+    Returns:
+        表格文本
+    """
+    if not logs:
+        return "(无日志)"
+
+    flat_logs = [_flatten(log) for log in logs]
+    schema = infer_schema(flat_logs, fields=fields, exclude=exclude)
+    columns: List[str] = schema["columns"]
+
+    lines = [
+        f"# 格式: 每行一条日志，字段以 '{DELIMITER}' 分隔；"
+        f"'{DITTO}' 表示与上一行相同，'{SUFFIX}xx' 表示用 xx 替换上一行值的末尾，"
+        f"'{ESCAPE}{DITTO}'、'{ESCAPE}{SUFFIX}' 开头的是原值"
+    ]
+    for field, value in schema["constants"].items():
+        lines.append(f"# {field}={value}")
+    lines.append(DELIMITER.join(columns))
+
+    used = sum(len(line) + 1 for line in lines)
+    previous: List[Optional[str]] = [None] * len(columns)
+    for index, log in enumerate(flat_logs):
+        current = [_format_value(log.get(field)) for field in columns]
+        row = DELIMITER.join(
+            _abbreviate(text, prev) for text, prev in zip(current, previous)
+        )
+        if max_chars is not None and used + len(row) + 1 > max_chars:
+            lines.append(f"# ... 省略 {len(flat_logs) - index} 条")
+            break
+        lines.append(row)
+        used += len(row) + 1
+        previous = current
+
+    return "\n".join(lines)
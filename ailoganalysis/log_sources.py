@@ -0,0 +1,363 @@
+"""
+多文件日志读取
+
+归档日志以按小时切分的 gzip / zstd JSONL 文件存放。这里支持通配符和按时间选择文件，
+由线程池并行解压、解析各文件（zlib / zstd 解压时释放 GIL），每个文件只保留有限的
+预读批次以控制内存，最后按时间戳归并，流式产出 LogRecord。
+
+按文件名时间把时间范围重叠的文件分为一组：组内做 k 路归并，互不重叠的组（如逐小时的文件）
+直接依次衔接，同时只打开当前组和预读的下一组，而不是一次打开所有选中的文件。
+文件名中识别不出时间的文件可能包含任意时间的日志，与整个衔接后的日志流一起归并。
+"""
+
+import glob
+import gzip
+import heapq
+import io
+import logging
+import os
+import re
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+from log_record import LogRecord, iter_log_records
+
+try:
+    import zstandard
+except ImportError:  # zstd 为可选依赖，仅读取 .zst 文件时需要
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# 每次解压读取的字节数
+DEFAULT_CHUNK_SIZE = 256 * 1024
+
+# 每个文件最多预读的批次数
+DEFAULT_READ_AHEAD = 2
+
+# 从文件名中识别时间：2026-01-04-10、20260104_10、2026-01-04T10 等；不含小时则按天
+_FILE_TIME_PATTERN = re.compile(r"(\d{4})[-_]?(\d{2})[-_]?(\d{2})(?:[T_\-]?(\d{2}))?(?!\d)")
+
+TimeLike = Union[datetime, str, None]
+
+
+def _to_datetime(value: TimeLike) -> Optional[datetime]:
+    """将 datetime 或 'YYYY-MM-DD HH:MM:SS' 字符串转换为 datetime"""
+    if value is None or isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(value.strip().replace("T", " "))
+
+
+def file_time_range(path: str) -> Optional[Tuple[datetime, datetime]]:
+    """
+    根据文件名推断文件覆盖的时间范围
+
+    Args:
+        path: 文件路径
+
+    Returns:
+        (开始时间, 结束时间)，无法识别时返回 None
+    """
+    match = None
+    for match in _FILE_TIME_PATTERN.finditer(os.path.basename(path)):
+        pass
+    if match is None:
+        return None
+    year, month, day, hour = match.groups()
+    try:
+        start = datetime(int(year), int(month), int(day), int(hour or 0))
+    except ValueError:
+        return None
+    span = timedelta(hours=1) if hour is not None else timedelta(days=1)
+    return start, start + span
+
+
+def select_log_files(patterns: Union[str, Sequence[str]], start: TimeLike = None,
+                     end: TimeLike = None) -> List[str]:
+    """
+    按通配符和时间范围选择日志文件
+
+    Args:
+        patterns: 通配符或通配符列表，支持 ** 递归
+        start: 开始时间（可选）
+        end: 结束时间（可选）
+
+    Returns:
+        按文件时间排序的文件列表；文件名中识别不出时间的文件总是保留
+    """
+    if isinstance(patterns, str):
+        patterns = [patterns]
+    start, end = _to_datetime(start), _to_datetime(end)
+
+    files = set()
+    for pattern in patterns:
+        files.update(p for p in glob.glob(os.path.expanduser(pattern), recursive=True)
+                     if os.path.isfile(p))
+
+    selected = []
+    for path in files:
+        time_range = file_time_range(path)
+        if time_range is not None:
+            file_start, file_end = time_range
+            if start is not None and file_end <= start:
+                continue
+            if end is not None and file_start > end:
+                continue
+        selected.append((time_range[0] if time_range else datetime.min, path))
+
+    selected.sort()
+    return [path for _, path in selected]
+
+
+def open_log_file(path: str) -> io.RawIOBase:
+    """
+    按扩展名打开（并解压）日志文件
+
+    Args:
+        path: 文件路径（.gz、.zst 或未压缩）
+
+    Returns:
+        解压后的二进制流
+    """
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    if path.endswith((".zst", ".zstd")):
+        if zstandard is None:
+            raise ImportError("读取 zstd 日志需要安装 zstandard: pip install zstandard")
+        raw = open(path, "rb")
+        return zstandard.ZstdDecompressor().stream_reader(raw, closefd=True)
+    return open(path, "rb")
+
+
+class _FileReader:
+    """
+    单个文件的分块读取器
+
+    同一时间每个文件最多只有一个读取任务在线程池中执行（解压流有状态），
+    任务读取一个块、解析为 LogRecord 批次后放入缓冲区；缓冲区未满时继续调度下一块。
+    """
+
+    def __init__(self, path: str, pool: ThreadPoolExecutor, chunk_size: int, read_ahead: int):
+        self.path = path
+        self._pool = pool
+        self._chunk_size = chunk_size
+        self._read_ahead = read_ahead
+        self._stream = None
+        self._tail = b""
+        self._batches = deque()
+        self._running = False
+        self._eof = False
+        self._error: Optional[BaseException] = None
+        self._closed = False
+        self._condition = threading.Condition()
+
+    def _schedule(self) -> None:
+        """缓冲区未满且没有读取任务时提交下一块读取（需持有锁）"""
+        if (self._running or self._eof or self._closed or self._error is not None
+                or len(self._batches) >= self._read_ahead):
+            return
+        self._running = True
+        self._pool.submit(self._read_chunk)
+
+    def _read_chunk(self) -> None:
+        """在工作线程中读取、解压并解析一个块"""
+        batch: List[LogRecord] = []
+        eof = False
+        error = None
+        try:
+            if self._stream is None:
+                self._stream = open_log_file(self.path)
+            data = self._stream.read(self._chunk_size)
+            if not data:
+                eof = True
+                lines = [self._tail] if self._tail else []
+                self._tail = b""
+            else:
+                lines = (self._tail + data).split(b"\n")
+                self._tail = lines.pop()
+            batch = list(iter_log_records(lines))
+        except BaseException as e:
+            error = e
+
+        with self._condition:
+            if batch:
+                self._batches.append(batch)
+            if error is not None:
+                self._error = error
+            if eof or error is not None:
+                self._eof = True
+            if self._eof or self._closed:
+                self._close_stream()
+            self._running = False
+            self._schedule()
+            self._condition.notify_all()
+
+    def _close_stream(self) -> None:
+        if self._stream is not None:
+            try:
+                self._stream.close()
+            except OSError:
+                pass
+            self._stream = None
+
+    def prefetch(self) -> None:
+        """提前开始读取第一块，供下一组文件预读"""
+        with self._condition:
+            self._schedule()
+
+    def __iter__(self) -> Iterator[LogRecord]:
+        while True:
+            with self._condition:
+                self._schedule()
+                while not self._batches and not (self._eof and not self._running):
+                    self._condition.wait()
+                if self._error is not None:
+                    raise IOError(f"读取日志文件失败: {self.path}: {self._error}") from self._error
+                if not self._batches:
+                    return
+                batch = self._batches.popleft()
+                self._schedule()
+            yield from batch
+
+    def close(self) -> None:
+        with self._condition:
+            self._closed = True
+            if not self._running:
+                self._close_stream()
+
+
+def _record_time(record: LogRecord) -> str:
+    """归并排序键：统一时间戳中的日期时间分隔符"""
+    timestamp = record.timestamp
+    return timestamp.replace("T", " ") if isinstance(timestamp, str) else ""
+
+
+class LogFileSource:
+    """
+    多文件日志源
+
+    用法：
+        source = LogFileSource("/data/logs/**/*.jsonl.gz", start="2026-01-04 10:00:00")
+        for record in source:
+            ...
+    """
+
+    def __init__(self, patterns: Union[str, Sequence[str]], start: TimeLike = None,
+                 end: TimeLike = None, max_workers: Optional[int] = None,
+                 read_ahead: int = DEFAULT_READ_AHEAD, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        """
+        初始化日志源
+
+        Args:
+            patterns: 通配符或通配符列表
+            start: 开始时间（可选），同时用于选择文件和过滤日志
+            end: 结束时间（可选）
+            max_workers: 解压线程数（默认 CPU 核数）
+            read_ahead: 每个文件最多预读的批次数
+            chunk_size: 每次解压读取的字节数
+        """
+        self.start = _to_datetime(start)
+        self.end = _to_datetime(end)
+        self.files = select_log_files(patterns, self.start, self.end)
+        self.max_workers = max_workers or os.cpu_count() or 4
+        self.read_ahead = max(1, read_ahead)
+        self.chunk_size = chunk_size
+        logger.info(f"选中 {len(self.files)} 个日志文件")
+
+    def _file_groups(self) -> Tuple[List[List[str]], List[str]]:
+        """
+        按文件名时间把时间范围重叠的文件分组
+
+        Returns:
+            (按时间排序、彼此不重叠的文件组, 识别不出时间的文件)
+        """
+        groups: List[List[str]] = []
+        unknown: List[str] = []
+        group_end = None
+        for path in self.files:
+            time_range = file_time_range(path)
+            if time_range is None:
+                unknown.append(path)
+                continue
+            file_start, file_end = time_range
+            if groups and file_start < group_end:
+                groups[-1].append(path)
+                group_end = max(group_end, file_end)
+            else:
+                groups.append([path])
+                group_end = file_end
+        return groups, unknown
+
+    def _open(self, paths: List[str], pool: ThreadPoolExecutor) -> List[_FileReader]:
+        readers = [_FileReader(path, pool, self.chunk_size, self.read_ahead) for path in paths]
+        for reader in readers:
+            reader.prefetch()
+        return readers
+
+    def _chain_groups(self, groups: List[List[str]], pool: ThreadPoolExecutor) -> Iterator[LogRecord]:
+        """依次读取各文件组：组内 k 路归并，组间直接衔接；读取当前组时预读下一组"""
+        upcoming = self._open(groups[0], pool) if groups else []
+        opened = upcoming
+        try:
+            for index in range(len(groups)):
+                current = upcoming
+                upcoming = self._open(groups[index + 1], pool) if index + 1 < len(groups) else []
+                opened = current + upcoming
+                if len(current) == 1:
+                    yield from current[0]
+                else:
+                    yield from heapq.merge(*current, key=_record_time)
+                for reader in current:
+                    reader.close()
+                opened = upcoming
+        finally:
+            for reader in opened:
+                reader.close()
+
+    def __iter__(self) -> Iterator[LogRecord]:
+        if not self.files:
+            return
+
+        start = self.start.strftime("%Y-%m-%d %H:%M:%S") if self.start else None
+        end = self.end.strftime("%Y-%m-%d %H:%M:%S") if self.end else None
+
+        with ThreadPoolExecutor(max_workers=self.max_workers,
+                                thread_name_prefix="log-source") as pool:
+            groups, unknown = self._file_groups()
+            chained = self._chain_groups(groups, pool)
+            readers = self._open(unknown, pool)
+            try:
+                # 各文件内部按时间有序，组内归并、组间衔接后再与时间未知的文件归并，得到全局时间序
+                records = heapq.merge(chained, *readers, key=_record_time) if readers else chained
+                for record in records:
+                    if start is not None or end is not None:
+                        timestamp = _record_time(record)
+                        if start is not None and timestamp < start:
+                            continue
+                        if end is not None and timestamp[:len(end)] > end:
+                            continue
+                    yield record
+            finally:
+                chained.close()
+                for reader in readers:
+                    reader.close()
+
+
+def read_log_files(patterns: Union[str, Sequence[str]], start: TimeLike = None,
+                   end: TimeLike = None, **kwargs) -> Iterable[LogRecord]:
+    """
+    按时间顺序读取多个日志文件
+
+    Args:
+        patterns: 通配符或通配符列表
+        start: 开始时间（可选）
+        end: 结束时间（可选）
+        **kwargs: 传给 LogFileSource 的其他参数
+
+    Returns:
+        LogRecord 迭代器
+    """
+    return iter(LogFileSource(patterns, start=start, end=end, **kwargs))
@@ -0,0 +1,397 @@
+"""
+SQL 指纹与聚合
+
+日志 context.query 中的 SQL 内联了字面量，同一条语句会因参数不同而各不相同。
+这里用单个正则扫描完成词法切分，将字符串、数字等字面量替换为占位符，
+折叠 IN 列表和多行 VALUES，统一关键字大小写与空白，得到稳定的归一化语句和指纹，
+再按指纹聚合出现次数、错误次数和耗时统计，生成 "最常出问题的语句" 表。
+"""
+
+import hashlib
+import re
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Mapping, Optional
+
+import numpy as np
+
+from duration_stats import DurationDigest, grouped_percentiles
+
+# 词法规则，按优先级排列；一次 finditer 完成切分。
+# 双引号默认按标准 SQL 视为带引号的标识符（"users"），MySQL 未开启 ANSI_QUOTES 时双引号括起的是字符串；
+# 带引号的限定名（[dbo].[users]、`db`.users）整体作为一个标识符
+_TOKEN_RULES = r"""
+    (?P<ws>\s+)
+    |(?P<comment>--[^\n]*|/\*.*?\*/|\#[^\n]*)
+    |(?P<string>'(?:[^'\\]|\\.|'')*'{double_quoted_string})
+    |(?P<quoted>(?:[A-Za-z_][\w$]*\.)*(?:`[^`]*`|\[[^\]]*\]{double_quoted_identifier})
+                (?:\.(?:`[^`]*`|\[[^\]]*\]{double_quoted_identifier}|[A-Za-z_*][\w$]*))*)
+    |(?P<number>0x[0-9a-fA-F]+|\d+(?:\.\d*)?(?:[eE][-+]?\d+)?|\.\d+(?:[eE][-+]?\d+)?)
+    |(?P<param>\?|%s|%\(\w+\)s|:\w+|\$\d+)
+    |(?P<word>[A-Za-z_][\w$]*(?:\.[A-Za-z_*][\w$]*)*)
+    |(?P<op><>|<=|>=|!=|\|\||::|[^\s\w])
+    """
+_DOUBLE_QUOTED = r'|"(?:[^"\\]|\\.|"")*"'
+_TOKEN_PATTERN = re.compile(
+    _TOKEN_RULES.format(double_quoted_string="", double_quoted_identifier=_DOUBLE_QUOTED),
+    re.VERBOSE | re.DOTALL,
+)
+_TOKEN_PATTERN_DOUBLE_QUOTED_STRINGS = re.compile(
+    _TOKEN_RULES.format(double_quoted_string=_DOUBLE_QUOTED, double_quoted_identifier=""),
+    re.VERBOSE | re.DOTALL,
+)
+
+# 限定名中的各段：`a`、[a]、"a" 或不带引号的名称
+_IDENTIFIER_PART_PATTERN = re.compile(r'`([^`]*)`|\[([^\]]*)\]|"((?:[^"\\]|\\.|"")*)"|([A-Za-z_*][\w$]*)')
+
+# 词法切分前的快速预处理：先把字符串和数字字面量替换为占位符，
+# 使仅字面量不同的语句共享同一个词法归一化缓存项
+_LITERAL_PATTERN = re.compile(
+    r"'(?:[^'\\]|\\.|'')*'|\b0x[0-9a-fA-F]+\b|(?<![\w$])\d+(?:\.\d+)?(?:[eE][-+]?\d+)?\b"
+)
+
+# 归一化后的占位符
+PLACEHOLDER = "?"
+
+# 常见 SQL 关键字，归一化时统一转为大写
+KEYWORDS = frozenset("""
+SELECT FROM WHERE AND OR NOT IN IS NULL LIKE BETWEEN EXISTS AS ON JOIN LEFT RIGHT INNER
+OUTER FULL CROSS GROUP BY ORDER HAVING LIMIT OFFSET UNION ALL DISTINCT INSERT INTO VALUES
+UPDATE SET DELETE REPLACE CREATE ALTER DROP TABLE INDEX VIEW CASE WHEN THEN ELSE END ASC
+DESC FOR WITH RETURNING DUPLICATE KEY TRUE FALSE COUNT SUM AVG MIN MAX LOCK SHARE MODE
+""".split())
+
+# 紧跟在这些关键字后的标识符视为表名
+_TABLE_KEYWORDS = frozenset({"FROM", "JOIN", "INTO", "UPDATE", "TABLE"})
+
+# 指纹长度（十六进制字符数）
+FINGERPRINT_LENGTH = 16
+
+
+def tokenize(sql: str, double_quoted_strings: bool = False) -> List[tuple]:
+    """
+    将 SQL 切分为 (类型, 文本) 词法单元，丢弃空白和注释
+
+    Args:
+        sql: 原始 SQL
+        double_quoted_strings: 双引号括起的内容是否为字符串（MySQL 未开启 ANSI_QUOTES 时为 True），
+            默认视为带引号的标识符
+
+    Returns:
+        词法单元列表
+    """
+    pattern = _TOKEN_PATTERN_DOUBLE_QUOTED_STRINGS if double_quoted_strings else _TOKEN_PATTERN
+    tokens = []
+    for match in pattern.finditer(sql):
+        kind = match.lastgroup
+        if kind == "ws" or kind == "comment":
+            continue
+        tokens.append((kind, match.group()))
+    return tokens
+
+
+def _unquote_identifier(text: str) -> str:
+    """
+    去掉标识符各段的引号并转为小写：[dbo].[users] -> dbo.users
+
+    Args:
+        text: quoted 类型的词法单元
+
+    Returns:
+        归一化后的标识符
+    """
+    return ".".join(next(group for group in match.groups() if group is not None)
+                    for match in _IDENTIFIER_PART_PATTERN.finditer(text)).lower()
+
+
+def _collapse_lists(parts: List[str]) -> List[str]:
+    """
+    折叠占位符列表：(?)、(?, ?, ?) -> (?+)，VALUES (?+), (?+) -> VALUES (?+)；
+    单个元素与多个元素的 IN 列表属于同一条语句，折叠为相同的形式
+    """
+    collapsed: List[str] = []
+    i = 0
+    while i < len(parts):
+        if parts[i] == "(" and i + 1 < len(parts) and parts[i + 1] == PLACEHOLDER:
+            j = i + 1
+            while j + 2 < len(parts) and parts[j + 1] == "," and parts[j + 2] == PLACEHOLDER:
+                j += 2
+            if j + 1 < len(parts) and parts[j + 1] == ")":
+                tuple_text = "(?+)"
+                # 多行 VALUES 只保留一组
+                if (len(collapsed) >= 2 and collapsed[-1] == ","
+                        and collapsed[-2] == tuple_text):
+                    collapsed.pop()
+                else:
+                    collapsed.append(tuple_text)
+                i = j + 2
+                continue
+        collapsed.append(parts[i])
+        i += 1
+    return collapsed
+
+
+def normalize_sql(sql: str, double_quoted_strings: bool = False) -> str:
+    """
+    归一化 SQL：字面量替换为占位符、折叠列表、关键字大写、标识符小写、压缩空白
+
+    Args:
+        sql: 原始 SQL
+        double_quoted_strings: 双引号括起的内容是否为字符串（见 tokenize）
+
+    Returns:
+        归一化后的 SQL
+    """
+    return _normalize_tokens(_LITERAL_PATTERN.sub(PLACEHOLDER, sql), double_quoted_strings)
+
+
+@lru_cache(maxsize=65536)
+def _normalize_tokens(sql: str, double_quoted_strings: bool = False) -> str:
+    """对已替换字面量的 SQL 做词法级归一化"""
+    parts: List[str] = []
+    for kind, text in tokenize(sql, double_quoted_strings):
+        if kind in ("string", "number", "param"):
+            # 负数字面量：把前面作为一元负号的 "-" 一并替换
+            if parts and parts[-1] == "-" and (
+                    len(parts) == 1 or parts[-2] in ("(", ",", "=", "<", ">", "<=", ">=", "<>", "!=")
+                    or parts[-2] in KEYWORDS):
+                parts.pop()
+            parts.append(PLACEHOLDER)
+        elif kind == "word":
+            upper = text.upper()
+            parts.append(upper if upper in KEYWORDS else text.lower())
+        elif kind == "quoted":
+            parts.append(_unquote_identifier(text))
+        else:
+            parts.append(text)
+
+    parts = _collapse_lists(parts)
+    text = " ".join(parts)
+    # 去掉括号、逗号周围多余的空格
+    return (text.replace("( ", "(").replace(" )", ")").replace(" ,", ",")
+            .replace(" ;", ";").rstrip(";").strip())
+
+
+def fingerprint(sql: str, double_quoted_strings: bool = False) -> str:
+    """
+    计算 SQL 指纹
+
+    Args:
+        sql: 原始 SQL
+        double_quoted_strings: 双引号括起的内容是否为字符串（见 tokenize）
+
+    Returns:
+        归一化语句的 SHA1 前缀
+    """
+    normalized = normalize_sql(sql, double_quoted_strings)
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()[:FINGERPRINT_LENGTH]
+
+
+@lru_cache(maxsize=65536)
+def extract_tables(sql: str, double_quoted_strings: bool = False) -> tuple:
+    """
+    提取 SQL 中引用的表名
+
+    Args:
+        sql: 原始 SQL
+        double_quoted_strings: 双引号括起的内容是否为字符串（见 tokenize）
+
+    Returns:
+        表名元组（去重并保持出现顺序）
+    """
+    tables = []
+    previous = None
+    for kind, text in tokenize(sql, double_quoted_strings):
+        if previous in _TABLE_KEYWORDS and kind in ("word", "quoted"):
+            # 带引号的名称即使与关键字同名（`order`）也是表名
+            name = _unquote_identifier(text) if kind == "quoted" else text.lower()
+            if (kind == "quoted" or name.upper() not in KEYWORDS) and name not in tables:
+                tables.append(name)
+        previous = text.upper() if kind == "word" else None
+    return tuple(tables)
+
+
+def _sql_context(log: Mapping[str, Any]) -> Optional[Mapping[str, Any]]:
+    """带非空 context.query 的日志返回其 context，否则返回 None"""
+    context = log.get("context")
+    if not isinstance(context, Mapping):
+        return None
+    query = context.get("query")
+    if not isinstance(query, str) or not query.strip():
+        return None
+    return context
+
+
+def _count_statement(groups: Dict[str, Dict[str, Any]], log: Mapping[str, Any], query: str,
+                     double_quoted_strings: bool) -> Dict[str, Any]:
+    """把一条日志计入所属指纹分组，返回该分组"""
+    normalized = normalize_sql(query, double_quoted_strings)
+    group = groups.get(normalized)
+    if group is None:
+        group = groups[normalized] = {
+            "index": len(groups),
+            "fingerprint": hashlib.sha1(normalized.encode("utf-8")).hexdigest()[:FINGERPRINT_LENGTH],
+            "statement": normalized,
+            "sample": query,
+            "tables": list(extract_tables(query, double_quoted_strings)),
+            "count": 0,
+            "error_count": 0,
+            "services": set(),
+        }
+    group["count"] += 1
+    if (log.get("level") or "").upper() == "ERROR":
+        group["error_count"] += 1
+    if log.get("service"):
+        group["services"].add(log.get("service"))
+    return group
+
+
+def _duration_of(context: Mapping[str, Any]) -> Optional[float]:
+    duration = context.get("duration_ms")
+    if isinstance(duration, (int, float)) and not isinstance(duration, bool):
+        return float(duration)
+    return None
+
+
+def _finish_groups(groups: Dict[str, Dict[str, Any]],
+                   duration_stats: Dict[int, Dict[str, float]]) -> List[Dict[str, Any]]:
+    """生成结果列表，按错误次数、p95、次数降序"""
+    result = []
+    for group in groups.values():
+        item = {key: value for key, value in group.items() if key != "index"}
+        item["services"] = sorted(group["services"])
+        item["duration"] = duration_stats.get(group["index"])
+        result.append(item)
+
+    result.sort(key=lambda item: (
+        item["error_count"],
+        item["duration"]["p95"] if item["duration"] else 0.0,
+        item["count"],
+    ), reverse=True)
+    return result
+
+
+def aggregate_sql(logs: Iterable[Mapping[str, Any]], double_quoted_strings: bool = False) -> List[Dict[str, Any]]:
+    """
+    按 SQL 指纹聚合日志
+
+    Args:
+        logs: 日志列表或迭代器（dict 或 LogRecord）
+        double_quoted_strings: 双引号括起的内容是否为字符串（见 tokenize）
+
+    Returns:
+        每个指纹一项：fingerprint、statement、sample、tables、count、error_count、
+        duration（count/mean/p50/p95/p99/max），按错误次数和 p95 降序
+    """
+    groups: Dict[str, Dict[str, Any]] = {}
+    codes: List[int] = []
+    durations: List[float] = []
+
+    for log in logs:
+        context = _sql_context(log)
+        if context is None:
+            continue
+        group = _count_statement(groups, log, context["query"], double_quoted_strings)
+        duration = _duration_of(context)
+        if duration is not None:
+            codes.append(group["index"])
+            durations.append(duration)
+
+    duration_stats: Dict[int, Dict[str, float]] = {}
+    if durations:
+        code_array = np.asarray(codes, dtype=np.int64)
+        duration_array = np.asarray(durations, dtype=np.float64)
+        stats = grouped_percentiles(code_array, duration_array)
+        maxima = np.full(len(groups), -np.inf)
+        np.maximum.at(maxima, code_array, duration_array)
+        for i, index in enumerate(stats["group"]):
+            duration_stats[int(index)] = {
+                "count": int(stats["count"][i]),
+                "mean": round(float(stats["mean"][i]), 1),
+                "p50": round(float(stats["p50"][i]), 1),
+                "p95": round(float(stats["p95"][i]), 1),
+                "p99": round(float(stats["p99"][i]), 1),
+                "max": round(float(maxima[index]), 1),
+            }
+
+    return _finish_groups(groups, duration_stats)
+
+
+class SqlAggregator:
+    """
+    流式版本的 aggregate_sql：逐条 add 日志，每个指纹只保留计数和一个 DurationDigest，
+    内存与日志条数无关；result() 的结构与 aggregate_sql 相同，分位数为近似值
+    """
+
+    def __init__(self, double_quoted_strings: bool = False):
+        """
+        Args:
+            double_quoted_strings: 双引号括起的内容是否为字符串（见 tokenize）
+        """
+        self.double_quoted_strings = double_quoted_strings
+        self._groups: Dict[str, Dict[str, Any]] = {}
+        self._digests: Dict[int, DurationDigest] = {}
+
+    def add(self, log: Mapping[str, Any]) -> None:
+        """累积一条日志，没有 context.query 的日志被忽略"""
+        context = _sql_context(log)
+        if context is None:
+            return
+        group = _count_statement(self._groups, log, context["query"], self.double_quoted_strings)
+        duration = _duration_of(context)
+        if duration is not None:
+            digest = self._digests.get(group["index"])
+            if digest is None:
+                digest = self._digests[group["index"]] = DurationDigest()
+            digest.add(duration)
+
+    def result(self) -> List[Dict[str, Any]]:
+        """返回与 aggregate_sql 结构相同的聚合结果"""
+        duration_stats = {
+            index: {
+                "count": digest.count,
+                "mean": round(digest.mean, 1),
+                "p50": round(digest.percentile(50), 1),
+                "p95": round(digest.percentile(95), 1),
+                "p99": round(digest.percentile(99), 1),
+                "max": round(digest.max, 1),
+            }
+            for index, digest in self._digests.items()
+        }
+        return _finish_groups(self._groups, duration_stats)
+
+
+def format_top_statements(statements: List[Dict[str, Any]], top_n: int = 10,
+                          max_statement_chars: Optional[int] = 200) -> str:
+    """
+    格式化 "最常出问题的语句" 表
+
+    Args:
+        statements: aggregate_sql 的返回值
+        top_n: 最多列出的语句数
+        max_statement_chars: 语句最大显示长度（可选）
+
+    Returns:
+        表格文本
+    """
+    if not statements:
+        return "无 SQL 数据"
+
+    lines = ["指纹|次数|错误|p50ms|p95ms|maxms|表|语句"]
+    for item in statements[:top_n]:
+        statement = item["statement"]
+        if max_statement_chars and len(statement) > max_statement_chars:
+            statement = statement[:max_statement_chars] + "..."
+        duration = item["duration"] or {}
+        lines.append("|".join(str(value) for value in (
+            item["fingerprint"],
+            item["count"],
+            item["error_count"],
+            duration.get("p50", ""),
+            duration.get("p95", ""),
+            duration.get("max", ""),
+            ",".join(item["tables"]),
+            statement,
+        )))
+    if len(statements) > top_n:
+        lines.append(f"... 其余 {len(statements) - top_n} 条语句省略")
+    return "\n".join(lines)